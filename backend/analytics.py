@@ -0,0 +1,203 @@
+"""Buffered product events and time-decayed trending scores.
+
+``POST /api/events`` only records each view or add-to-cart in an in-memory
+``EventBuffer``, keyed by product, so tracking adds no Mongo write to the
+request path. ``TrendingAggregator`` drains the buffer every few seconds and
+writes it in two unordered bulk writes:
+
+* ``$inc`` of each product's ``trending_score``
+* ``$inc`` of hourly per-product rollups in ``product_event_counts``
+
+``trending_score`` uses forward decay. An event at time ``t`` adds
+``weight * 2 ** ((t - landmark) / half_life)``, so older events never have
+to be rewritten. Ranking by the stored score matches ranking by the decayed
+score, and the decayed value is ``score * 2 ** (-(now - landmark) / half_life)``.
+Before the multiplier grows large, the landmark moves forward and every
+stored score is scaled down with one ``$mul``. The landmark lives in the
+``trending_state`` collection. A conditional update picks the one worker
+that rescales.
+
+With ``auto_viral`` set, each flush marks the top trending products
+``is_viral`` and clears the flag on the rest. ``on_catalog_change`` is
+awaited with the ids whose flag changed.
+
+A flush that fails loses that window's events. That is an acceptable price
+for analytics data, and the request path stays write-free.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from pymongo import ReturnDocument, UpdateOne
+
+from pagination import SORT_SPECS
+
+logger = logging.getLogger(__name__)
+
+EVENT_WEIGHTS = {
+    "view": 1.0,
+    "add_to_cart": 5.0,
+}
+# Rollup field per event type
+ROLLUP_FIELDS = {
+    "view": "views",
+    "add_to_cart": "add_to_carts",
+}
+
+# Move the landmark once scores carry a 2**16 multiplier
+REBASE_AFTER_HALF_LIVES = 16
+
+
+class EventBuffer:
+    """Per-product event counts waiting for the next flush, capped at ``max_products`` distinct products."""
+
+    def __init__(self, max_products):
+        self.max_products = max_products
+        self._counts = {}  # product id -> Counter of event types
+        self.accepted = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._counts)
+
+    def add(self, product_id, event_type, count=1):
+        """Count an event; returns False (and drops it) when the buffer is full of other products."""
+        counts = self._counts.get(product_id)
+        if counts is None:
+            if len(self._counts) >= self.max_products:
+                self.dropped += count
+                return False
+            counts = self._counts[product_id] = Counter()
+        counts[event_type] += count
+        self.accepted += count
+        return True
+
+    def drain(self):
+        counts, self._counts = self._counts, {}
+        return counts
+
+
+class TrendingAggregator:
+    def __init__(self, db, buffer, half_life_seconds, auto_viral=False, viral_top_n=10, viral_min_score=0.0,
+                 on_catalog_change=None):
+        self.db = db
+        self.buffer = buffer
+        self.half_life = half_life_seconds
+        self.auto_viral = auto_viral
+        self.viral_top_n = viral_top_n
+        self.viral_min_score = viral_min_score
+        self.on_catalog_change = on_catalog_change
+        self._landmark = None  # epoch seconds
+        self._lock = asyncio.Lock()
+        self.flushes = 0
+        self.flushed_events = 0
+        self.failed_events = 0
+
+    def growth(self, now, landmark=None):
+        """Forward-decay multiplier for an event at ``now``."""
+        return 2 ** ((now - (self._landmark if landmark is None else landmark)) / self.half_life)
+
+    async def _load_landmark(self, now):
+        state = await self.db.trending_state.find_one_and_update(
+            {"_id": "landmark"},
+            {"$setOnInsert": {"at": now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._landmark = state["at"]
+
+    async def _rebase(self, now):
+        """Move the landmark to ``now`` and scale every stored score to match."""
+        old = self._landmark
+        moved = await self.db.trending_state.find_one_and_update(
+            {"_id": "landmark", "at": old}, {"$set": {"at": now}}
+        )
+        if moved is not None:
+            factor = 1 / self.growth(now, old)
+            await self.db.products.update_many({"trending_score": {"$gt": 0}}, {"$mul": {"trending_score": factor}})
+            logger.info(f"Moved the trending landmark forward {now - old:.0f}s")
+        # Another worker may have won; either way read back the current landmark
+        await self._load_landmark(now)
+
+    async def backfill(self):
+        """Give products written before trending scores existed a zero score, so they sort and page normally."""
+        result = await self.db.products.update_many({"trending_score": None}, {"$set": {"trending_score": 0.0}})
+        if result.modified_count:
+            logger.info(f"Initialised trending scores on {result.modified_count} products")
+
+    async def flush(self):
+        async with self._lock:
+            counts = self.buffer.drain()
+            now = time.time()
+            try:
+                if self._landmark is None:
+                    await self._load_landmark(now)
+                if now - self._landmark > REBASE_AFTER_HALF_LIVES * self.half_life:
+                    await self._rebase(now)
+                if counts:
+                    await self._write(counts, now)
+                if self.auto_viral:
+                    await self._update_viral(now)
+            except Exception:
+                self.failed_events += sum(sum(product_counts.values()) for product_counts in counts.values())
+                raise
+
+    async def _write(self, counts, now):
+        # Unknown or deleted ids are dropped here rather than validated on the request path
+        known = set(await self.db.products.distinct("id", {"id": {"$in": list(counts)}, "deleted_at": None}))
+        growth = self.growth(now)
+        hour = datetime.fromtimestamp(now - now % 3600, timezone.utc)
+        score_updates, rollups = [], []
+        for product_id in known:
+            product_counts = counts[product_id]
+            weight = sum(EVENT_WEIGHTS[event_type] * count for event_type, count in product_counts.items())
+            score_updates.append(UpdateOne({"id": product_id}, {"$inc": {"trending_score": weight * growth}}))
+            rollups.append(UpdateOne(
+                {"product_id": product_id, "hour": hour},
+                {"$inc": {ROLLUP_FIELDS[event_type]: count for event_type, count in product_counts.items()}},
+                upsert=True,
+            ))
+        if score_updates:
+            await self.db.products.bulk_write(score_updates, ordered=False)
+            await self.db.product_event_counts.bulk_write(rollups, ordered=False)
+        self.flushes += 1
+        self.flushed_events += sum(sum(counts[product_id].values()) for product_id in known)
+
+    async def _update_viral(self, now):
+        """Flag the top trending products whose decayed score reaches ``viral_min_score``."""
+        threshold = self.viral_min_score * self.growth(now)
+        top = await self.db.products.find(
+            {"trending_score": {"$gte": max(threshold, 1e-9)}, "deleted_at": None}, {"_id": 0, "id": 1}
+        ).sort(SORT_SPECS["trending"]).limit(self.viral_top_n).to_list(length=None)
+        viral_ids = {product["id"] for product in top}
+        flagged = set(await self.db.products.distinct("id", {"is_viral": True}))
+        if viral_ids == flagged:
+            return
+        await self.db.products.update_many(
+            {"id": {"$in": list(viral_ids - flagged)}}, {"$set": {"is_viral": True}})
+        await self.db.products.update_many(
+            {"id": {"$in": list(flagged - viral_ids)}}, {"$set": {"is_viral": False}})
+        if self.on_catalog_change:
+            await self.on_catalog_change(sorted(viral_ids ^ flagged))
+
+    async def run(self, interval_seconds):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Product event flush failed")
+
+    def stats(self):
+        return {
+            "buffered_products": len(self.buffer),
+            "accepted": self.buffer.accepted,
+            "dropped": self.buffer.dropped,
+            "flushes": self.flushes,
+            "flushed_events": self.flushed_events,
+            "failed_events": self.failed_events,
+        }
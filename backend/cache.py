@@ -0,0 +1,76 @@
+"""Bounded in-process cache for catalog reads.
+
+Entries are evicted least-recently-used once ``max_entries`` is reached and
+expire after ``ttl`` seconds. Every product write bumps the catalog version,
+which drops all entries at once so no reader sees a listing older than the
+write that changed it.
+"""
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class CatalogCache:
+    def __init__(self, max_entries=1024, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached value for ``key``, or ``MISSING``."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, version=None):
+        """Store ``value`` under ``key``.
+
+        Pass the ``version`` read before loading ``value``; if a write bumped
+        the catalog in the meantime the value may be stale and is not stored.
+        """
+        if version is not None and version != self.version:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def bump(self):
+        """Advance the catalog version and drop every cached entry."""
+        self.version += 1
+        self._entries.clear()
+        return self.version
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "version": self.version,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
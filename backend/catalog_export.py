@@ -0,0 +1,57 @@
+"""Streaming catalog export as a JSON array or NDJSON.
+
+Documents are encoded straight from the Motor cursor, with no ``Product``
+validation in between, and sent in chunks of about ``CHUNK_SIZE`` bytes.
+Memory stays flat however many products match, and the first bytes leave as
+soon as the first cursor batch arrives.
+"""
+import json
+from datetime import datetime
+
+CHUNK_SIZE = 64 * 1024
+CURSOR_BATCH_SIZE = 1000
+
+# Feed-sync bookkeeping isn't part of the public product shape
+EXPORT_PROJECTION = {"_id": 0, "sync_hash": 0, "sync_field_hashes": 0}
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot export value of type {type(value).__name__}")
+
+
+def encode_product(document):
+    return json.dumps(document, default=_encode_value, separators=(",", ":"))
+
+
+async def _chunked(pieces):
+    buffered, size = [], 0
+    async for piece in pieces:
+        buffered.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffered).encode()
+            buffered, size = [], 0
+    if buffered:
+        yield "".join(buffered).encode()
+
+
+async def _json_array_pieces(cursor):
+    yield "["
+    separator = ""
+    async for document in cursor:
+        yield separator + encode_product(document)
+        separator = ","
+    yield "]"
+
+
+async def _ndjson_pieces(cursor):
+    async for document in cursor:
+        yield encode_product(document) + "\n"
+
+
+def stream_products(cursor, export_format):
+    """Byte chunks of every document from ``cursor`` as a JSON array or NDJSON lines."""
+    pieces = _ndjson_pieces(cursor) if export_format == "ndjson" else _json_array_pieces(cursor)
+    return _chunked(pieces)
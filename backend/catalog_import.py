@@ -0,0 +1,244 @@
+"""Streaming bulk import of supplier catalog feeds (NDJSON or CSV).
+
+The feed is consumed as a stream of byte chunks and never held in memory as a
+whole. Rows are validated against ``ProductCreate`` and written in chunks
+with unordered ``insert_many``, so one bad row doesn't stop the rest of its
+batch. The report lists per-row errors by line (NDJSON) or record (CSV)
+number.
+
+CSV feeds have a header row with ``ProductCreate`` field names. List fields
+(skin_types, ingredients, tags, images, benefits) are ``|``-separated and
+boolean fields accept true/false, yes/no or 1/0.
+
+Also usable from the command line against the database in ``.env``:
+
+    python catalog_import.py supplier-feed.csv --chunk-size 2000
+
+A CLI import writes straight to Mongo and records each chunk in the catalog
+change log. Running API workers follow that log, so they add the new
+products to their caches and indexes within ``CATALOG_CHANGES_FOLLOW_SECONDS``.
+"""
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from changelog import ChangeLog
+from models import ImportReport, ImportRowError, ProductCreate, StoredProduct
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+READ_SIZE = 64 * 1024
+
+LIST_FIELDS = ("skin_types", "ingredients", "tags", "images", "benefits")
+BOOL_FIELDS = ("is_featured", "is_new", "is_viral")
+TRUE_VALUES = {"true", "yes", "1", "y", "t"}
+
+class FeedRowError(ValueError):
+    pass
+
+
+async def iter_lines(byte_chunks):
+    """Decode an async iterable of byte chunks into text lines, without line endings."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in byte_chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_ndjson_rows(lines):
+    """Yield ``(line_number, row)`` pairs; ``row`` is a ``FeedRowError`` for unparseable lines."""
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, FeedRowError(f"Invalid JSON: {e.msg}")
+            continue
+        if not isinstance(row, dict):
+            yield line_number, FeedRowError("Expected a JSON object")
+            continue
+        yield line_number, row
+
+
+def csv_record_to_row(header, values):
+    if len(values) != len(header):
+        raise FeedRowError(f"Expected {len(header)} columns, got {len(values)}")
+    row = {}
+    for field, value in zip(header, values):
+        value = value.strip()
+        if field in LIST_FIELDS:
+            row[field] = [item.strip() for item in value.split("|") if item.strip()]
+        elif value == "":
+            # Empty cells fall back to the model default (or fail if required)
+            continue
+        elif field in BOOL_FIELDS:
+            row[field] = value.lower() in TRUE_VALUES
+        else:
+            row[field] = value
+    return row
+
+
+async def iter_csv_rows(lines):
+    """Yield ``(record_number, row)`` pairs from CSV lines, header first.
+
+    Physical lines are joined while a quoted field is still open, so cells may
+    contain newlines.
+    """
+    header = None
+    record_number = 0
+    buffered = []
+    async for line in lines:
+        buffered.append(line)
+        record = "\n".join(buffered)
+        if record.count('"') % 2:
+            continue
+        buffered = []
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        record_number += 1
+        try:
+            yield record_number, csv_record_to_row(header, values)
+        except FeedRowError as e:
+            yield record_number, e
+    if buffered:
+        yield record_number + 1, FeedRowError("Unterminated quoted field at end of feed")
+
+
+def record_error(report, row_number, message):
+    """Count a failed row on ``report``, keeping at most ``MAX_REPORTED_ERRORS`` messages."""
+    report.failed += 1
+    if len(report.errors) < MAX_REPORTED_ERRORS:
+        report.errors.append(ImportRowError(row=row_number, error=message))
+    else:
+        report.errors_truncated = True
+
+
+def format_validation_error(error):
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc'])}: {detail['msg']}"
+        for detail in error.errors()
+    )
+
+
+async def import_products(collection, rows, chunk_size=DEFAULT_CHUNK_SIZE, on_inserted=None):
+    """Validate and insert rows from an async iterable of ``(row_number, row)`` pairs.
+
+    ``on_inserted`` is awaited with the documents written by each chunk so the
+    caller can update in-process indexes and caches.
+    """
+    report = ImportReport()
+    started = time.perf_counter()
+
+    async def flush(batch):
+        documents = [document for _, document in batch]
+        failed_indexes = set()
+        try:
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed_indexes.add(write_error["index"])
+                record_error(report, batch[write_error["index"]][0], write_error.get("errmsg", "Write failed"))
+        inserted = [document for index, document in enumerate(documents) if index not in failed_indexes]
+        report.inserted += len(inserted)
+        if inserted and on_inserted:
+            await on_inserted(inserted)
+
+    batch = []
+    async for row_number, row in rows:
+        report.rows += 1
+        if isinstance(row, FeedRowError):
+            record_error(report, row_number, str(row))
+            continue
+        try:
+            product = StoredProduct(**ProductCreate(**row).dict())
+        except ValidationError as e:
+            record_error(report, row_number, format_validation_error(e))
+            continue
+        batch.append((row_number, product.dict()))
+        if len(batch) >= chunk_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    report.elapsed_seconds = round(time.perf_counter() - started, 3)
+    report.rows_per_second = round(report.rows / report.elapsed_seconds, 1) if report.elapsed_seconds else 0.0
+    return report
+
+
+def feed_rows(feed_format, byte_chunks):
+    lines = iter_lines(byte_chunks)
+    if feed_format == "csv":
+        return iter_csv_rows(lines)
+    return iter_ndjson_rows(lines)
+
+
+async def read_file_chunks(path):
+    with open(path, "rb") as feed:
+        while chunk := feed.read(READ_SIZE):
+            yield chunk
+
+
+async def run(path, feed_format, chunk_size):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        db = client[os.environ['DB_NAME']]
+        # Running servers follow the change log to pick up the new products
+        changelog = ChangeLog(db, retention_seconds=0)
+
+        async def on_inserted(documents):
+            try:
+                await changelog.record([document["id"] for document in documents])
+            except Exception:
+                # The rows are in; servers pick them up on their next full resync
+                logger.exception("Failed to record catalog changes")
+
+        rows = feed_rows(feed_format, read_file_chunks(path))
+        return await import_products(db.products, rows, chunk_size, on_inserted=on_inserted)
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import products from an NDJSON or CSV feed")
+    parser.add_argument("path", help="feed file")
+    parser.add_argument("--format", choices=("ndjson", "csv"), help="feed format (default: from the file extension)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per insert_many batch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    feed_format = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    report = asyncio.run(run(args.path, feed_format, args.chunk_size))
+    print(json.dumps(report.dict(), indent=2))
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,441 @@
+"""Versioned, memory-mapped catalog snapshot shared by every worker on a box.
+
+A single builder process (``python catalog_snapshot.py``) reads the live
+catalog once and writes one binary file:
+
+* the fields ``get_products`` filters and sorts on, as NumPy columns
+  (category and skin-type codes, price, flags, rating, ``created_at`` in
+  microseconds, trending score, fixed-width ids)
+* one precomputed row order per ``pagination.SORT_SPECS`` sort
+* every product pre-serialized twice, as ``Product`` and as
+  ``ProductSummary`` JSON, in two blob regions with row offsets
+
+The file is an 8-byte magic, a length-prefixed JSON header (catalog version,
+row count, content digest, and where each array lives), then the arrays,
+64-byte aligned. It is written to a temporary file and moved into place with
+``os.replace``, so readers see either the old snapshot or the new one.
+
+Workers ``mmap`` the file read-only and wrap the arrays with
+``np.frombuffer``. The OS page cache holds one copy for all workers, and
+opening a snapshot reads only the header. ``SnapshotReader.current()`` stats
+the path at most once per ``check_interval``. When the file has been
+replaced, it maps the new one. The old mapping goes
+away when the last request using it finishes.
+
+A listing is a boolean mask over the filter columns, walked in the sort's
+precomputed order, and the page body is a join of the stored JSON. No Mongo
+round trip is involved, so a freshly started worker serves listings as soon
+as the file is there. Writes show up once the builder has rebuilt.
+``--watch`` polls the change log version and rebuilds when it moves, and
+``--refresh`` rebuilds at least that often for stock and trending scores,
+which aren't logged.
+
+Build once, or keep the file current:
+
+    python catalog_snapshot.py /var/lib/shop/catalog.snap
+    python catalog_snapshot.py /var/lib/shop/catalog.snap --watch 2 --refresh 60
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+
+from changelog import ChangeLog
+from models import Category, Product, ProductSummary, SkinType
+from pagination import SORT_SPECS, InvalidCursor
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CATSNAP1"
+FORMAT = 1
+ALIGNMENT = 64
+FIRST_SCAN_ROWS = 1024
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+# Snapshot column -> its dtype; sort keys read the column of the same name
+COLUMNS = {
+    "category": np.uint8,
+    "skin_types": np.uint32,  # bit i set for SkinType number i
+    "price": np.float64,
+    "is_featured": np.bool_,
+    "is_new": np.bool_,
+    "rating": np.float64,
+    "created_at": np.int64,  # microseconds since the epoch, UTC
+    "trending_score": np.float64,
+}
+
+
+class InvalidSnapshot(Exception):
+    pass
+
+
+def _microseconds(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+def _padding(position):
+    return -position % ALIGNMENT
+
+
+# Building
+
+def _sort_orders(columns, ids):
+    """Row order for every listing sort, ties broken the way Mongo breaks them."""
+    id_rank = np.empty(len(ids), dtype=np.int64)
+    id_rank[np.argsort(ids, kind="stable")] = np.arange(len(ids))
+    orders = {}
+    for sort, spec in SORT_SPECS.items():
+        keys = []
+        for field, direction in spec:
+            key = id_rank if field == "id" else columns[field].astype(np.float64)
+            keys.append(key if direction == ASCENDING else -key)
+        # lexsort takes its primary key last
+        orders[sort] = np.lexsort(keys[::-1]).astype(np.int32)
+    return orders
+
+
+def _blob_region(blobs):
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+    return offsets, b"".join(blobs)
+
+
+def encode_snapshot(products, version):
+    """Header and arrays for a list of ``Product`` models (in the order they'll be stored)."""
+    categories = [category.value for category in Category]
+    skin_types = [skin_type.value for skin_type in SkinType]
+    category_codes = {value: code for code, value in enumerate(categories)}
+    skin_type_bits = {value: 1 << bit for bit, value in enumerate(skin_types)}
+
+    values = {
+        "category": [category_codes[product.category.value] for product in products],
+        "skin_types": [sum(skin_type_bits[skin_type.value] for skin_type in set(product.skin_types))
+                       for product in products],
+        "created_at": [_microseconds(product.created_at) for product in products],
+    }
+    for name in COLUMNS.keys() - values.keys():
+        values[name] = [getattr(product, name) for product in products]
+    columns = {name: np.array(values[name], dtype=dtype) for name, dtype in COLUMNS.items()}
+    ids = np.array([product.id.encode() for product in products] or [b""], dtype=bytes)[:len(products)]
+    full = [product.model_dump_json().encode() for product in products]
+    summary = [ProductSummary(**product.dict()).model_dump_json().encode() for product in products]
+
+    arrays = {f"column:{name}": column for name, column in columns.items()}
+    arrays["id"] = ids
+    arrays.update((f"order:{sort}", order) for sort, order in _sort_orders(columns, ids).items())
+    for kind, blobs in (("full", full), ("summary", summary)):
+        offsets, data = _blob_region(blobs)
+        arrays[f"{kind}_offsets"] = offsets
+        arrays[f"{kind}_json"] = np.frombuffer(data, dtype=np.uint8)
+    header = {
+        "format": FORMAT,
+        "version": version,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "count": len(products),
+        "categories": categories,
+        "skin_types": skin_types,
+    }
+    return header, arrays
+
+
+def write_snapshot(path, header, arrays):
+    """Write the snapshot next to ``path`` and move it into place atomically; returns its digest."""
+    layout, position = {}, 0
+    for name, array in arrays.items():
+        position += _padding(position)
+        layout[name] = [array.dtype.str, position, len(array)]
+        position += array.nbytes
+    # The digest is hex of a fixed size, so a placeholder gives the final header length
+    header = {**header, "digest": "0" * 32, "arrays": layout}
+    header_size = len(json.dumps(header).encode())
+    data_start = len(MAGIC) + 4 + header_size
+    data_start += _padding(data_start)
+
+    path = Path(path)
+    temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(temporary, "wb") as snapshot_file:
+            snapshot_file.seek(data_start)
+            written = 0
+            for name, array in arrays.items():
+                padding = b"\0" * (layout[name][1] - written)
+                data = array.tobytes()
+                snapshot_file.write(padding)
+                snapshot_file.write(data)
+                digest.update(data)
+                written = layout[name][1] + len(data)
+            header["digest"] = digest.hexdigest()
+            encoded = json.dumps(header).encode()
+            snapshot_file.seek(0)
+            snapshot_file.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+    return header["digest"]
+
+
+async def build_snapshot(db, changelog, path):
+    """Snapshot every live product to ``path``; returns the header written."""
+    started = time.perf_counter()
+    # Read before the products, so replaying changes from this version can't miss any
+    version = await changelog.version()
+    products = [Product(**document) async for document in db.products.find({"deleted_at": None}, {"_id": 0})]
+    header, arrays = await asyncio.get_running_loop().run_in_executor(None, encode_snapshot, products, version)
+    header["digest"] = await asyncio.get_running_loop().run_in_executor(None, write_snapshot, path, header, arrays)
+    logger.info(f"Wrote catalog snapshot v{version} ({len(products)} products) to {path} "
+                f"in {time.perf_counter() - started:.2f}s")
+    return header
+
+
+# Reading
+
+class CatalogSnapshot:
+    """One mapped snapshot file. Arrays are read-only views into the mapping."""
+
+    def __init__(self, path):
+        with open(path, "rb") as snapshot_file:
+            stat = os.fstat(snapshot_file.fileno())
+            try:
+                self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:  # empty file
+                raise InvalidSnapshot(str(e))
+        self.identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise InvalidSnapshot(f"{path} is not a catalog snapshot")
+        (header_size,) = struct.unpack_from("<I", self._map, len(MAGIC))
+        try:
+            header = json.loads(self._map[len(MAGIC) + 4:len(MAGIC) + 4 + header_size])
+        except ValueError:
+            raise InvalidSnapshot(f"{path} has a corrupt header")
+        if header.get("format") != FORMAT:
+            raise InvalidSnapshot(f"{path} has snapshot format {header.get('format')}, expected {FORMAT}")
+        data_start = len(MAGIC) + 4 + header_size
+        data_start += _padding(data_start)
+
+        self.version = header["version"]
+        self.digest = header["digest"]
+        self.built_at = header["built_at"]
+        self.count = header["count"]
+        self._category_codes = {value: code for code, value in enumerate(header["categories"])}
+        self._skin_type_bits = {value: 1 << bit for bit, value in enumerate(header["skin_types"])}
+        self._view = memoryview(self._map)
+        arrays = {}
+        try:
+            for name, (dtype, offset, length) in header["arrays"].items():
+                arrays[name] = np.frombuffer(self._map, dtype=np.dtype(dtype), count=length, offset=data_start + offset)
+        except ValueError as e:
+            raise InvalidSnapshot(f"{path} is truncated: {e}")
+        self._columns = {name: arrays[f"column:{name}"] for name in COLUMNS}
+        self._columns["id"] = arrays["id"]
+        self._orders = {name.split(":", 1)[1]: array for name, array in arrays.items() if name.startswith("order:")}
+        self._blobs = {kind: (arrays[f"{kind}_offsets"], data_start + header["arrays"][f"{kind}_json"][1])
+                       for kind in ("full", "summary")}
+
+    def has_sort(self, sort):
+        return sort in self._orders
+
+    def _filter(self, category, skin_type, featured, new, min_price, max_price):
+        columns = self._columns
+        mask = np.ones(self.count, dtype=bool)
+        if category:
+            mask &= columns["category"] == self._category_codes.get(getattr(category, "value", category), -1)
+        if skin_type:
+            mask &= (columns["skin_types"] & self._skin_type_bits.get(getattr(skin_type, "value", skin_type), 0)) != 0
+        if featured is not None:
+            mask &= columns["is_featured"] == featured
+        if new is not None:
+            mask &= columns["is_new"] == new
+        if min_price is not None:
+            mask &= columns["price"] >= min_price
+        if max_price is not None:
+            mask &= columns["price"] <= max_price
+        return mask
+
+    def _sort_key(self, field, value):
+        """A cursor value in its column's representation."""
+        if value is None and field != "id":
+            # Mongo sorts a missing key below every value; the snapshot's columns have none
+            return -np.inf
+        if field == "id":
+            return str(value).encode()
+        if field == "created_at":
+            if isinstance(value, str):
+                # Issued by the Mongo path while created_at still held ISO strings
+                try:
+                    value = datetime.fromisoformat(value)
+                except ValueError:
+                    raise InvalidCursor("Malformed cursor")
+            if not isinstance(value, datetime):
+                raise InvalidCursor("Malformed cursor")
+            return _microseconds(value)
+        if not isinstance(value, (bool, int, float)):
+            raise InvalidCursor("Malformed cursor")
+        return value
+
+    def _after(self, sort, values):
+        """Rows strictly after ``values`` in ``sort`` order (the snapshot's ``keyset_filter``)."""
+        after = np.zeros(self.count, dtype=bool)
+        equal = np.ones(self.count, dtype=bool)
+        for (field, direction), value in zip(SORT_SPECS[sort], values):
+            column, key = self._columns[field], self._sort_key(field, value)
+            after |= equal & (column > key if direction == ASCENDING else column < key)
+            equal &= column == key
+        return after
+
+    def select(self, category, skin_type, featured, new, min_price, max_price, sort, limit, cursor_values=None):
+        """Rows of one listing page in order, and whether another page follows."""
+        mask = self._filter(category, skin_type, featured, new, min_price, max_price)
+        if cursor_values is not None:
+            mask &= self._after(sort, cursor_values)
+        order = self._orders[sort]
+        # Walk the sort order in growing chunks; a page rarely needs all of it
+        found, wanted, start, chunk_size = [], limit + 1, 0, FIRST_SCAN_ROWS
+        while wanted > 0 and start < len(order):
+            chunk = order[start:start + chunk_size]
+            found.append(chunk[mask[chunk]])
+            wanted -= len(found[-1])
+            start += chunk_size
+            chunk_size *= 2
+        rows = np.concatenate(found) if found else order[:0]
+        return rows[:limit], len(rows) > limit
+
+    def sort_values(self, row, sort):
+        """The sort keys of ``row`` as a document, for ``pagination.encode_cursor``."""
+        values = {}
+        for field, _ in SORT_SPECS[sort]:
+            value = self._columns[field][row]
+            if field == "id":
+                value = value.decode()
+            elif field == "created_at":
+                value = EPOCH + int(value) * ONE_MICROSECOND
+            else:
+                value = value.item()
+            values[field] = value
+        return values
+
+    def _pieces(self, rows, kind):
+        offsets, start = self._blobs[kind]
+        view = self._view
+        return [view[start + begin:start + end]
+                for begin, end in zip(offsets[rows].tolist(), offsets[rows + 1].tolist())]
+
+    def json_array(self, rows, summary=False):
+        """A JSON array body of the stored ``Product`` (or ``ProductSummary``) JSON for ``rows``."""
+        return b"[" + b",".join(self._pieces(rows, "summary" if summary else "full")) + b"]"
+
+    def documents(self, rows):
+        return [json.loads(bytes(piece)) for piece in self._pieces(rows, "full")]
+
+
+class SnapshotReader:
+    """The newest snapshot at ``path``, re-checked at most every ``check_interval`` seconds."""
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._rejected = None  # identity of a file that failed to map, so it's tried once
+        self._next_check = 0.0
+        self.swaps = 0
+        self.failures = 0
+
+    def current(self):
+        """The mapped snapshot, or ``None`` if no valid one has been written yet."""
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._refresh()
+        return self._snapshot
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity == self._rejected or (self._snapshot is not None and self._snapshot.identity == identity):
+            return
+        try:
+            replacement = CatalogSnapshot(self.path)
+        except (OSError, InvalidSnapshot, KeyError):
+            # Keep serving the snapshot already mapped, if any
+            self._rejected = identity
+            self.failures += 1
+            logger.exception(f"Failed to map catalog snapshot {self.path}")
+            return
+        # Requests still holding the old snapshot keep its mapping alive until they finish
+        self._snapshot = replacement
+        self.swaps += 1
+        logger.info(f"Mapped catalog snapshot v{replacement.version} ({replacement.count} products)")
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "path": self.path,
+            "version": snapshot.version if snapshot else None,
+            "products": snapshot.count if snapshot else 0,
+            "built_at": snapshot.built_at if snapshot else None,
+            "swaps": self.swaps,
+            "failures": self.failures,
+        }
+
+
+# Builder
+
+async def run(path, watch, refresh):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    changelog = ChangeLog(db, retention_seconds=0)
+    try:
+        header = await build_snapshot(db, changelog, path)
+        built_at = time.monotonic()
+        while watch:
+            await asyncio.sleep(watch)
+            try:
+                if await changelog.version() == header["version"] and time.monotonic() - built_at < refresh:
+                    continue
+                header = await build_snapshot(db, changelog, path)
+                built_at = time.monotonic()
+            except Exception:
+                logger.exception("Catalog snapshot rebuild failed; workers keep the previous one")
+    finally:
+        client.close()
+
+
+def main():
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Write the memory-mapped catalog snapshot the API workers serve")
+    parser.add_argument("path", nargs="?", default=os.environ.get("CATALOG_SNAPSHOT_PATH"),
+                        help="snapshot file (default: $CATALOG_SNAPSHOT_PATH)")
+    parser.add_argument("--watch", type=float, default=0.0,
+                        help="keep running, checking the catalog version every WATCH seconds")
+    parser.add_argument("--refresh", type=float, default=60.0,
+                        help="with --watch, rebuild at least every REFRESH seconds (stock, trending scores)")
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("a snapshot path or CATALOG_SNAPSHOT_PATH is required")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(run(args.path, args.watch, args.refresh))
+
+
+if __name__ == "__main__":
+    main()
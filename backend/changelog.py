@@ -0,0 +1,127 @@
+"""Monotonic catalog change log for delta sync.
+
+Every catalog write records one entry per product in ``catalog_changes``:
+``{version, product_id, op: "upsert" | "remove", at}``. Versions come from
+one ``$inc`` of the ``catalog_version`` counter, which reserves a contiguous
+range for each batch, so versions are unique and increasing across workers.
+A client that knows version ``v`` asks for the entries after ``v`` and gets
+only the products that changed.
+
+Writers reserve versions before inserting entries, so a reader can see
+version 12 before a concurrent writer has inserted 11. The reader stops at
+the first gap and resumes there on its next call. A gap still open after
+``gap_grace_seconds`` is treated as a writer that died between the two
+steps, and the reader skips it.
+
+Compaction deletes entries older than the retention window. It first raises
+the counter's ``floor``. A client asking from below the floor is told to do
+a full resync instead of receiving a partial history.
+
+Stock movements and trending scores are not catalog changes and aren't
+logged, matching what invalidates the catalog cache.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+COUNTER_ID = "catalog_version"
+UPSERT = "upsert"
+REMOVE = "remove"
+
+
+def _as_utc(value):
+    # Dates read back naive when the client isn't tz_aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class ChangeLog:
+    def __init__(self, db, retention_seconds, gap_grace_seconds=30.0):
+        self.db = db
+        self.retention = timedelta(seconds=retention_seconds)
+        self.gap_grace = timedelta(seconds=gap_grace_seconds)
+
+    async def _counter(self):
+        return await self.db.counters.find_one({"_id": COUNTER_ID}) or {}
+
+    async def version(self):
+        """The newest catalog version (0 before the first change)."""
+        return (await self._counter()).get("value", 0)
+
+    async def record(self, upserted_ids=(), removed_ids=()):
+        """Append entries for products written and removed; returns the new version."""
+        changes = [(product_id, UPSERT) for product_id in upserted_ids]
+        changes += [(product_id, REMOVE) for product_id in removed_ids]
+        if not changes:
+            return None
+        counter = await self.db.counters.find_one_and_update(
+            {"_id": COUNTER_ID},
+            {"$inc": {"value": len(changes)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        first = counter["value"] - len(changes) + 1
+        now = datetime.now(timezone.utc)
+        await self.db.catalog_changes.insert_many(
+            [{"version": first + offset, "product_id": product_id, "op": op, "at": now}
+             for offset, (product_id, op) in enumerate(changes)],
+            ordered=False,
+        )
+        return counter["value"]
+
+    async def changes(self, since, limit):
+        """Entries after ``since``, up to ``limit`` of them.
+
+        Returns ``(entries, version, resync, has_more)``. ``version`` is what
+        the client passes as ``since`` next time. ``resync`` means the log no
+        longer reaches back to ``since``, or ``since`` is from another
+        database, and the client must reload the full catalog.
+        """
+        counter = await self._counter()
+        current = counter.get("value", 0)
+        if since < counter.get("floor", 0) or since > current:
+            return [], current, True, False
+
+        documents = await self.db.catalog_changes.find(
+            {"version": {"$gt": since}}, {"_id": 0}
+        ).sort("version", ASCENDING).limit(limit + 1).to_list(length=limit + 1)
+        has_more = len(documents) > limit
+        entries, version = [], since
+        abandoned_before = datetime.now(timezone.utc) - self.gap_grace
+        for document in documents[:limit]:
+            if document["version"] != version + 1 and _as_utc(document["at"]) > abandoned_before:
+                # An earlier version is still being written; resume from here next time
+                has_more = False
+                break
+            entries.append(document)
+            version = document["version"]
+        return entries, version, False, has_more
+
+    async def compact(self):
+        """Drop entries older than the retention window; returns how many were removed."""
+        cutoff = datetime.now(timezone.utc) - self.retention
+        # Versions and timestamps rise together, so the newest expired entry bounds the rest
+        newest_expired = await self.db.catalog_changes.find_one(
+            {"at": {"$lt": cutoff}}, {"_id": 0, "version": 1}, sort=[("at", DESCENDING), ("version", DESCENDING)]
+        )
+        if newest_expired is None:
+            return 0
+        # Readers must see the new floor before the entries under it disappear
+        await self.db.counters.update_one({"_id": COUNTER_ID}, {"$max": {"floor": newest_expired["version"]}})
+        result = await self.db.catalog_changes.delete_many({"version": {"$lte": newest_expired["version"]}})
+        return result.deleted_count
+
+    async def run_compactor(self, interval_seconds):
+        while True:
+            try:
+                removed = await self.compact()
+                if removed:
+                    logger.info(f"Compacted {removed} catalog change log entries")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Catalog change log compaction failed")
+            await asyncio.sleep(interval_seconds)
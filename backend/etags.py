@@ -0,0 +1,38 @@
+"""Conditional GETs for JSON list responses.
+
+The ETag is a hash of the exact response body. Any change a client could
+see, including fields that don't invalidate the catalog cache (stock,
+trending scores), produces a new tag. Cached pages keep their tag next to
+their body, so the hash is computed once per cache fill, not per request.
+Tags are weak, because the compression middleware may re-encode the body.
+
+A request whose ``If-None-Match`` carries the current tag gets an empty
+``304``, so an unchanged listing costs a round trip and a few headers.
+"""
+import hashlib
+
+from fastapi import Response
+
+
+def make_etag(body):
+    return 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of ``etag`` against an ``If-None-Match`` header value."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def json_response(request, body, etag=None, headers=None):
+    """A JSON ``Response`` for pre-encoded ``body``, or ``304`` if the client's copy is current."""
+    etag = etag or make_etag(body)
+    # no-cache: clients may store the response but must revalidate it with the ETag
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,92 @@
+"""Filter sidebar counts, computed in one ``$facet`` aggregation.
+
+Category, skin type and price counts are disjunctive. Each one reflects
+every active filter except its own, so with ``category=lips`` selected the
+category counts still show how many products the other categories would
+give. ``total`` and the tag counts reflect every filter.
+
+The pipeline opens with a ``$match`` on the filters every facet shares,
+plus an ``$or`` of what each disjunctive facet still filters on, so the same
+indexes that serve ``/api/products`` narrow the documents. Inside ``$facet``
+each count then matches the remaining filters it applies. Only
+the four counted fields are carried into ``$facet``.
+"""
+from models import FacetCount, PriceBucketCount, ProductFacets
+
+# Lower edges of the price buckets; the last bucket is open-ended
+PRICE_BOUNDARIES = [0, 15, 25, 50, 100]
+MAX_TAG_FACETS = 30
+
+OPEN_BUCKET = "open"
+
+# Listing filters on a counted field; each is left out of its own facet's counts
+FACETED_FIELDS = ("category", "skin_types", "price")
+
+
+def _count_by(field):
+    # Same as $sortByCount, with ties broken by value so the order is stable
+    return [{"$group": {"_id": field, "count": {"$sum": 1}}}, {"$sort": {"count": -1, "_id": 1}}]
+
+
+def facet_pipeline(query):
+    faceted = {field: query[field] for field in FACETED_FIELDS if field in query}
+    shared = {field: value for field, value in query.items() if field not in faceted}
+
+    def conditions_except(excluded=None):
+        return {field: value for field, value in faceted.items() if field != excluded}
+
+    def match_except(excluded=None):
+        conditions = conditions_except(excluded)
+        return [{"$match": conditions}] if conditions else []
+
+    opening = dict(shared)
+    # Every facet's documents, so the index on any of its filters can narrow the pass; with a
+    # single faceted filter its own facet needs the whole catalog and there's nothing to narrow
+    branches = [conditions_except(field) for field in faceted]
+    if len(branches) > 1:
+        opening["$or"] = branches
+
+    return [
+        {"$match": opening},
+        {"$project": {"_id": 0, "category": 1, "skin_types": 1, "tags": 1, "price": 1}},
+        {"$facet": {
+            "total": [*match_except(), {"$count": "count"}],
+            "categories": [*match_except("category"), *_count_by("$category")],
+            "skin_types": [*match_except("skin_types"), {"$unwind": "$skin_types"}, *_count_by("$skin_types")],
+            "tags": [*match_except(), {"$unwind": "$tags"}, *_count_by("$tags"), {"$limit": MAX_TAG_FACETS}],
+            "price_ranges": [*match_except("price"), {"$bucket": {
+                "groupBy": "$price",
+                # Prices at or above the last boundary land in the default bucket
+                "boundaries": PRICE_BOUNDARIES,
+                "default": OPEN_BUCKET,
+                "output": {"count": {"$sum": 1}},
+            }}],
+        }},
+    ]
+
+
+def _counts(groups):
+    return [FacetCount(value=group["_id"], count=group["count"]) for group in groups]
+
+
+def _price_ranges(buckets):
+    counts = {bucket["_id"]: bucket["count"] for bucket in buckets}
+    ranges = [
+        PriceBucketCount(min=low, max=high, count=counts.get(low, 0))
+        for low, high in zip(PRICE_BOUNDARIES, PRICE_BOUNDARIES[1:])
+    ]
+    ranges.append(PriceBucketCount(min=PRICE_BOUNDARIES[-1], count=counts.get(OPEN_BUCKET, 0)))
+    return ranges
+
+
+async def compute_facets(collection, query):
+    results = await collection.aggregate(facet_pipeline(query)).to_list(1)
+    facets = results[0] if results else {}
+    total = facets.get("total") or [{"count": 0}]
+    return ProductFacets(
+        total=total[0]["count"],
+        categories=_counts(facets.get("categories", [])),
+        skin_types=_counts(facets.get("skin_types", [])),
+        tags=_counts(facets.get("tags", [])),
+        price_ranges=_price_ranges(facets.get("price_ranges", [])),
+    )
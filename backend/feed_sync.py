@@ -0,0 +1,259 @@
+"""Incremental supplier feed sync.
+
+Products imported from a supplier feed are keyed by ``(supplier,
+supplier_sku)`` and carry a hash of their feed content plus one short hash
+per field. A sync loads only those hashes, diffs every incoming row against
+them and sends:
+
+* ``InsertOne`` for SKUs not seen before,
+* ``UpdateOne`` with ``$set`` of just the fields whose hash changed,
+* a soft delete (``deleted_at``) for SKUs missing from the feed.
+
+The feed's ``stock`` is the supplier's level, not what checkout can still
+take, so it is never ``$set`` over a live counter. The last level synced is
+kept in ``feed_stock``, and a change is applied as an ``$inc`` of the
+difference. Stock held by pending reservations stays held. A sharded product
+gets the difference spread over its ``stock_shards`` counters instead. A
+product with no ``feed_stock`` yet takes the feed level as is.
+
+Unchanged rows cost a hash comparison and no write, so a refresh that only
+moves prices and stock on a small fraction of the catalog turns into a few
+small bulk writes.
+
+Command line, against the database in ``.env``:
+
+    python feed_sync.py acme acme-feed.ndjson
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import ValidationError
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from catalog_import import FeedRowError, feed_rows, format_validation_error, read_file_chunks, record_error
+from changelog import ChangeLog
+import inventory
+from models import FeedProduct, StoredProduct, SyncReport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Refuse to soft-delete more than this share of a supplier's live SKUs in one
+# sync; a truncated or half-uploaded feed shouldn't empty the catalog.
+MAX_DELETE_FRACTION = 0.5
+
+SYNC_FIELDS = [field for field in FeedProduct.model_fields if field != "sku"]
+SYNC_FIELD_SET = set(SYNC_FIELDS)
+
+HASH_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "supplier_sku": 1,
+    "sync_hash": 1,
+    "sync_field_hashes": 1,
+    "deleted_at": 1,
+    "feed_stock": 1,
+    "stock_shards": 1,
+}
+
+
+def short_hash(value):
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def hash_feed_values(values):
+    """Content hash of a feed row's JSON-mode values (one encode for the whole row)."""
+    return short_hash(values)
+
+
+def hash_feed_fields(values):
+    """Per-field hashes, only computed for rows that are new or changed."""
+    return {field: short_hash(values[field]) for field in SYNC_FIELDS}
+
+
+def supplier_query(supplier):
+    # The supplier_sku type check matches the partial unique index's filter
+    return {"supplier": supplier, "supplier_sku": {"$type": "string"}}
+
+
+async def sync_feed(collection, supplier, rows, batch_size=DEFAULT_BATCH_SIZE,
+                    max_delete_fraction=MAX_DELETE_FRACTION, on_changed=None):
+    """Apply one full supplier feed (async iterable of ``(row_number, row)``) to the catalog.
+
+    ``on_changed(upserted_ids, removed_ids)`` is awaited after each bulk write
+    that changed something, so the caller can refresh indexes and caches.
+    """
+    report = SyncReport(supplier=supplier)
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+
+    existing = {}
+    async for document in collection.find(supplier_query(supplier), HASH_PROJECTION):
+        existing[document["supplier_sku"]] = document
+
+    seen_skus = set()
+    operations = []  # (row_number, operation, product_id, removed)
+    shard_stock_changes = {}  # product_id -> (difference, shard count), applied once its update is written
+
+    async def flush():
+        if not operations:
+            return
+        batch = operations[:]
+        operations.clear()
+        failed_indexes = set()
+        try:
+            await collection.bulk_write([operation for _, operation, _, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed_indexes.add(write_error["index"])
+                record_error(report, batch[write_error["index"]][0], write_error.get("errmsg", "Write failed"))
+        upserted_ids, removed_ids = [], []
+        for index, (_, operation, product_id, removed) in enumerate(batch):
+            if index in failed_indexes:
+                shard_stock_changes.pop(product_id, None)
+                continue
+            if product_id in shard_stock_changes:
+                difference, shard_count = shard_stock_changes.pop(product_id)
+                short = await inventory.adjust_sharded_stock(collection.database, product_id, difference, shard_count)
+                if short:
+                    # Already reserved by checkouts since the feed counted it
+                    logger.warning(f"Feed stock drop for {product_id} exceeds its shards by {short}; left at zero")
+            if isinstance(operation, InsertOne):
+                report.inserted += 1
+            elif removed:
+                report.deleted += 1
+            else:
+                report.updated += 1
+            (removed_ids if removed else upserted_ids).append(product_id)
+        if on_changed and (upserted_ids or removed_ids):
+            await on_changed(upserted_ids, removed_ids)
+
+    async for row_number, row in rows:
+        report.rows += 1
+        if isinstance(row, FeedRowError):
+            record_error(report, row_number, str(row))
+            continue
+        sku = row.get("sku")
+        if isinstance(sku, str) and sku:
+            if sku in seen_skus:
+                record_error(report, row_number, f"Duplicate sku {sku!r} in feed")
+                continue
+            # Count the SKU as present even if the row is invalid, so it isn't soft-deleted
+            seen_skus.add(sku)
+        try:
+            feed_product = FeedProduct(**row)
+        except ValidationError as e:
+            record_error(report, row_number, format_validation_error(e))
+            continue
+
+        values = feed_product.model_dump(mode="json", include=SYNC_FIELD_SET)
+        content_hash = hash_feed_values(values)
+        current = existing.get(sku)
+        if current is not None and current.get("sync_hash") == content_hash and not current.get("deleted_at"):
+            report.unchanged += 1
+            continue
+
+        field_hashes = hash_feed_fields(values)
+        if current is None:
+            product = StoredProduct(**feed_product.dict(include=SYNC_FIELD_SET), supplier=supplier, supplier_sku=sku)
+            document = product.dict()
+            document["sync_hash"] = content_hash
+            document["sync_field_hashes"] = field_hashes
+            document["feed_stock"] = product.stock
+            operations.append((row_number, InsertOne(document), product.id, False))
+        else:
+            previous_hashes = current.get("sync_field_hashes") or {}
+            changed_fields = [field for field in SYNC_FIELDS if previous_hashes.get(field) != field_hashes[field]]
+            changes = feed_product.dict(include=set(changed_fields) - {"stock"})
+            changes["sync_hash"] = content_hash
+            changes["sync_field_hashes"] = field_hashes
+            if current.get("deleted_at"):
+                changes["deleted_at"] = None
+            if "image_url" in changed_fields:
+                # The variants were rendered from the old image
+                changes["image_variants"] = []
+            update = {"$set": changes}
+            if "stock" in changed_fields:
+                changes["feed_stock"] = feed_product.stock
+                previous = current.get("feed_stock")
+                if current.get("stock_shards"):
+                    if previous is not None:
+                        shard_stock_changes[current["id"]] = (feed_product.stock - previous, current["stock_shards"])
+                elif previous is None:
+                    changes["stock"] = feed_product.stock
+                else:
+                    update["$inc"] = {"stock": feed_product.stock - previous}
+            operations.append((row_number, UpdateOne({"id": current["id"]}, update), current["id"], False))
+
+        if len(operations) >= batch_size:
+            await flush()
+
+    live_skus = [sku for sku, document in existing.items() if not document.get("deleted_at")]
+    missing = [sku for sku in live_skus if sku not in seen_skus]
+    if missing and len(missing) > max_delete_fraction * len(live_skus):
+        report.deletes_skipped = True
+    else:
+        for sku in missing:
+            product_id = existing[sku]["id"]
+            operations.append((0, UpdateOne({"id": product_id}, {"$set": {"deleted_at": now}}), product_id, True))
+            if len(operations) >= batch_size:
+                await flush()
+    await flush()
+
+    report.elapsed_seconds = round(time.perf_counter() - started, 3)
+    report.rows_per_second = round(report.rows / report.elapsed_seconds, 1) if report.elapsed_seconds else 0.0
+    return report
+
+
+async def run(supplier, path, feed_format, batch_size, max_delete_fraction):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        db = client[os.environ['DB_NAME']]
+        # Running servers follow the change log to pick up the writes
+        changelog = ChangeLog(db, retention_seconds=0)
+
+        async def on_changed(upserted_ids, removed_ids):
+            try:
+                await changelog.record(upserted_ids, removed_ids)
+            except Exception:
+                # The writes are in; servers pick them up on their next full resync
+                logger.exception("Failed to record catalog changes")
+
+        rows = feed_rows(feed_format, read_file_chunks(path))
+        return await sync_feed(db.products, supplier, rows, batch_size, max_delete_fraction, on_changed=on_changed)
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync a supplier's full catalog feed into the products collection")
+    parser.add_argument("supplier", help="supplier name the SKUs belong to")
+    parser.add_argument("path", help="feed file")
+    parser.add_argument("--format", choices=("ndjson", "csv"), help="feed format (default: from the file extension)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="operations per bulk_write")
+    parser.add_argument("--max-delete-fraction", type=float, default=MAX_DELETE_FRACTION,
+                        help="skip soft deletes if more than this share of live SKUs is missing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    feed_format = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    report = asyncio.run(run(args.supplier, args.path, feed_format, args.batch_size, args.max_delete_fraction))
+    print(json.dumps(report.dict(), indent=2))
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,361 @@
+"""Content-addressed product images with lazily generated, size-capped derivatives.
+
+Originals are stored once under their SHA-256, at
+``<root>/originals/ab/abcdef...``. Uploading the same bytes twice costs a hash
+and nothing else. A derivative is a resized WebP or JPEG at one of
+``VARIANT_WIDTHS``, addressed as ``/api/images/<digest>/<width>.<format>``.
+Its URL can only ever name one image, so it is served with
+``Cache-Control: public, max-age=31536000, immutable`` and browsers and CDNs
+never revalidate it.
+
+Derivatives are not made at upload time. The first request for one decodes
+and resizes the original in a ``ProcessPoolExecutor``, so Pillow's CPU work
+never runs on the event loop. Concurrent requests for the same derivative
+share one render. The resized files live under ``<root>/variants`` in an LRU
+disk cache capped at ``cache_max_bytes``. The least recently served
+derivatives are deleted when it fills up and re-rendered if asked for again.
+Each worker keeps its own recency order over the shared directory. A file
+another worker evicted is simply rendered again.
+"""
+import asyncio
+import hashlib
+import ipaddress
+import logging
+import multiprocessing
+import os
+import re
+import socket
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from models import ImageFormat, ImageVariant
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (160, 320, 480, 640, 960, 1280)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MEDIA_TYPES = {ImageFormat.WEBP: "image/webp", ImageFormat.JPEG: "image/jpeg"}
+ACCEPTED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+MAX_PIXELS = 40_000_000
+MAX_REDIRECTS = 5
+
+# EXIF orientations that transpose the stored width and height
+ORIENTATION_TAG = 0x0112
+QUARTER_TURN_ORIENTATIONS = {5, 6, 7, 8}
+
+# Quality settings per derivative format
+SAVE_OPTIONS = {
+    ImageFormat.WEBP: {"format": "WEBP", "quality": 80, "method": 4},
+    ImageFormat.JPEG: {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True},
+}
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class ImageFetchFailed(Exception):
+    pass
+
+
+def check_url(url, allowed_hosts=None):
+    """The addresses ``url``'s host resolves to, all of them public.
+
+    Raises ``InvalidImage`` unless ``url`` is http(s) on an allowed host that
+    resolves only to public addresses.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise InvalidImage(f"Only http(s) image URLs can be ingested: {url}")
+    host = parsed.hostname.lower()
+    if allowed_hosts and host not in allowed_hosts:
+        raise InvalidImage(f"Images can't be ingested from {host}")
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+    except ValueError:
+        raise InvalidImage(f"Invalid image URL: {url}")
+    except socket.gaierror as e:
+        raise ImageFetchFailed(f"Failed to resolve {host}: {e}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        # Private, loopback, link-local (cloud metadata), reserved and multicast ranges
+        if not ip.is_global or ip.is_multicast:
+            raise InvalidImage(f"Images can't be ingested from {host}: it resolves to an internal address")
+    return sorted(addresses)
+
+
+class PinnedAddressAdapter(HTTPAdapter):
+    """Connects to ``address`` instead of resolving the URL's host again.
+
+    The host could resolve somewhere else the second time (DNS rebinding), so
+    the request goes to the address ``check_url`` vetted. The ``Host`` header,
+    TLS server name and certificate check still use the original host.
+    """
+
+    def __init__(self, hostname, address, **kwargs):
+        self.hostname = hostname
+        self.address = address
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["server_hostname"] = self.hostname
+        kwargs["assert_hostname"] = self.hostname
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        parsed = urlparse(request.url)
+        request.headers["Host"] = parsed.netloc.rsplit("@", 1)[-1]
+        host = f"[{self.address}]" if ":" in self.address else self.address
+        request.url = parsed._replace(netloc=f"{host}:{parsed.port}" if parsed.port else host).geturl()
+        return super().send(request, **kwargs)
+
+
+def download(url, max_bytes, timeout=15.0, allowed_hosts=None):
+    """Fetch an original over HTTP(S). Blocking; call it from a thread.
+
+    Redirects are followed by hand, so every hop goes through ``check_url``,
+    and each is fetched from the address it vetted.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        addresses = check_url(url, allowed_hosts)
+        parsed = urlparse(url)
+        session = requests.Session()
+        # A proxy would resolve the host itself
+        session.trust_env = False
+        session.mount(f"{parsed.scheme}://", PinnedAddressAdapter(parsed.hostname, addresses[0]))
+        try:
+            with session, session.get(url, stream=True, timeout=timeout, allow_redirects=False) as response:
+                if response.is_redirect:
+                    url = urljoin(url, response.headers["location"])
+                    continue
+                response.raise_for_status()
+                chunks, size = [], 0
+                for chunk in response.iter_content(64 * 1024):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ImageTooLarge(f"Image is larger than {max_bytes} bytes")
+                    chunks.append(chunk)
+        except requests.RequestException as e:
+            raise ImageFetchFailed(f"Failed to fetch {url}: {e}")
+        return b"".join(chunks)
+    raise ImageFetchFailed(f"Too many redirects fetching {url}")
+
+
+# Pillow work; these run in the process pool, so they take and return plain values
+
+def probe(path):
+    """``(format, width, height)`` of the image at ``path``; raises ``InvalidImage`` if it isn't one we accept."""
+    import warnings
+
+    from PIL import Image, UnidentifiedImageError
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            with Image.open(path) as image:
+                image.verify()
+            with Image.open(path) as image:
+                image_format, (width, height) = image.format, image.size
+                # Rotated a quarter turn by its EXIF orientation, as render's exif_transpose displays it
+                if image.getexif().get(ORIENTATION_TAG) in QUARTER_TURN_ORIENTATIONS:
+                    width, height = height, width
+    except (UnidentifiedImageError, Image.DecompressionBombWarning, Image.DecompressionBombError, OSError,
+            SyntaxError) as e:
+        raise InvalidImage(f"Not a supported image: {e}")
+    if image_format not in ACCEPTED_FORMATS:
+        raise InvalidImage(f"Unsupported image format {image_format}")
+    return image_format, width, height
+
+
+def render(source, target, width, image_format):
+    """Write ``source`` resized to ``width`` (never enlarged) to ``target``; returns the bytes written."""
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    with Image.open(source) as image:
+        # Let JPEG decode at a reduced scale when the target is much smaller
+        image.draft("RGB", (width, max(1, image.height * width // image.width)))
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        if image_format == ImageFormat.JPEG and has_alpha:
+            image = image.convert("RGBA")
+            flattened = Image.new("RGB", image.size, "white")
+            flattened.paste(image, mask=image.getchannel("A"))
+            image = flattened
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        temporary = f"{target}.{os.getpid()}.tmp"
+        image.save(temporary, **SAVE_OPTIONS[image_format])
+    os.replace(temporary, target)
+    return os.path.getsize(target)
+
+
+class DiskLRU:
+    """Recency order and total size of the files in a directory, deleting the oldest past ``max_bytes``."""
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._files = OrderedDict()  # path -> size, least recently used first
+        self.size = 0
+        self.evictions = 0
+
+    def load(self):
+        """Pick up files already on disk, oldest access first."""
+        found = []
+        for path in self.root.rglob("*"):
+            if path.is_file() and not path.name.endswith(".tmp"):
+                stat = path.stat()
+                found.append((stat.st_atime, str(path), stat.st_size))
+        for _, path, size in sorted(found):
+            self._files[path] = size
+            self.size += size
+        self._evict()
+
+    def touch(self, path):
+        """Mark ``path`` used; returns False if it isn't cached."""
+        if path not in self._files:
+            return False
+        self._files.move_to_end(path)
+        return True
+
+    def add(self, path, size):
+        self.size += size - self._files.pop(path, 0)
+        self._files[path] = size
+        self._evict()
+
+    def discard(self, path):
+        self.size -= self._files.pop(path, 0)
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._files) > 1:
+            path, size = self._files.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._files)
+
+
+class ImageStore:
+    def __init__(self, root, cache_max_bytes, workers=None, base_url=""):
+        self.root = Path(root)
+        self.originals = self.root / "originals"
+        self.variants = self.root / "variants"
+        self.base_url = base_url.rstrip("/")
+        self.workers = workers
+        self.cache = DiskLRU(self.variants, cache_max_bytes)
+        self._pool = None
+        self._renders = SingleFlight()
+        self.rendered = 0
+
+    def _prepare(self):
+        self.originals.mkdir(parents=True, exist_ok=True)
+        self.variants.mkdir(parents=True, exist_ok=True)
+        self.cache.load()
+
+    async def start(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._prepare)
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def _in_pool(self, function, *args):
+        if self._pool is None:
+            # Spawned, not forked: the server process has Motor's threads running
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return await asyncio.get_running_loop().run_in_executor(self._pool, function, *args)
+
+    def original_path(self, digest):
+        return self.originals / digest[:2] / digest
+
+    def variant_path(self, digest, width, image_format):
+        return self.variants / digest[:2] / digest / f"{width}.{image_format.value}"
+
+    def variant_urls(self, digest, width):
+        """Derivatives for an original ``width`` pixels wide, smallest first, WebP before JPEG."""
+        widths = [variant for variant in VARIANT_WIDTHS if variant <= width] or [VARIANT_WIDTHS[0]]
+        return [
+            ImageVariant(url=f"{self.base_url}/api/images/{digest}/{variant}.{image_format.value}",
+                         width=min(variant, width), format=image_format)
+            for image_format in ImageFormat
+            for variant in widths
+        ]
+
+    async def ingest(self, data):
+        """Store an uploaded original; returns ``(digest, format, width, height)``."""
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, lambda: hashlib.sha256(data).hexdigest())
+        path = self.original_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = path.with_name(f"{digest}.{os.getpid()}.tmp")
+            await loop.run_in_executor(None, temporary.write_bytes, data)
+            try:
+                image_format, width, height = await self._in_pool(probe, str(temporary))
+            except BaseException:
+                temporary.unlink(missing_ok=True)
+                raise
+            os.replace(temporary, path)
+        else:
+            image_format, width, height = await self._in_pool(probe, str(path))
+        return digest, image_format, width, height
+
+    async def variant(self, digest, width, image_format):
+        """Path of a derivative, rendering it first if it isn't cached; ``None`` if the original is unknown."""
+        path = self.variant_path(digest, width, image_format)
+        key = str(path)
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            self.cache.discard(key)
+        else:
+            # Possibly rendered by another worker sharing the directory
+            if not self.cache.touch(key):
+                self.cache.add(key, size)
+            return path
+        source = self.original_path(digest)
+        if not source.exists():
+            return None
+
+        async def render_variant():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            size = await self._in_pool(render, str(source), key, width, image_format)
+            self.rendered += 1
+            self.cache.add(key, size)
+            return path
+
+        return await self._renders.do(key, render_variant)
+
+    def stats(self):
+        return {
+            "cached_variants": len(self.cache),
+            "cache_bytes": self.cache.size,
+            "cache_max_bytes": self.cache.max_bytes,
+            "evictions": self.cache.evictions,
+            "rendered": self.rendered,
+        }
@@ -0,0 +1,131 @@
+"""Declarative index registry, applied to Mongo at application startup.
+
+Product indexes follow the equality-sort-range rule: filters matched by
+equality (category, skin_types, is_new) come first, then the keys of one of
+the listing sorts from ``pagination.SORT_SPECS``, and price ranges are served
+from the trailing keys. Every listing query carries a sort, so even shapes
+without a dedicated index walk a sort index instead of scanning the
+collection.
+"""
+import logging
+import os
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+CART_TTL_SECONDS = int(os.environ.get("CART_TTL_SECONDS", str(30 * 24 * 3600)))
+
+FEATURED_KEYS = [("is_featured", DESCENDING), ("rating", DESCENDING), ("id", ASCENDING)]
+NEWEST_KEYS = [("created_at", DESCENDING), ("id", ASCENDING)]
+PRICE_KEYS = [("price", ASCENDING), ("id", ASCENDING)]
+RATING_KEYS = [("rating", DESCENDING), ("id", ASCENDING)]
+TRENDING_KEYS = [("trending_score", DESCENDING), ("id", ASCENDING)]
+
+INDEXES = {
+    "products": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Feed sync identity; only products that came from a supplier feed have a SKU
+        IndexModel(
+            [("supplier", ASCENDING), ("supplier_sku", ASCENDING)],
+            name="supplier_sku_unique",
+            unique=True,
+            partialFilterExpression={"supplier_sku": {"$type": "string"}},
+        ),
+        # One index per listing sort
+        IndexModel(FEATURED_KEYS, name="sort_featured"),
+        IndexModel(NEWEST_KEYS, name="sort_newest"),
+        IndexModel(PRICE_KEYS, name="sort_price"),
+        IndexModel(RATING_KEYS, name="sort_rating"),
+        IndexModel(TRENDING_KEYS, name="sort_trending"),
+        # Category pages use every sort
+        IndexModel([("category", ASCENDING), *FEATURED_KEYS], name="category_featured"),
+        IndexModel([("category", ASCENDING), *NEWEST_KEYS], name="category_newest"),
+        IndexModel([("category", ASCENDING), *PRICE_KEYS], name="category_price"),
+        IndexModel([("category", ASCENDING), *RATING_KEYS], name="category_rating"),
+        IndexModel([("category", ASCENDING), *TRENDING_KEYS], name="category_trending"),
+        # Skin type filter (multikey) with the default and price sorts
+        IndexModel([("skin_types", ASCENDING), *FEATURED_KEYS], name="skin_types_featured"),
+        IndexModel([("skin_types", ASCENDING), *PRICE_KEYS], name="skin_types_price"),
+        # "New arrivals" listing
+        IndexModel([("is_new", ASCENDING), *NEWEST_KEYS], name="is_new_newest"),
+        # Facet counts over the whole live catalog (no filter, or only the facet's own) have no sort to walk
+        IndexModel([("deleted_at", ASCENDING)], name="deleted_at"),
+        # Automatic viral flagging clears the flag on products that dropped out of the top
+        IndexModel([("is_viral", ASCENDING)], name="viral", partialFilterExpression={"is_viral": True}),
+    ],
+    "cart": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # One line per product per cart; add-to-cart upserts on this key
+        IndexModel([("cart_id", ASCENDING), ("product_id", ASCENDING)], name="cart_product_unique", unique=True),
+        # Lines untouched for CART_TTL_SECONDS are removed as abandoned
+        IndexModel([("updated_at", ASCENDING)], name="updated_at_ttl", expireAfterSeconds=CART_TTL_SECONDS),
+    ],
+    "reservations": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Expiry sweep
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+        # Confirmed or released reservations are kept for a week; pending ones have no closed_at
+        IndexModel([("closed_at", ASCENDING)], name="closed_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "stock_shards": [
+        IndexModel([("product_id", ASCENDING), ("shard", ASCENDING)], name="product_shard_unique", unique=True),
+    ],
+    "product_event_counts": [
+        IndexModel([("product_id", ASCENDING), ("hour", ASCENDING)], name="product_hour_unique", unique=True),
+        IndexModel([("hour", ASCENDING)], name="hour_ttl", expireAfterSeconds=90 * 24 * 3600),
+    ],
+    "catalog_changes": [
+        IndexModel([("version", ASCENDING)], name="version_unique", unique=True),
+        # Compaction finds the newest entry older than the retention window
+        IndexModel([("at", ASCENDING), ("version", ASCENDING)], name="at_version"),
+    ],
+    "newsletter": [
+        # Signups from before emails were normalized need migrate_newsletter_emails.py first
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+}
+
+
+# Updates run before a collection's indexes are built, for documents that predate an indexed field
+BACKFILLS = {
+    "cart": [
+        # Lines added before updated_at existed would never expire; date them from added_at,
+        # which may still be an ISO string, or from now if it's missing or unreadable
+        ({"updated_at": {"$exists": False}}, [{"$set": {"updated_at": {"$convert": {
+            "input": "$added_at", "to": "date", "onError": "$$NOW", "onNull": "$$NOW",
+        }}}}]),
+    ],
+}
+
+
+class IndexBuildError(Exception):
+    pass
+
+
+async def ensure_indexes(db, registry=INDEXES, backfills=BACKFILLS):
+    """Create every registered index. Existing identical indexes are a no-op.
+
+    A collection's ``backfills`` are applied first; once done they match
+    nothing, so later startups only pay for an indexed query.
+
+    A failure on one collection (for example duplicates blocking a unique
+    index) does not stop the remaining collections. Once they have all been
+    tried, ``IndexBuildError`` is raised: the routes rely on these indexes,
+    and on the unique ones to reject duplicates.
+    """
+    failed = []
+    for collection_name, indexes in registry.items():
+        try:
+            for query, update in backfills.get(collection_name, []):
+                result = await db[collection_name].update_many(query, update)
+                if result.modified_count:
+                    logger.info(f"Backfilled {result.modified_count} documents in {collection_name}")
+            created = await db[collection_name].create_indexes(indexes)
+            logger.info(f"Ensured indexes on {collection_name}: {', '.join(created)}")
+        except OperationFailure:
+            logger.exception(f"Failed to create indexes on {collection_name}")
+            failed.append(collection_name)
+    if failed:
+        raise IndexBuildError(f"Failed to create indexes on {', '.join(failed)}")
@@ -0,0 +1,295 @@
+"""Stock reservations for checkout.
+
+Stock only ever moves through conditional atomic updates: a decrement
+matches ``stock >= quantity``, so concurrent checkouts can't oversell.
+A reservation holds its stock until it is confirmed or released. Pending
+reservations that outlive their TTL are released by ``sweep_expired`` and
+their stock is returned.
+
+Hot products can spread their stock over several counter documents in
+``stock_shards``. Concurrent decrements then land on different documents
+instead of queueing on one. A sharded product keeps ``stock`` at 0 and
+``stock_shards`` set to the shard count, so only the sharded path can take
+its stock.
+
+Stock is decremented before the reservation document is written, and the
+reservation is moved out of ``pending`` before stock is returned. A crash
+between those two writes strands that stock, but it never oversells.
+"""
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+COMMITTED = "committed"
+RELEASED = "released"
+
+# A shard move's claim on its product; an older one is from a move that never finished
+SHARDING_CLAIM_SECONDS = 300
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id):
+        super().__init__(f"Insufficient stock for product {product_id}")
+        self.product_id = product_id
+
+
+async def _take_unsharded(db, product_id, quantity):
+    result = await db.products.update_one(
+        {"id": product_id, "stock": {"$gte": quantity}},
+        {"$inc": {"stock": -quantity}},
+    )
+    return [{"shard": None, "quantity": quantity}] if result.modified_count else []
+
+
+async def _take_sharded(db, product_id, quantity, shard_count):
+    """Take ``quantity`` from the shards, preferring a single random shard."""
+    start = random.randrange(shard_count)
+    order = [(start + offset) % shard_count for offset in range(shard_count)]
+    for shard in order:
+        result = await db.stock_shards.update_one(
+            {"product_id": product_id, "shard": shard, "stock": {"$gte": quantity}},
+            {"$inc": {"stock": -quantity}},
+        )
+        if result.modified_count:
+            return [{"shard": shard, "quantity": quantity}]
+
+    # No single shard can cover it; drain several, keeping whatever each can give
+    allocations = []
+    remaining = quantity
+    async for counter in db.stock_shards.find({"product_id": product_id, "stock": {"$gt": 0}}):
+        take = min(counter["stock"], remaining)
+        result = await db.stock_shards.update_one(
+            {"product_id": product_id, "shard": counter["shard"], "stock": {"$gte": take}},
+            {"$inc": {"stock": -take}},
+        )
+        if result.modified_count:
+            allocations.append({"shard": counter["shard"], "quantity": take})
+            remaining -= take
+            if not remaining:
+                return allocations
+    await _give_back(db, product_id, allocations)
+    return []
+
+
+async def _give_back(db, product_id, allocations):
+    for allocation in allocations:
+        if allocation["shard"] is None:
+            await db.products.update_one({"id": product_id}, {"$inc": {"stock": allocation["quantity"]}})
+        else:
+            await db.stock_shards.update_one(
+                {"product_id": product_id, "shard": allocation["shard"]},
+                {"$inc": {"stock": allocation["quantity"]}},
+            )
+
+
+async def reserve(db, items, ttl_seconds, cart_id=None):
+    """Reserve stock for ``items`` (dicts with product_id, quantity and stock_shards).
+
+    Either every item is reserved or none is; raises ``OutOfStock`` naming the
+    first product that couldn't be covered.
+    """
+    taken = []
+    for item in items:
+        product_id, quantity = item["product_id"], item["quantity"]
+        if item.get("stock_shards"):
+            allocations = await _take_sharded(db, product_id, quantity, item["stock_shards"])
+        else:
+            allocations = await _take_unsharded(db, product_id, quantity)
+        if not allocations:
+            for reserved in taken:
+                await _give_back(db, reserved["product_id"], reserved["allocations"])
+            raise OutOfStock(product_id)
+        taken.append({"product_id": product_id, "quantity": quantity, "allocations": allocations})
+
+    now = datetime.now(timezone.utc)
+    reservation = {
+        "id": str(uuid.uuid4()),
+        "cart_id": cart_id,
+        "status": PENDING,
+        "items": taken,
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=ttl_seconds),
+    }
+    await db.reservations.insert_one(reservation)
+    reservation.pop("_id", None)
+    return reservation
+
+
+def _reservation_filter(reservation_id, cart_id, **conditions):
+    query = {"id": reservation_id, "status": PENDING, **conditions}
+    if cart_id is not None:
+        query["cart_id"] = cart_id
+    return query
+
+
+async def release(db, reservation_id, cart_id=None):
+    """Release a pending reservation and return its stock; ``None`` if it isn't pending."""
+    reservation = await db.reservations.find_one_and_update(
+        _reservation_filter(reservation_id, cart_id),
+        {"$set": {"status": RELEASED, "closed_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0},
+    )
+    if reservation is None:
+        return None
+    # Only the caller that won the status transition returns the stock
+    for item in reservation["items"]:
+        await _give_back(db, item["product_id"], item["allocations"])
+    reservation["status"] = RELEASED
+    return reservation
+
+
+async def confirm(db, reservation_id, cart_id=None):
+    """Commit a pending, unexpired reservation; ``None`` if it is gone, closed or expired."""
+    now = datetime.now(timezone.utc)
+    reservation = await db.reservations.find_one_and_update(
+        _reservation_filter(reservation_id, cart_id, expires_at={"$gt": now}),
+        {"$set": {"status": COMMITTED, "closed_at": now}},
+        projection={"_id": 0},
+    )
+    if reservation is not None:
+        reservation["status"] = COMMITTED
+    return reservation
+
+
+async def sweep_expired(db, batch_size=500):
+    """Release pending reservations past their expiry; returns how many were released."""
+    now = datetime.now(timezone.utc)
+    expired = await db.reservations.find(
+        {"status": PENDING, "expires_at": {"$lte": now}}, {"_id": 0, "id": 1}
+    ).limit(batch_size).to_list(batch_size)
+    released = 0
+    for reservation in expired:
+        if await release(db, reservation["id"]):
+            released += 1
+    return released
+
+
+async def run_sweeper(db, interval_seconds):
+    while True:
+        try:
+            released = await sweep_expired(db)
+            if released:
+                logger.info(f"Released {released} expired stock reservations")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Stock reservation sweep failed")
+        await asyncio.sleep(interval_seconds)
+
+
+async def shard_stock(db, product_id, shard_count):
+    """Move a product's stock into ``shard_count`` counters.
+
+    The product is claimed first with a ``sharding`` marker, so only one move
+    runs at a time; a claim older than ``SHARDING_CLAIM_SECONDS`` is taken to
+    be from a move that crashed. The counters are then written, tagged with
+    the claim, and the product is flagged as sharded, guarded on the claim and
+    on the stock that was split. A checkout in between makes the move start
+    over, and a crash in between leaves the plain counter in use. Returns the
+    amount moved, or ``None`` if the product doesn't exist, is already sharded
+    or is being sharded.
+    """
+    claim = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    product = await db.products.find_one_and_update(
+        {
+            "id": product_id,
+            "stock_shards": {"$in": [0, None]},
+            "$or": [
+                {"sharding": None},
+                {"sharding.at": {"$lt": now - timedelta(seconds=SHARDING_CLAIM_SECONDS)}},
+            ],
+        },
+        {"$set": {"sharding": {"claim": claim, "at": now}}},
+        projection={"_id": 0, "stock": 1},
+    )
+    if product is None:
+        return None
+    moved = None
+    try:
+        # Counters left by moves that stopped before flagging the product; their claim is gone,
+        # so they can never be flagged and nothing reads them
+        await db.stock_shards.delete_many({"product_id": product_id, "move": {"$ne": claim}})
+        while product is not None:
+            stock = product.get("stock", 0)
+            base, extra = divmod(stock, shard_count)
+            try:
+                await db.stock_shards.insert_many([
+                    {"product_id": product_id, "shard": shard, "stock": base + (1 if shard < extra else 0),
+                     "move": claim}
+                    for shard in range(shard_count)
+                ])
+            except BulkWriteError:
+                # A move whose claim was taken over is still writing its counters
+                return None
+            flagged = await db.products.update_one(
+                {"id": product_id, "sharding.claim": claim, "stock": stock},
+                {"$set": {"stock": 0, "stock_shards": shard_count}, "$unset": {"sharding": ""}},
+            )
+            if flagged.modified_count:
+                moved = stock
+                return moved
+            # A checkout took stock since it was read; split the new amount
+            await db.stock_shards.delete_many({"product_id": product_id, "move": claim})
+            product = await db.products.find_one({"id": product_id, "sharding.claim": claim}, {"_id": 0, "stock": 1})
+        return None
+    finally:
+        if moved is None:
+            # Only this move's own counters; the product still reads its plain stock
+            await db.stock_shards.delete_many({"product_id": product_id, "move": claim})
+            await db.products.update_one({"id": product_id, "sharding.claim": claim}, {"$unset": {"sharding": ""}})
+
+
+async def adjust_sharded_stock(db, product_id, difference, shard_count):
+    """Spread a stock change of either sign over a sharded product's counters.
+
+    A decrease takes what each counter holds before moving on to the next, so
+    no counter goes below zero. Returns the part of a decrease the counters
+    couldn't cover.
+    """
+    if difference >= 0:
+        base, extra = divmod(difference, shard_count)
+        for shard in range(shard_count):
+            amount = base + (1 if shard < extra else 0)
+            if amount:
+                await db.stock_shards.update_one(
+                    {"product_id": product_id, "shard": shard}, {"$inc": {"stock": amount}}
+                )
+        return 0
+
+    remaining = -difference
+    while remaining:
+        counters = await db.stock_shards.find(
+            {"product_id": product_id, "stock": {"$gt": 0}}, {"_id": 0, "shard": 1, "stock": 1}
+        ).to_list(None)
+        if not counters:
+            break
+        for counter in counters:
+            take = min(counter["stock"], remaining)
+            result = await db.stock_shards.update_one(
+                {"product_id": product_id, "shard": counter["shard"], "stock": {"$gte": take}},
+                {"$inc": {"stock": -take}},
+            )
+            if result.modified_count:
+                remaining -= take
+                if not remaining:
+                    break
+    return remaining
+
+
+async def available_stock(db, product_id, shard_count):
+    if not shard_count:
+        product = await db.products.find_one({"id": product_id}, {"_id": 0, "stock": 1})
+        return product.get("stock", 0) if product else 0
+    result = await db.stock_shards.aggregate([
+        {"$match": {"product_id": product_id}},
+        {"$group": {"_id": None, "stock": {"$sum": "$stock"}}},
+    ]).to_list(1)
+    return result[0]["stock"] if result else 0
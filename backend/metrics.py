@@ -0,0 +1,262 @@
+"""Request and Mongo metrics in Prometheus text format.
+
+``MetricsMiddleware`` times every HTTP request into a latency histogram
+labelled by method and route template (``/api/products/{product_id}``, not
+the concrete path), and counts responses by status. ``MongoCommandListener``
+is passed to the Motor client through ``event_listeners``. It times every
+command by command name and collection. ``MongoPoolListener`` keeps gauges
+of open and checked-out connections.
+
+When ``slow_request_ms`` is set, each request collects the Mongo commands it
+issues, and requests slower than the threshold are logged with that list.
+Motor runs pymongo in executor threads with a copy of the caller's context,
+so the per-request list is reachable from the listener through a
+``ContextVar``.
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (command, collection, milliseconds) for each Mongo command the current request issued
+request_commands = ContextVar("request_commands", default=None)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.label_names, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_number(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for label_values, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+def render_values(name, help_text, metric_type, label_names, values):
+    """Lines for a gauge or counter family kept elsewhere; ``values`` maps label-value tuples to numbers."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for label_values, value in sorted(values.items()):
+        lines.append(f"{name}{_format_labels(label_names, label_values)} {_format_number(value)}")
+    return lines
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route"))
+http_requests = Counter("http_requests_total", "HTTP responses by route template and status", ("method", "route", "status"))
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "Mongo command latency by command and collection", ("command", "collection"))
+mongo_command_failures = Counter(
+    "mongo_command_failures_total", "Failed Mongo commands by command and collection", ("command", "collection"))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._in_flight = {}  # (request_id, connection_id) -> collection
+
+    def started(self, event):
+        # Most commands name their collection as the command's value; getMore carries it separately
+        target = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        collection = target if isinstance(target, str) else ""
+        self._in_flight[(event.request_id, event.connection_id)] = collection
+
+    def _finish(self, event, failed):
+        collection = self._in_flight.pop((event.request_id, event.connection_id), "")
+        seconds = event.duration_micros / 1_000_000
+        labels = (event.command_name, collection)
+        mongo_command_duration.observe(labels, seconds)
+        if failed:
+            mongo_command_failures.inc(labels)
+        commands = request_commands.get()
+        if commands is not None:
+            commands.append((event.command_name, collection, round(seconds * 1000, 2)))
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = defaultdict(int)  # address -> open connections
+        self.checked_out = defaultdict(int)  # address -> connections in use
+
+    def _add(self, counts, event, delta):
+        address = "%s:%s" % event.address
+        with self._lock:
+            counts[address] += delta
+
+    def connection_created(self, event):
+        self._add(self.open, event, 1)
+
+    def connection_closed(self, event):
+        self._add(self.open, event, -1)
+
+    def connection_checked_out(self, event):
+        self._add(self.checked_out, event, 1)
+
+    def connection_checked_in(self, event):
+        self._add(self.checked_out, event, -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def render(self):
+        with self._lock:
+            open_connections = {(address,): count for address, count in self.open.items()}
+            checked_out = {(address,): count for address, count in self.checked_out.items()}
+        return (
+            render_values("mongo_pool_connections", "Open connections in the Mongo pool", "gauge",
+                          ("address",), open_connections)
+            + render_values("mongo_pool_checked_out", "Mongo connections in use", "gauge", ("address",), checked_out)
+        )
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and status, plus the opt-in slow-request log."""
+
+    def __init__(self, app, slow_request_ms=0):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        commands = [] if self.slow_request_ms else None
+        token = request_commands.set(commands)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - started
+            request_commands.reset(token)
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            http_request_duration.observe((method, route_path), seconds)
+            http_requests.inc((method, route_path, str(status)))
+            if commands is not None and seconds * 1000 >= self.slow_request_ms:
+                self._log_slow_request(scope, status, seconds, commands)
+
+    def _log_slow_request(self, scope, status, seconds, commands):
+        query = scope.get("query_string", b"").decode("latin-1")
+        path = scope["path"] + (f"?{query}" if query else "")
+        mongo_ms = sum(milliseconds for _, _, milliseconds in commands)
+        issued = ", ".join(f"{name} {collection} {milliseconds}ms" for name, collection, milliseconds in commands)
+        logger.warning(
+            f"Slow request {scope['method']} {path} -> {status} in {seconds * 1000:.1f}ms; "
+            f"{len(commands)} Mongo commands ({mongo_ms:.1f}ms): {issued or 'none'}"
+        )
+
+
+def render(*families):
+    """Prometheus text exposition of the request and Mongo metrics plus extra line groups."""
+    lines = []
+    for metric in (http_request_duration, http_requests, mongo_command_duration, mongo_command_failures):
+        lines.extend(metric.render())
+    for family in families:
+        lines.extend(family)
+    return "\n".join(lines) + "\n"
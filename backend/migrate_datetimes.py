@@ -0,0 +1,125 @@
+"""Rewrite legacy ISO-string timestamps as native BSON dates.
+
+Older documents stored ``created_at``/``added_at``/``subscribed_at`` as ISO
+strings. This walks each collection in ``_id`` order, converting one batch
+at a time with an unordered bulk write, and records the last ``_id`` it
+finished in the ``migrations`` collection so an interrupted run resumes where
+it stopped. Each update is conditional on the field still holding the string
+it read, so documents the API rewrote in the meantime are left alone.
+
+The API reads both representations, and listing cursors page across a mix
+of strings and dates, so this can run while it serves traffic:
+
+    python migrate_datetimes.py --batch-size 1000 --pause 0.05
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+MIGRATION_ID = "native_datetimes"
+
+DATETIME_FIELDS = {
+    "products": "created_at",
+    "cart": "added_at",
+    "newsletter": "subscribed_at",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def parse_timestamp(value):
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def migrate_collection(db, collection_name, field, batch_size=1000, pause=0.0, restart=False):
+    """Convert ``field`` on every document of ``collection_name``; return the number rewritten."""
+    checkpoint_id = f"{MIGRATION_ID}:{collection_name}"
+    checkpoint = None if restart else await db.migrations.find_one({"_id": checkpoint_id})
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    converted = checkpoint.get("converted", 0) if checkpoint else 0
+    if last_id is not None:
+        logger.info(f"{collection_name}: resuming after _id {last_id} ({converted} converted so far)")
+
+    while True:
+        query = {field: {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db[collection_name].find(query, {field: 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        operations = []
+        for document in batch:
+            try:
+                value = parse_timestamp(document[field])
+            except ValueError:
+                logger.warning(f"{collection_name}: skipping {document['_id']}, unparseable {field} {document[field]!r}")
+                continue
+            operations.append(UpdateOne(
+                {"_id": document["_id"], field: document[field]},
+                {"$set": {field: value}},
+            ))
+        if operations:
+            result = await db[collection_name].bulk_write(operations, ordered=False)
+            converted += result.modified_count
+
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_id": last_id, "converted": converted, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+        logger.info(f"{collection_name}: {converted} converted, last _id {last_id}")
+        if pause:
+            # Leave headroom for API traffic between batches
+            await asyncio.sleep(pause)
+
+    return converted
+
+
+async def run(batch_size, pause, restart, collections):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        for collection_name in collections:
+            converted = await migrate_collection(
+                db, collection_name, DATETIME_FIELDS[collection_name], batch_size, pause, restart
+            )
+            logger.info(f"{collection_name}: done, {converted} documents converted")
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000, help="documents per bulk write")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints and start from the beginning")
+    parser.add_argument(
+        "--collection",
+        dest="collections",
+        action="append",
+        choices=sorted(DATETIME_FIELDS),
+        help="collection to migrate (repeatable, default: all)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(run(args.batch_size, args.pause, args.restart, args.collections or list(DATETIME_FIELDS)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Normalize legacy newsletter emails and drop the duplicates that creates.
+
+Signups from before emails were normalized kept whatever case and spacing
+the visitor typed, so ``Jane@Example.com`` and ``jane@example.com`` are two
+subscriptions. Lower-casing them in place would collide on the unique
+``email`` index, and that index can't be built while they exist.
+
+This reads every subscription in ``_id`` (signup) order, keeps the earliest
+of each normalized address and deletes the rest, then rewrites the survivors'
+emails in normalized form. Each rewrite is conditional on the email it read,
+so a signup changed in the meantime is left alone. Finally it builds the
+newsletter indexes and exits non-zero if they still can't be created.
+
+Run it before deploying the unique index, or whenever startup reports that
+the newsletter indexes failed:
+
+    python migrate_newsletter_emails.py
+"""
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from email_validator import EmailNotValidError
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, UpdateOne
+
+from indexes import INDEXES, IndexBuildError, ensure_indexes
+from models import normalize_email
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+
+def normalized(email):
+    try:
+        return normalize_email(email)
+    except EmailNotValidError:
+        # Kept, but still folded so case variants of it collapse too
+        return email.strip().lower()
+
+
+async def _write(collection, operations, batch_size):
+    for start in range(0, len(operations), batch_size):
+        await collection.bulk_write(operations[start:start + batch_size], ordered=False)
+
+
+async def migrate_emails(db, batch_size=1000, dry_run=False):
+    """Normalize and deduplicate ``newsletter`` emails; returns ``(rewritten, deleted)``."""
+    kept = {}  # normalized email -> _id of the earliest signup
+    deletes, rewrites = [], []
+    async for subscription in db.newsletter.find({}, {"email": 1}).sort("_id", 1):
+        email = subscription.get("email")
+        if not isinstance(email, str):
+            continue
+        address = normalized(email)
+        if address in kept:
+            deletes.append(DeleteOne({"_id": subscription["_id"]}))
+            continue
+        kept[address] = subscription["_id"]
+        if address != email:
+            rewrites.append(UpdateOne({"_id": subscription["_id"], "email": email}, {"$set": {"email": address}}))
+
+    if not dry_run:
+        # Duplicates go first, so a rewrite never collides with a row about to be deleted
+        await _write(db.newsletter, deletes, batch_size)
+        await _write(db.newsletter, rewrites, batch_size)
+    return len(rewrites), len(deletes)
+
+
+async def run(batch_size, dry_run):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        rewritten, deleted = await migrate_emails(db, batch_size, dry_run)
+        logger.info(f"newsletter: {rewritten} emails normalized, {deleted} duplicate signups deleted"
+                    + (" (dry run)" if dry_run else ""))
+        if not dry_run:
+            await ensure_indexes(db, {"newsletter": INDEXES["newsletter"]})
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000, help="operations per bulk write")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(run(args.batch_size, args.dry_run))
+    except IndexBuildError as e:
+        logger.error(str(e))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,340 @@
+"""Pydantic models and enums shared by the API routes and the command-line tools."""
+from email_validator import EmailNotValidError, validate_email
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Optional, Union
+import uuid
+from datetime import datetime, timezone
+from enum import Enum
+
+# Enums
+class SkinType(str, Enum):
+    DRY = "dry"
+    OILY = "oily"
+    SENSITIVE = "sensitive"
+    COMBO = "combination"
+
+class Category(str, Enum):
+    SKINCARE = "skincare"
+    LIPS = "lips"
+    EYES = "eyes"
+    TOOLS = "tools"
+
+class ProductSort(str, Enum):
+    FEATURED = "featured"
+    NEWEST = "newest"
+    PRICE_LOW = "price-low"
+    PRICE_HIGH = "price-high"
+    RATING = "rating"
+    TRENDING = "trending"
+
+class ProductView(str, Enum):
+    FULL = "full"
+    SUMMARY = "summary"
+
+class ImageFormat(str, Enum):
+    WEBP = "webp"
+    JPEG = "jpeg"
+
+# One resized rendition of a product image; a srcset entry is "<url> <width>w"
+class ImageVariant(BaseModel):
+    url: str
+    width: int
+    format: ImageFormat
+
+# Product Models
+class Product(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    description: str
+    short_description: str
+    price: float
+    original_price: Optional[float] = None
+    category: Category
+    skin_types: List[SkinType]
+    ingredients: List[str]
+    tags: List[str]
+    image_url: str
+    images: List[str] = []
+    image_variants: List[ImageVariant] = []  # of image_url, once it has been ingested (see images.py)
+    rating: float = 5.0
+    review_count: int = 0
+    stock: int = 100
+    stock_shards: int = 0  # >0 when stock lives in sharded counters (see inventory.py)
+    is_featured: bool = False
+    is_new: bool = False
+    is_viral: bool = False
+    trending_score: float = 0.0  # forward-decayed demand, maintained by analytics.py
+    benefits: List[str] = []
+    how_to_use: str = ""
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    deleted_at: Optional[datetime] = None
+
+# The product document as written to Mongo; the supplier fields are never served by the API
+class StoredProduct(Product):
+    cost: Optional[float] = None  # unit cost from the supplier; input to repricing rules
+    supplier: Optional[str] = None
+    supplier_sku: Optional[str] = None
+
+# What listing cards render; served by GET /api/products?view=summary
+class ProductSummary(BaseModel):
+    id: str
+    name: str
+    short_description: str
+    price: float
+    original_price: Optional[float] = None
+    category: Category
+    skin_types: List[SkinType]
+    image_url: str
+    image_variants: List[ImageVariant] = []
+    rating: float = 5.0
+    review_count: int = 0
+    is_featured: bool = False
+    is_new: bool = False
+    is_viral: bool = False
+    trending_score: float = 0.0
+    created_at: datetime
+
+# Batch lookup by id
+MAX_BATCH_IDS = 100
+
+class ProductBatchRequest(BaseModel):
+    ids: List[str] = Field(min_length=1, max_length=MAX_BATCH_IDS)
+
+class ProductBatch(BaseModel):
+    products: List[Optional[Product]]  # in request order, None where the id wasn't found
+    missing: List[str]
+
+# Delta sync from the catalog change log
+MAX_CHANGES_PER_REQUEST = 500
+
+class CatalogChanges(BaseModel):
+    version: int  # pass as ``since`` on the next call
+    resync: bool = False  # the log no longer reaches back to ``since``; reload the full listing
+    has_more: bool = False
+    upserted: List[Union[Product, ProductSummary]] = []
+    removed: List[str] = []
+
+class ProductCreate(BaseModel):
+    name: str
+    description: str
+    short_description: str
+    price: float
+    original_price: Optional[float] = None
+    cost: Optional[float] = None
+    category: Category
+    skin_types: List[SkinType]
+    ingredients: List[str]
+    tags: List[str]
+    image_url: str
+    images: List[str] = []
+    is_featured: bool = False
+    is_new: bool = False
+    is_viral: bool = False
+    benefits: List[str] = []
+    how_to_use: str = ""
+
+class CartItem(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    cart_id: Optional[str] = None
+    product_id: str
+    quantity: int
+    added_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+
+class CartItemCreate(BaseModel):
+    product_id: str
+    quantity: int = Field(1, ge=1)
+
+class CartProduct(BaseModel):
+    id: str
+    name: str
+    short_description: str
+    category: Category
+    image_url: str
+    price: float
+    original_price: Optional[float] = None
+
+class CartLine(BaseModel):
+    id: str
+    product_id: str
+    quantity: int
+    product: Optional[CartProduct] = None  # None when the product no longer exists
+    line_total: float
+    line_savings: float
+
+class CartView(BaseModel):
+    cart_id: str
+    items: List[CartLine]
+    item_count: int
+    subtotal: float
+    savings: float
+
+# Filter sidebar counts
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class PriceBucketCount(BaseModel):
+    min: float
+    max: Optional[float] = None  # None for the open-ended top bucket
+    count: int
+
+class ProductFacets(BaseModel):
+    total: int
+    categories: List[FacetCount]
+    skin_types: List[FacetCount]
+    tags: List[FacetCount]
+    price_ranges: List[PriceBucketCount]
+
+# Checkout
+class StockAllocation(BaseModel):
+    shard: Optional[int] = None
+    quantity: int
+
+class ReservationItem(BaseModel):
+    product_id: str
+    quantity: int
+    allocations: List[StockAllocation]
+
+class Reservation(BaseModel):
+    id: str
+    cart_id: Optional[str] = None
+    status: str
+    items: List[ReservationItem]
+    created_at: datetime
+    expires_at: datetime
+
+class StockLevel(BaseModel):
+    product_id: str
+    stock: int
+    shards: int = 0
+
+class StockShardRequest(BaseModel):
+    shards: int = Field(ge=2, le=256)
+
+# Supplier feed rows: the catalog fields plus the supplier's SKU and stock level
+class FeedProduct(ProductCreate):
+    sku: str = Field(min_length=1)
+    stock: int = 100
+
+# Bulk import
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportReport(BaseModel):
+    rows: int = 0
+    inserted: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
+    errors_truncated: bool = False
+    elapsed_seconds: float = 0.0
+    rows_per_second: float = 0.0
+
+class SyncReport(BaseModel):
+    supplier: str
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    deletes_skipped: bool = False
+    failed: int = 0
+    errors: List[ImportRowError] = []
+    errors_truncated: bool = False
+    elapsed_seconds: float = 0.0
+    rows_per_second: float = 0.0
+
+# Product images
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+class ImageIngestRequest(BaseModel):
+    url: Optional[str] = None  # defaults to the product's current image_url
+    product_id: Optional[str] = None  # attach the variants to this product
+
+class ImageAsset(BaseModel):
+    digest: str  # SHA-256 of the original
+    format: str
+    width: int
+    height: int
+    variants: List[ImageVariant]
+    product_id: Optional[str] = None
+
+# Bulk repricing
+MAX_REPORTED_CHANGES = 10000
+
+class PricingRule(BaseModel):
+    category: Optional[Category] = None  # None applies to every category without its own rule
+    markup: float = Field(gt=0)  # price = cost * markup
+    ending: Optional[float] = Field(0.99, ge=0, lt=1)  # cents every price ends in; None keeps plain cents
+    max_discount: Optional[float] = Field(None, ge=0, lt=1)  # floor of original_price * (1 - max_discount)
+
+class RepricingRequest(BaseModel):
+    rules: List[PricingRule] = Field(min_length=1)
+    dry_run: bool = True
+    diff_limit: int = Field(100, ge=0, le=MAX_REPORTED_CHANGES)
+
+class PriceChange(BaseModel):
+    id: str
+    name: str
+    category: Category
+    cost: float
+    old_price: float
+    new_price: float
+    original_price: Optional[float] = None
+    capped: bool = False  # raised to respect the rule's max_discount
+
+class RepricingReport(BaseModel):
+    dry_run: bool
+    products: int = 0
+    priced: int = 0
+    changed: int = 0
+    increased: int = 0
+    decreased: int = 0
+    capped: int = 0
+    skipped_no_cost: int = 0
+    skipped_no_rule: int = 0
+    written: int = 0
+    conflicts: int = 0  # price changed by someone else between load and write; left alone
+    changes: List[PriceChange] = []  # largest moves first, up to diff_limit
+    changes_truncated: bool = False
+    elapsed_seconds: float = 0.0
+
+# Product analytics events
+MAX_EVENTS_PER_REQUEST = 100
+
+class EventType(str, Enum):
+    VIEW = "view"
+    ADD_TO_CART = "add_to_cart"
+
+class ProductEvent(BaseModel):
+    product_id: str = Field(max_length=64)
+    type: EventType
+
+class ProductEventBatch(BaseModel):
+    events: List[ProductEvent] = Field(min_length=1, max_length=MAX_EVENTS_PER_REQUEST)
+
+class EventsAccepted(BaseModel):
+    accepted: int
+    dropped: int
+
+class NewsletterSubscription(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    email: str
+    subscribed_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+def normalize_email(value):
+    """Trimmed and lower-cased, so the unique index treats case variants as one address."""
+    email = validate_email(value.strip(), check_deliverability=False)
+    return email.normalized.lower()
+
+class NewsletterSubscriptionCreate(BaseModel):
+    email: str
+
+    @field_validator("email")
+    @classmethod
+    def normalize_email(cls, value):
+        try:
+            return normalize_email(value)
+        except EmailNotValidError as e:
+            raise ValueError(str(e))
@@ -0,0 +1,114 @@
+"""Server-side sort orders and opaque keyset cursors for product listings.
+
+Every sort ends with ``id`` as a unique tie-breaker, so a page boundary can be
+described by the sort-key values of the last product on the page. The next
+page is then a range condition on those keys instead of a skip/offset, which
+lets Mongo walk the matching index and keeps every page equally cheap.
+"""
+import base64
+import json
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING
+
+DEFAULT_SORT = "featured"
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 200
+
+# Same orderings as the ShopPage sort dropdown
+SORT_SPECS = {
+    "featured": [("is_featured", DESCENDING), ("rating", DESCENDING), ("id", ASCENDING)],
+    "newest": [("created_at", DESCENDING), ("id", ASCENDING)],
+    "price-low": [("price", ASCENDING), ("id", ASCENDING)],
+    "price-high": [("price", DESCENDING), ("id", DESCENDING)],
+    "rating": [("rating", DESCENDING), ("id", ASCENDING)],
+    "trending": [("trending_score", DESCENDING), ("id", ASCENDING)],
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def encode_cursor(sort, product):
+    """Build the cursor that resumes ``sort`` right after ``product``."""
+    values = [_encode_value(product.get(field)) for field, _ in SORT_SPECS[sort]]
+    payload = json.dumps({"s": sort, "v": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(sort, cursor):
+    """Return the sort-key values stored in ``cursor``, checking it belongs to ``sort``."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = [_decode_value(value) for value in payload["v"]]
+        cursor_sort = payload["s"]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+    if cursor_sort != sort or len(values) != len(SORT_SPECS[sort]):
+        raise InvalidCursor("Cursor does not match the requested sort")
+    return values
+
+
+# Mongo orders values of different types by type first, in this order. Only the
+# types a catalog sort key can hold are listed; a missing field sorts as null.
+TYPE_ORDER = ["null", "number", "string", "bool", "date"]
+
+
+def _type_name(value):
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime):
+        return "date"
+    raise InvalidCursor("Malformed cursor")
+
+
+def _after(field, direction, value):
+    """Conditions, any of which puts ``field`` strictly after ``value``."""
+    position = TYPE_ORDER.index(_type_name(value))
+    later_types = TYPE_ORDER[position + 1:] if direction == ASCENDING else TYPE_ORDER[:position]
+    # Nothing sorts between null and another null
+    conditions = [] if value is None else [{field: {"$gt" if direction == ASCENDING else "$lt": value}}]
+    # A comparison only matches values of its own type, so the other types are spelled out
+    for type_name in later_types:
+        # Equality with None also matches documents missing the field, which $type doesn't
+        conditions.append({field: None} if type_name == "null" else {field: {"$type": type_name}})
+    return conditions
+
+
+def keyset_filter(sort, values):
+    """Mongo filter matching documents strictly after ``values`` in ``sort`` order.
+
+    For keys (k1, k2, k3) this expands to
+    ``k1 > v1 OR (k1 = v1 AND k2 > v2) OR (k1 = v1 AND k2 = v2 AND k3 > v3)``
+    with ``>`` flipped to ``<`` on descending keys. Each ``>`` also matches the
+    types that sort after the value's own type, so a field holding a mix of
+    types (say ``created_at`` part way through a migration from strings to
+    dates) pages through all of them, and nulls and missing keys aren't
+    skipped.
+    """
+    spec = SORT_SPECS[sort]
+    branches = []
+    for position, (field, direction) in enumerate(spec):
+        prefix = {prefix_field: values[i] for i, (prefix_field, _) in enumerate(spec[:position])}
+        branches += [{**prefix, **condition} for condition in _after(field, direction, values[position])]
+    return {"$or": branches}
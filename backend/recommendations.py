@@ -0,0 +1,285 @@
+"""In-memory "similar products" over category, skin types, tags and ingredients.
+
+Each product becomes a row of a NumPy matrix: its features are hashed into
+``FEATURE_DIMS`` buckets and weighted by field and IDF, and every row is
+L2-normalised. A dot product between two rows is then their cosine
+similarity. The top ``NEIGHBOURS`` rows for every product are precomputed in
+blocks of matrix products and served straight from memory.
+
+Changes don't recompute all pairs. A product that is added, changed or
+removed has its own row recomputed, along with two kinds of affected row:
+rows that list it as a neighbour, and rows for which it now beats the
+current weakest neighbour. That costs one pass of ``matrix @ changed.T``.
+IDF weights follow the live document frequencies, but rows that didn't
+change keep the weights they were encoded with until the next rebuild.
+
+The heavy numeric work runs in a worker thread, so reads stay on the event
+loop. Writes are queued with ``submit`` and applied in order by one
+background task, which waits ``BATCH_DELAY_SECONDS`` for more before each
+batch. The thread never touches the arrays being read: a build or
+a batch of changes produces new arrays, which are swapped in on the event
+loop once complete, so ``similar`` never sees a half-applied batch.
+"""
+import asyncio
+import logging
+import math
+import zlib
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FEATURE_DIMS = 256
+NEIGHBOURS = 12
+BLOCK_ROWS = 512
+# How long queued writes wait for more, so a bulk job's chunks are applied as one copy of the arrays
+BATCH_DELAY_SECONDS = 0.5
+
+FIELD_WEIGHTS = {
+    "category": 1.0,
+    "skin_types": 0.5,
+    "tags": 1.0,
+    "ingredients": 1.5,
+}
+
+SIMILARITY_PROJECTION = {"_id": 0, "id": 1, **{field: 1 for field in FIELD_WEIGHTS}}
+
+
+def product_features(product):
+    values = []
+    for field in FIELD_WEIGHTS:
+        value = product.get(field)
+        if not value:
+            continue
+        for item in value if isinstance(value, list) else [value]:
+            values.append(f"{field}:{str(getattr(item, 'value', item)).strip().lower()}")
+    return sorted(set(values))
+
+
+def _bucket(feature, dims):
+    return zlib.crc32(feature.encode()) % dims
+
+
+class SimilarProducts:
+    def __init__(self, dims=FEATURE_DIMS, neighbours=NEIGHBOURS, batch_delay=BATCH_DELAY_SECONDS):
+        self.dims = dims
+        self.k = neighbours
+        self.batch_delay = batch_delay
+        self.ready = False
+        self._lock = asyncio.Lock()
+        self._pending = []
+        self._worker = None
+        self._reset()
+
+    def _reset(self, capacity=0):
+        self._ids = []  # row -> product id
+        self._rows = {}  # product id -> row
+        self._features = []  # row -> feature keys, for keeping document frequencies current
+        self._document_frequency = Counter()
+        self._active_count = 0
+        self._vectors = np.zeros((capacity, self.dims), dtype=np.float32)
+        self._active = np.zeros(capacity, dtype=bool)
+        self._neighbours = np.full((capacity, self.k), -1, dtype=np.int32)
+        self._scores = np.zeros((capacity, self.k), dtype=np.float32)
+
+    def __len__(self):
+        return self._active_count
+
+    def similar(self, product_id, limit=NEIGHBOURS):
+        """Ids of the most similar products, best first; empty if the product isn't indexed."""
+        row = self._rows.get(product_id)
+        if row is None or not self._active[row]:
+            return []
+        ids = self._ids
+        return [ids[neighbour] for neighbour in self._neighbours[row][:limit] if neighbour >= 0]
+
+    # Encoding
+
+    def _encode(self, features):
+        vector = np.zeros(self.dims, dtype=np.float32)
+        total = max(self._active_count, 1)
+        for feature in features:
+            field = feature.split(":", 1)[0]
+            idf = math.log((1 + total) / (1 + self._document_frequency[feature])) + 1.0
+            vector[_bucket(feature, self.dims)] += FIELD_WEIGHTS[field] * idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _grow(self, rows_needed):
+        capacity = len(self._active)
+        if rows_needed <= capacity:
+            return
+        capacity = max(rows_needed, capacity * 2, 64)
+        extra = capacity - len(self._active)
+        self._vectors = np.vstack([self._vectors, np.zeros((extra, self.dims), dtype=np.float32)])
+        self._active = np.concatenate([self._active, np.zeros(extra, dtype=bool)])
+        self._neighbours = np.vstack([self._neighbours, np.full((extra, self.k), -1, dtype=np.int32)])
+        self._scores = np.vstack([self._scores, np.zeros((extra, self.k), dtype=np.float32)])
+
+    # Neighbour computation
+
+    def _top_k(self, rows, scores):
+        """Write the best ``k`` positive-scoring columns of ``scores`` as the neighbours of ``rows``."""
+        count = len(self._ids)
+        # Removed rows have zero vectors, so they score 0 and are dropped below with the other non-matches
+        scores[np.arange(len(rows)), rows] = -np.inf
+        k = min(self.k, count)
+        if k == 0:
+            return
+        best = np.argpartition(scores, count - k, axis=1)[:, count - k:]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        keep = best_scores > 0
+        neighbours = np.full((len(rows), self.k), -1, dtype=np.int32)
+        neighbour_scores = np.zeros((len(rows), self.k), dtype=np.float32)
+        neighbours[:, :k] = np.where(keep, best, -1)
+        neighbour_scores[:, :k] = np.where(keep, best_scores, 0)
+        self._neighbours[rows] = neighbours
+        self._scores[rows] = neighbour_scores
+
+    def _refresh(self, rows):
+        vectors = self._vectors[:len(self._ids)]
+        for start in range(0, len(rows), BLOCK_ROWS):
+            block = rows[start:start + BLOCK_ROWS]
+            self._top_k(block, vectors[block] @ vectors.T)
+
+    def _load(self, products):
+        """Build from scratch (runs in a worker thread on a fresh instance)."""
+        features = [product_features(product) for product in products]
+        self._reset(capacity=len(products))
+        for product, product_features_ in zip(products, features):
+            self._rows[product["id"]] = len(self._ids)
+            self._ids.append(product["id"])
+            self._features.append(product_features_)
+            self._document_frequency.update(product_features_)
+        self._active[:len(self._ids)] = True
+        self._active_count = len(self._ids)
+        for row, product_features_ in enumerate(self._features):
+            self._vectors[row] = self._encode(product_features_)
+        self._refresh(np.arange(len(self._ids)))
+
+    def _updated(self, upserts, removed_ids):
+        """A copy with one batch of changes applied (runs in a worker thread; ``self`` is only read)."""
+        updated = SimilarProducts(self.dims, self.k)
+        updated._ids = list(self._ids)
+        updated._rows = dict(self._rows)
+        updated._features = list(self._features)
+        updated._document_frequency = Counter(self._document_frequency)
+        updated._active_count = self._active_count
+        updated._vectors = self._vectors.copy()
+        updated._active = self._active.copy()
+        updated._neighbours = self._neighbours.copy()
+        updated._scores = self._scores.copy()
+        updated._apply(upserts, removed_ids)
+        return updated
+
+    def _apply(self, upserts, removed_ids):
+        """Apply one batch of changes in place, recomputing only the affected rows.
+
+        Only ever called on a copy no reader can see yet; see ``_updated``.
+        """
+        changed, removed = [], []
+        for product_id in removed_ids:
+            row = self._rows.get(product_id)
+            if row is None or not self._active[row]:
+                continue
+            self._document_frequency.subtract(self._features[row])
+            self._features[row] = []
+            self._active[row] = False
+            self._active_count -= 1
+            self._vectors[row] = 0
+            self._neighbours[row] = -1
+            self._scores[row] = 0
+            removed.append(row)
+
+        for product in upserts:
+            row = self._rows.get(product["id"])
+            if row is None:
+                row = len(self._ids)
+                self._grow(row + 1)
+                self._rows[product["id"]] = row
+                self._ids.append(product["id"])
+                self._features.append([])
+            self._document_frequency.subtract(self._features[row])
+            self._features[row] = product_features(product)
+            self._document_frequency.update(self._features[row])
+            if not self._active[row]:
+                self._active[row] = True
+                self._active_count += 1
+            changed.append(row)
+        for row in changed:
+            self._vectors[row] = self._encode(self._features[row])
+
+        touched = changed + removed
+        if not touched:
+            return
+        count = len(self._ids)
+        vectors = self._vectors[:count]
+        # Rows listing a touched product have a stale score (or a product that's gone)
+        stale = np.isin(self._neighbours[:count], touched).any(axis=1)
+        # Rows for which a changed product now beats the weakest current neighbour
+        weakest = self._scores[:count, -1]
+        for start in range(0, len(changed), BLOCK_ROWS):
+            block = changed[start:start + BLOCK_ROWS]
+            stale |= (vectors @ vectors[block].T).max(axis=1) > weakest
+        stale[changed] = True
+        stale &= self._active[:count]
+        self._refresh(np.flatnonzero(stale))
+
+    # Async entry points
+
+    async def rebuild(self, cursor):
+        """Replace the index with every document yielded by an async cursor."""
+        async with self._lock:
+            await self._build(cursor)
+
+    async def ensure_ready(self, load_cursor):
+        """Build from ``load_cursor()`` unless already built; concurrent callers share one build."""
+        async with self._lock:
+            if not self.ready:
+                await self._build(load_cursor())
+
+    async def _build(self, cursor):
+        products = [product async for product in cursor]
+        built = SimilarProducts(self.dims, self.k)
+        await asyncio.get_running_loop().run_in_executor(None, built._load, products)
+        self._swap(built)
+        self.ready = True
+
+    def _swap(self, other):
+        # On the event loop, like every read, so no read sees a mix of old and new arrays
+        (self._ids, self._rows, self._features, self._document_frequency, self._active_count,
+         self._vectors, self._active, self._neighbours, self._scores) = (
+            other._ids, other._rows, other._features, other._document_frequency, other._active_count,
+            other._vectors, other._active, other._neighbours, other._scores)
+
+    def submit(self, upserts=(), removed_ids=()):
+        """Queue product documents to (re-)index and ids to drop; applied in the background."""
+        self._pending.append((list(upserts), list(removed_ids)))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        while self._pending:
+            # Let the rest of a burst of submits queue up behind the first
+            await asyncio.sleep(self.batch_delay)
+            batches, self._pending = self._pending, []
+            # Collapse the queue: the last write per product wins
+            upserts, removed = {}, set()
+            for batch_upserts, batch_removed in batches:
+                for product_id in batch_removed:
+                    upserts.pop(product_id, None)
+                    removed.add(product_id)
+                for product in batch_upserts:
+                    removed.discard(product["id"])
+                    upserts[product["id"]] = product
+            try:
+                async with self._lock:
+                    updated = await asyncio.get_running_loop().run_in_executor(
+                        None, self._updated, list(upserts.values()), list(removed))
+                    self._swap(updated)
+            except Exception:
+                logger.exception("Failed to update similar-product neighbours")
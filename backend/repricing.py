@@ -0,0 +1,255 @@
+"""Vectorized bulk repricing from cost, markup and discount rules.
+
+The catalog's price columns (``cost``, ``price``, ``original_price``,
+``category``) are loaded into one DataFrame, and each rule is applied to its
+category with NumPy array arithmetic rather than product by product:
+
+1. ``cost * markup``
+2. rounded to the nearest price ending in ``ending`` (``23.99``, ``24.99``)
+3. if ``max_discount`` is set and the product has an ``original_price``,
+   raised to the cheapest ending at or above
+   ``original_price * (1 - max_discount)``, but never above ``original_price``
+
+A rule with no category applies to every category without its own rule.
+Products without a cost, or with no rule for their category, keep their
+price.
+
+A dry run only reports the diff. Otherwise the changed prices, and only
+those, go back through unordered ``bulk_write`` batches. Each update is
+guarded on the price that was loaded, so a price edited in the meantime is
+left alone and counted as a conflict.
+
+Command line, against the database in ``.env``:
+
+    python repricing.py rules.json --diff diff.csv          # dry run
+    python repricing.py rules.json --apply
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import TypeAdapter
+from pymongo import UpdateOne
+
+from changelog import ChangeLog
+from models import PriceChange, PricingRule, RepricingReport
+
+logger = logging.getLogger(__name__)
+
+LOAD_BATCH_SIZE = 10000
+WRITE_BATCH_SIZE = 5000
+
+PRICE_PROJECTION = {"_id": 0, "id": 1, "name": 1, "category": 1, "cost": 1, "price": 1, "original_price": 1}
+PRICE_COLUMNS = ["id", "name", "category", "cost", "price", "original_price"]
+
+
+class InvalidRules(ValueError):
+    pass
+
+
+def _category_key(category):
+    return getattr(category, "value", category)
+
+
+def rule_columns(categories, rules):
+    """Per-product ``markup``, ``ending`` and ``max_discount`` arrays (NaN where no rule applies)."""
+    by_category = {}
+    for rule in rules:
+        key = _category_key(rule.category)
+        if key in by_category:
+            raise InvalidRules(f"More than one rule for {key or 'the default category'}")
+        by_category[key] = rule
+
+    count = len(categories)
+    columns = {name: np.full(count, np.nan) for name in ("markup", "ending", "max_discount")}
+    explicit = [key for key in by_category if key is not None]
+    for key, rule in by_category.items():
+        mask = ~np.isin(categories, explicit) if key is None else categories == key
+        columns["markup"][mask] = rule.markup
+        columns["ending"][mask] = np.nan if rule.ending is None else rule.ending
+        columns["max_discount"][mask] = np.nan if rule.max_discount is None else rule.max_discount
+    return columns
+
+
+def _to_ending(values, ending, round_up=False):
+    """``values`` moved to the nearest (or next) price ending in ``ending``; plain cents where it's NaN."""
+    has_ending = ~np.isnan(ending)
+    offset = np.where(has_ending, ending, 0.0)
+    if round_up:
+        # Small tolerances keep exact floors (19.99 for a 19.99 floor) from jumping a step
+        charm = np.ceil(values - offset - 1e-9) + offset
+        cents = np.ceil(values * 100 - 1e-6) / 100
+    else:
+        charm = np.round(values - offset) + offset
+        cents = np.round(values, 2)
+    return np.where(has_ending, charm, cents)
+
+
+def evaluate(frame, rules):
+    """Add ``new_price`` and ``capped`` columns to a price frame; ``new_price`` is NaN where it can't be priced."""
+    columns = rule_columns(frame["category"].to_numpy(dtype=object), rules)
+    cost = frame["cost"].to_numpy(dtype=float)
+    original = frame["original_price"].to_numpy(dtype=float)
+
+    target = _to_ending(cost * columns["markup"], columns["ending"])
+    # NaN original prices or discounts give a NaN floor, and NaN compares False
+    floor = original * (1 - columns["max_discount"])
+    with np.errstate(invalid="ignore"):
+        capped = target < floor
+    raised = np.minimum(_to_ending(floor, columns["ending"], round_up=True), original)
+    new_price = np.round(np.where(capped, raised, target), 2)
+    with np.errstate(invalid="ignore"):
+        new_price[~(new_price > 0)] = np.nan
+
+    frame = frame.assign(new_price=new_price, capped=capped, has_rule=~np.isnan(columns["markup"]))
+    return frame
+
+
+def price_frame(documents):
+    frame = pd.DataFrame.from_records(documents, columns=PRICE_COLUMNS)
+    frame["category"] = frame["category"].map(_category_key)
+    for column in ("cost", "price", "original_price"):
+        frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    return frame
+
+
+async def load_prices(collection):
+    return await collection.find({"deleted_at": None}, PRICE_PROJECTION).batch_size(LOAD_BATCH_SIZE).to_list(
+        length=None)
+
+
+def diff(frame, rules, dry_run, diff_limit):
+    """Evaluate ``rules`` over ``frame``; returns the report and the frame of changed rows."""
+    report = RepricingReport(dry_run=dry_run, products=len(frame))
+    priced = evaluate(frame, rules)
+    has_cost = priced["cost"].notna()
+    report.skipped_no_cost = int((~has_cost).sum())
+    report.skipped_no_rule = int((has_cost & ~priced["has_rule"]).sum())
+    valid = priced["new_price"].notna()
+    report.priced = int(valid.sum())
+
+    delta = priced["new_price"] - priced["price"]
+    changed = priced[valid & (delta.abs() >= 0.005)].assign(delta=delta)
+    report.changed = len(changed)
+    report.increased = int((changed["delta"] > 0).sum())
+    report.decreased = int((changed["delta"] < 0).sum())
+    report.capped = int(changed["capped"].sum())
+
+    largest = changed.loc[changed["delta"].abs().sort_values(ascending=False).index[:diff_limit]]
+    report.changes = [
+        PriceChange(
+            id=row.id,
+            name=row.name,
+            category=row.category,
+            cost=row.cost,
+            old_price=row.price,
+            new_price=row.new_price,
+            original_price=None if pd.isna(row.original_price) else row.original_price,
+            capped=bool(row.capped),
+        )
+        for row in largest.itertuples(index=False)
+    ]
+    report.changes_truncated = len(changed) > diff_limit
+    return report, changed
+
+
+async def write_prices(collection, changed):
+    """Write ``new_price`` for the changed rows, guarded on the loaded price; returns ``(written ids, conflicts)``."""
+    now = datetime.now(timezone.utc)
+    # Mongo keeps milliseconds; truncate so the stamp can be matched when reading back
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    written_ids, conflicts = [], 0
+    ids, old_prices, new_prices = (changed[column].tolist() for column in ("id", "price", "new_price"))
+    for start in range(0, len(ids), WRITE_BATCH_SIZE):
+        batch_ids = ids[start:start + WRITE_BATCH_SIZE]
+        operations = [
+            UpdateOne({"id": product_id, "price": old_price, "deleted_at": None},
+                      {"$set": {"price": new_price, "repriced_at": now}})
+            for product_id, old_price, new_price in zip(
+                batch_ids,
+                old_prices[start:start + WRITE_BATCH_SIZE],
+                new_prices[start:start + WRITE_BATCH_SIZE],
+            )
+        ]
+        result = await collection.bulk_write(operations, ordered=False)
+        if result.matched_count == len(operations):
+            written_ids += batch_ids
+            continue
+        conflicts += len(operations) - result.matched_count
+        # The result only has counts; the rows this run wrote carry its stamp
+        async for document in collection.find({"id": {"$in": batch_ids}, "repriced_at": now}, {"_id": 0, "id": 1}):
+            written_ids.append(document["id"])
+    return written_ids, conflicts
+
+
+async def reprice(collection, rules, dry_run=True, diff_limit=100, on_repriced=None):
+    """Load, evaluate and (unless ``dry_run``) write back; returns ``(report, changed frame)``.
+
+    ``on_repriced`` is awaited with ``{product_id: new_price}`` for the rows
+    written, so the caller can refresh caches and indexes. Rows that lost the
+    guarded write to a concurrent edit are left out.
+    """
+    started = time.perf_counter()
+    documents = await load_prices(collection)
+    # The array work is CPU-bound; keep it off the event loop
+    report, changed = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: diff(price_frame(documents), rules, dry_run, diff_limit))
+    if not dry_run and len(changed):
+        written_ids, report.conflicts = await write_prices(collection, changed)
+        report.written = len(written_ids)
+        if on_repriced and written_ids:
+            written = changed[changed["id"].isin(written_ids)]
+            await on_repriced(dict(zip(written["id"], written["new_price"])))
+    report.elapsed_seconds = round(time.perf_counter() - started, 3)
+    return report, changed
+
+
+async def run(rules, apply, diff_path):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        db = client[os.environ['DB_NAME']]
+        # Running servers follow the change log to pick up the new prices
+        changelog = ChangeLog(db, retention_seconds=0)
+
+        async def on_repriced(prices):
+            try:
+                await changelog.record(list(prices))
+            except Exception:
+                # The prices are in; servers pick them up on their next full resync
+                logger.exception("Failed to record catalog changes")
+
+        report, changed = await reprice(db.products, rules, dry_run=not apply, diff_limit=0, on_repriced=on_repriced)
+        if diff_path:
+            changed[["id", "name", "category", "cost", "price", "new_price", "original_price", "capped"]].rename(
+                columns={"price": "old_price"}).to_csv(diff_path, index=False)
+        return report
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprice the catalog from cost, markup and discount rules")
+    parser.add_argument("rules", help="JSON file with a list of pricing rules")
+    parser.add_argument("--apply", action="store_true", help="write the new prices (default: dry run)")
+    parser.add_argument("--diff", dest="diff_path", help="write every price change to this CSV file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with open(args.rules) as rules_file:
+        rules = TypeAdapter(list[PricingRule]).validate_python(json.load(rules_file))
+    report = asyncio.run(run(rules, args.apply, args.diff_path))
+    print(json.dumps(report.dict(exclude={"changes"}), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""In-process inverted index for ranked product search.
+
+Products are tokenized over name, short_description, description, ingredients
+and tags. Each field carries a weight, so a hit in the name counts for more
+than a hit deep in the description (BM25F-style). The last query term is
+expanded as a prefix so the search box can be used as a type-ahead.
+"""
+import asyncio
+import math
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Field weights applied to term frequencies before BM25 saturation
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "tags": 2.0,
+    "short_description": 1.5,
+    "ingredients": 1.5,
+    "description": 1.0,
+}
+
+# Fields kept next to each posting list so filters don't need a Mongo round trip
+FILTER_FIELDS = ("category", "skin_types", "price")
+
+# Projection for loading just what the index needs from Mongo
+INDEX_PROJECTION = {"_id": 0, "id": 1, **{field: 1 for field in (*FIELD_WEIGHTS, *FILTER_FIELDS)}}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_PREFIX_EXPANSIONS = 50
+
+
+def tokenize(text):
+    if not text:
+        return []
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(part) for part in text)
+    return TOKEN_RE.findall(str(text).lower())
+
+
+class ProductSearchIndex:
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self.ready = False
+        self._replay = None  # writes made while a rebuild reads the collection, for the rebuilt index
+        self._reset()
+
+    def _reset(self):
+        self._postings = defaultdict(dict)  # term -> {product_id: weighted tf}
+        self._terms = []  # sorted vocabulary, used for prefix expansion
+        self._doc_terms = {}  # product_id -> set of terms, used for removal
+        self._doc_lengths = {}
+        self._doc_meta = {}
+        self._total_length = 0.0
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def _record(self, method, *args):
+        # The rebuild's cursor may already have passed this product
+        if self._replay is not None:
+            self._replay.append((method, args))
+
+    def add(self, product):
+        """Index (or re-index) a single product document."""
+        self._record("add", product)
+        product_id = product["id"]
+        if product_id in self._doc_lengths:
+            self._remove(product_id)
+
+        frequencies = defaultdict(float)
+        length = 0.0
+        for field, weight in FIELD_WEIGHTS.items():
+            tokens = tokenize(product.get(field))
+            length += len(tokens) * weight
+            for token in tokens:
+                frequencies[token] += weight
+
+        for term, frequency in frequencies.items():
+            postings = self._postings[term]
+            if not postings:
+                insort(self._terms, term)
+            postings[product_id] = frequency
+
+        self._doc_terms[product_id] = set(frequencies)
+        self._doc_lengths[product_id] = length
+        self._doc_meta[product_id] = {field: product.get(field) for field in FILTER_FIELDS}
+        self._total_length += length
+
+    def remove(self, product_id):
+        self._record("remove", product_id)
+        self._remove(product_id)
+
+    def _remove(self, product_id):
+        terms = self._doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+                index = bisect_left(self._terms, term)
+                if index < len(self._terms) and self._terms[index] == term:
+                    del self._terms[index]
+        self._total_length -= self._doc_lengths.pop(product_id)
+        self._doc_meta.pop(product_id, None)
+
+    def update_prices(self, prices):
+        """Refresh the price filter of indexed products from ``{product_id: price}``."""
+        self._record("update_prices", dict(prices))
+        for product_id, price in prices.items():
+            meta = self._doc_meta.get(product_id)
+            if meta is not None:
+                meta["price"] = price
+
+    async def rebuild(self, cursor):
+        """Replace the index contents with every document yielded by an async cursor.
+
+        The new index is built aside and swapped in, so searches keep using the
+        old contents until it is complete.
+        """
+        async with self._lock:
+            await self._build(cursor)
+
+    async def ensure_ready(self, load_cursor):
+        """Build from ``load_cursor()`` unless already built; concurrent callers share one build."""
+        async with self._lock:
+            if not self.ready:
+                await self._build(load_cursor())
+
+    async def _build(self, cursor):
+        built = ProductSearchIndex()
+        self._replay = []
+        try:
+            async for product in cursor:
+                built.add(product)
+            # Writes to the live index while the cursor was read; no await from here to the swap
+            for method, args in self._replay:
+                getattr(built, method)(*args)
+        finally:
+            self._replay = None
+        self._swap(built)
+        self.ready = True
+
+    def _swap(self, other):
+        (self._postings, self._terms, self._doc_terms, self._doc_lengths, self._doc_meta, self._total_length) = (
+            other._postings, other._terms, other._doc_terms, other._doc_lengths, other._doc_meta, other._total_length)
+
+    def _expand_prefix(self, prefix):
+        start = bisect_left(self._terms, prefix)
+        expansions = []
+        for term in self._terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            expansions.append(term)
+        return expansions
+
+    def _matches_filters(self, product_id, category, skin_type, min_price, max_price):
+        meta = self._doc_meta[product_id]
+        if category and meta["category"] != category:
+            return False
+        if skin_type and skin_type not in (meta["skin_types"] or []):
+            return False
+        price = meta["price"]
+        if min_price is not None and (price is None or price < min_price):
+            return False
+        if max_price is not None and (price is None or price > max_price):
+            return False
+        return True
+
+    def search(self, query, category=None, skin_type=None, min_price=None,
+               max_price=None, limit=20, prefix=True):
+        """Return up to ``limit`` ``(product_id, score)`` pairs, best match first.
+
+        Every query term must match (AND semantics); when ``prefix`` is set the
+        last term also matches any indexed term it is a prefix of.
+        """
+        terms = tokenize(query)
+        doc_count = len(self._doc_lengths)
+        if not terms or not doc_count:
+            return []
+        avg_length = self._total_length / doc_count or 1.0
+
+        scores = None
+        for position, term in enumerate(terms):
+            if prefix and position == len(terms) - 1:
+                expansions = self._expand_prefix(term)
+            else:
+                expansions = [term] if term in self._postings else []
+
+            term_scores = {}
+            for expansion in expansions:
+                postings = self._postings[expansion]
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for product_id, frequency in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_lengths[product_id] / avg_length)
+                    score = idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                    # A prefix can expand to several terms in one document; keep the best
+                    if score > term_scores.get(product_id, 0.0):
+                        term_scores[product_id] = score
+
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    product_id: score + term_scores[product_id]
+                    for product_id, score in scores.items()
+                    if product_id in term_scores
+                }
+            if not scores:
+                return []
+
+        ranked = sorted(
+            (
+                (product_id, score)
+                for product_id, score in scores.items()
+                if self._matches_filters(product_id, category, skin_type, min_price, max_price)
+            ),
+            key=lambda hit: (-hit[1], hit[0]),
+        )
+        return ranked[:limit]
@@ -1,132 +1,216 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, File, Header, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from pydantic import TypeAdapter, create_model
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import asyncio
 import os
 import logging
+from functools import lru_cache
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Union
 import uuid
 from datetime import datetime, timezone
-from enum import Enum
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Local modules read their settings from the environment at import time
+from analytics import EventBuffer, TrendingAggregator
+from cache import MISSING, CatalogCache
+from catalog_export import CURSOR_BATCH_SIZE, EXPORT_PROJECTION, stream_products
+from catalog_import import DEFAULT_CHUNK_SIZE, feed_rows, import_products
+from catalog_snapshot import SnapshotReader
+from changelog import REMOVE, ChangeLog
+from compression import CompressionMiddleware
+from etags import etag_matches, json_response, make_etag
+from facets import compute_facets
+from feed_sync import sync_feed
+from images import (
+    DIGEST_PATTERN,
+    IMMUTABLE_CACHE_CONTROL,
+    MEDIA_TYPES,
+    VARIANT_WIDTHS,
+    ImageFetchFailed,
+    ImageStore,
+    ImageTooLarge,
+    InvalidImage,
+    download,
+)
+from indexes import IndexBuildError, ensure_indexes
+import inventory
+import metrics
+from models import (
+    CartItem,
+    CartItemCreate,
+    CartLine,
+    CartProduct,
+    CartView,
+    CatalogChanges,
+    Category,
+    EventsAccepted,
+    ImageAsset,
+    ImageFormat,
+    ImageIngestRequest,
+    ImportReport,
+    MAX_BATCH_IDS,
+    MAX_CHANGES_PER_REQUEST,
+    MAX_IMAGE_BYTES,
+    NewsletterSubscription,
+    NewsletterSubscriptionCreate,
+    Product,
+    ProductBatch,
+    ProductBatchRequest,
+    ProductCreate,
+    ProductEventBatch,
+    ProductFacets,
+    ProductSort,
+    ProductSummary,
+    ProductView,
+    RepricingReport,
+    RepricingRequest,
+    Reservation,
+    SkinType,
+    StockLevel,
+    StockShardRequest,
+    StoredProduct,
+    SyncReport,
+)
+from pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    SORT_SPECS,
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+    keyset_filter,
+)
+from repricing import InvalidRules, reprice
+from recommendations import NEIGHBOURS, SIMILARITY_PROJECTION, SimilarProducts
+from search_index import INDEX_PROJECTION, ProductSearchIndex
+from singleflight import SingleFlight
+from write_behind import QueueFull, WriteBehindQueue
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Command timings and pool gauges for /api/metrics
+mongo_commands = metrics.MongoCommandListener()
+mongo_pool = metrics.MongoPoolListener()
+# Datetimes are stored as native BSON dates and read back timezone-aware (UTC)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[mongo_commands, mongo_pool])
 db = client[os.environ['DB_NAME']]
 
+# In-process full-text index over the catalog, built at startup
+search_index = ProductSearchIndex()
+
+# Precomputed "similar products" neighbours, built in the background at startup
+similar_products = SimilarProducts()
+
+# Cache for product reads, invalidated by bumping its version on every product write
+catalog_cache = CatalogCache(
+    max_entries=int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', '1024')),
+    ttl=float(os.environ.get('CATALOG_CACHE_TTL_SECONDS', '60')),
+)
+
+# Uploaded originals and their lazily rendered variants live on local disk
+image_store = ImageStore(
+    os.environ.get('IMAGE_STORE_PATH', str(ROOT_DIR / 'image_store')),
+    cache_max_bytes=int(float(os.environ.get('IMAGE_CACHE_MAX_MB', '2048')) * 1024 * 1024),
+    workers=int(os.environ.get('IMAGE_WORKERS', '2')),
+    base_url=os.environ.get('IMAGE_BASE_URL', ''),
+)
+# Comma-separated hosts /images/ingest may fetch from; any public host when unset
+IMAGE_INGEST_HOSTS = {host.strip().lower() for host in os.environ.get('IMAGE_INGEST_HOSTS', '').split(',') if host.strip()}
+
+# With a snapshot path set, listings come from the memory-mapped file that
+# `python catalog_snapshot.py --watch` keeps current, shared by every worker on the box
+CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH')
+catalog_snapshots = SnapshotReader(
+    CATALOG_SNAPSHOT_PATH,
+    check_interval=float(os.environ.get('CATALOG_SNAPSHOT_CHECK_SECONDS', '1')),
+) if CATALOG_SNAPSHOT_PATH else None
+
+# Every product write is logged with a catalog version so clients can fetch just the changes
+changelog = ChangeLog(
+    db,
+    retention_seconds=float(os.environ.get('CATALOG_CHANGES_RETENTION_HOURS', '168')) * 3600,
+)
+CATALOG_CHANGES_COMPACT_SECONDS = float(os.environ.get('CATALOG_CHANGES_COMPACT_SECONDS', '3600'))
+# Each worker polls the log to pick up writes made by other workers and the CLI tools
+CATALOG_CHANGES_FOLLOW_SECONDS = float(os.environ.get('CATALOG_CHANGES_FOLLOW_SECONDS', '5'))
+
+# Versions this worker recorded itself; its indexes already reflect them
+own_change_versions = set()
+
+async def catalog_changed(upserted_ids=(), removed_ids=()):
+    """Log a product write for delta sync, then invalidate cached catalog reads."""
+    try:
+        version = await changelog.record(upserted_ids, removed_ids)
+        if version is not None:
+            own_change_versions.update(range(version - len(upserted_ids) - len(removed_ids) + 1, version + 1))
+    except Exception:
+        # The write itself succeeded; clients that miss it pick it up on their next full resync
+        logger.exception("Failed to record catalog changes")
+    catalog_cache.bump()
+
+# Product views and add-to-carts are counted in memory and flushed to Mongo in the background.
+# Trending scores don't invalidate the catalog cache, so sort=trending pages lag by up to its TTL.
+event_buffer = EventBuffer(max_products=int(os.environ.get('EVENT_BUFFER_MAX_PRODUCTS', '50000')))
+EVENT_FLUSH_SECONDS = float(os.environ.get('EVENT_FLUSH_SECONDS', '5'))
+trending = TrendingAggregator(
+    db,
+    event_buffer,
+    half_life_seconds=float(os.environ.get('TRENDING_HALF_LIFE_HOURS', '24')) * 3600,
+    auto_viral=os.environ.get('AUTO_VIRAL', 'false').lower() in ('1', 'true', 'yes'),
+    viral_top_n=int(os.environ.get('VIRAL_TOP_N', '10')),
+    viral_min_score=float(os.environ.get('VIRAL_MIN_SCORE', '25')),
+    on_catalog_change=catalog_changed,
+)
+
+# Checkout holds reserved stock this long before the sweeper returns it
+RESERVATION_TTL_SECONDS = int(os.environ.get('RESERVATION_TTL_SECONDS', '900'))
+RESERVATION_SWEEP_SECONDS = float(os.environ.get('RESERVATION_SWEEP_SECONDS', '30'))
+
 # Create the main app without a prefix
 app = FastAPI()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Enums
-class SkinType(str, Enum):
-    DRY = "dry"
-    OILY = "oily"
-    SENSITIVE = "sensitive"
-    COMBO = "combination"
-
-class Category(str, Enum):
-    SKINCARE = "skincare"
-    LIPS = "lips"
-    EYES = "eyes"
-    TOOLS = "tools"
-
-# Product Models
-class Product(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    description: str
-    short_description: str
-    price: float
-    original_price: Optional[float] = None
-    category: Category
-    skin_types: List[SkinType]
-    ingredients: List[str]
-    tags: List[str]
-    image_url: str
-    images: List[str] = []
-    rating: float = 5.0
-    review_count: int = 0
-    stock: int = 100
-    is_featured: bool = False
-    is_new: bool = False
-    is_viral: bool = False
-    benefits: List[str] = []
-    how_to_use: str = ""
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class ProductCreate(BaseModel):
-    name: str
-    description: str
-    short_description: str
-    price: float
-    original_price: Optional[float] = None
-    category: Category
-    skin_types: List[SkinType]
-    ingredients: List[str]
-    tags: List[str]
-    image_url: str
-    images: List[str] = []
-    is_featured: bool = False
-    is_new: bool = False
-    is_viral: bool = False
-    benefits: List[str] = []
-    how_to_use: str = ""
-
-class CartItem(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    product_id: str
-    quantity: int
-    added_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class CartItemCreate(BaseModel):
-    product_id: str
-    quantity: int = 1
-
-class NewsletterSubscription(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    email: str
-    subscribed_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class NewsletterSubscriptionCreate(BaseModel):
-    email: str
-
-# Helper function to prepare data for MongoDB
-def prepare_for_mongo(data):
-    if isinstance(data, dict):
-        if 'created_at' in data and isinstance(data['created_at'], datetime):
-            data['created_at'] = data['created_at'].isoformat()
-        if 'added_at' in data and isinstance(data['added_at'], datetime):
-            data['added_at'] = data['added_at'].isoformat()
-        if 'subscribed_at' in data and isinstance(data['subscribed_at'], datetime):
-            data['subscribed_at'] = data['subscribed_at'].isoformat()
-    return data
-
-def parse_from_mongo(item):
-    if isinstance(item, dict):
-        if 'created_at' in item and isinstance(item['created_at'], str):
-            item['created_at'] = datetime.fromisoformat(item['created_at'])
-        if 'added_at' in item and isinstance(item['added_at'], str):
-            item['added_at'] = datetime.fromisoformat(item['added_at'])
-        if 'subscribed_at' in item and isinstance(item['subscribed_at'], str):
-            item['subscribed_at'] = datetime.fromisoformat(item['subscribed_at'])
-    return item
+# Concurrent cache misses for the same read share one Mongo call
+read_flight = SingleFlight(timeout=float(os.environ.get('READ_COALESCE_TIMEOUT_SECONDS', '10')))
+
+async def read_through_cache(cache_key, load):
+    """Cached value for ``cache_key``; on a miss, ``await load()`` once for all concurrent callers.
+
+    The flight key includes the catalog version, so a request that arrives
+    after a write never joins a load that started before it. ``None``
+    results (not found) are shared but not cached.
+    """
+    value = catalog_cache.get(cache_key)
+    if value is not MISSING:
+        return value
+    version = catalog_cache.version
+
+    async def load_and_cache():
+        value = await load()
+        if value is not None:
+            catalog_cache.set(cache_key, value, version)
+        return value
+
+    try:
+        return await read_flight.do((version, cache_key), load_and_cache)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Catalog read timed out")
 
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "Beauty Dropship API"}
 
-# Product routes
-@api_router.get("/products", response_model=List[Product])
-async def get_products(
+def build_product_query(
     category: Optional[Category] = None,
     skin_type: Optional[SkinType] = None,
     featured: Optional[bool] = None,
@@ -134,7 +218,8 @@ async def get_products(
     min_price: Optional[float] = None,
     max_price: Optional[float] = None
 ):
-    query = {}
+    # Products soft-deleted by a feed sync are hidden
+    query = {"deleted_at": None}
     if category:
         query["category"] = category
     if skin_type:
@@ -150,98 +235,723 @@ async def get_products(
             query["price"]["$lte"] = max_price
         else:
             query["price"] = {"$lte": max_price}
-    
-    products = await db.products.find(query).to_list(length=None)
-    return [Product(**parse_from_mongo(product)) for product in products]
+    return query
+
+# Product routes
+PRODUCT_FIELDS = set(Product.model_fields)
+
+# A listing page is full products, summaries (``view=summary``) or the requested fields (``fields=``)
+ProductListing = Union[List[Product], List[ProductSummary], List[Dict[str, Any]]]
+
+@lru_cache(maxsize=256)
+def product_fields_model(names):
+    """A model of just the ``Product`` fields in ``names`` (a sorted tuple), with their defaults."""
+    return create_model("ProductFields", **{name: (Product.model_fields[name].annotation, Product.model_fields[name])
+                                            for name in names})
+
+def listing_model(view: ProductView, fields: Optional[str]):
+    """The model a compact listing's rows are served as, or ``None`` for full products."""
+    if fields:
+        names = {name.strip() for name in fields.split(",") if name.strip()}
+        unknown = sorted(names - PRODUCT_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown product fields: {', '.join(unknown)}")
+        return product_fields_model(tuple(sorted(names | {"id"})))
+    if view == ProductView.SUMMARY:
+        return ProductSummary
+    return None
+
+def listing_projection(model, sort: str):
+    """Mongo projection for a compact listing served as ``model``, or ``None`` for full products.
+
+    The sort keys are always included; the next-page cursor is built from them.
+    """
+    if model is None:
+        return None
+    projection = {"_id": 0}
+    projection.update((name, 1) for name in model.model_fields)
+    projection.update((key, 1) for key, _ in SORT_SPECS[sort])
+    return projection
+
+def encode_listing(model, documents):
+    """A JSON array body of projected documents served as ``model``: defaults filled in, sort keys dropped."""
+    return b"[" + b",".join(model(**document).model_dump_json().encode() for document in documents) + b"]"
+
+# Full products are serialized once per cache fill; the cached bytes also give the ETag
+product_list_json = TypeAdapter(List[Product])
+
+@api_router.get("/products", response_model=ProductListing)
+async def get_products(
+    request: Request,
+    category: Optional[Category] = None,
+    skin_type: Optional[SkinType] = None,
+    featured: Optional[bool] = None,
+    new: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort: ProductSort = ProductSort.FEATURED,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    view: ProductView = ProductView.FULL,
+    fields: Optional[str] = Query(None, description="Comma-separated Product fields to return")
+):
+    """List products. ``view=summary`` returns ``ProductSummary`` rows and ``fields=`` just those fields.
+
+    ``X-Catalog-Version`` is the change-log version the page is at least as
+    new as; pass it to ``/products/changes`` to keep the listing current.
+    Pages are at most ``MAX_PAGE_SIZE`` products; follow ``X-Next-Cursor``
+    for the rest, or stream the whole catalog from ``/products/export``.
+    """
+    model = listing_model(view, fields)
+    projection = listing_projection(model, sort.value)
+    cache_key = ("products", category, skin_type, featured, new, min_price, max_price, sort, limit, cursor,
+                 tuple(projection) if projection else None)
+    snapshot = catalog_snapshots.current() if catalog_snapshots else None
+    if snapshot is not None and snapshot.has_sort(sort.value):
+        return snapshot_products_response(
+            request, snapshot, cache_key, (category, skin_type, featured, new, min_price, max_price),
+            sort.value, limit, cursor, model,
+        )
+
+    async def load():
+        # Read before the page, so replaying changes from this version can't miss any
+        version = await changelog.version()
+        products, next_cursor = await fetch_products_page(
+            build_product_query(category, skin_type, featured, new, min_price, max_price),
+            sort.value,
+            limit,
+            cursor,
+            projection,
+        )
+        body = encode_listing(model, products) if model else product_list_json.dump_json(products)
+        headers = {"X-Catalog-Version": str(version)}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return body, make_etag(body), headers
+
+    body, etag, headers = await read_through_cache(cache_key, load)
+    return json_response(request, body, etag, headers)
+
+def snapshot_products_response(request, snapshot, cache_key, filters, sort, limit, cursor, model):
+    """A ``get_products`` page from the catalog snapshot, with no Mongo round trip."""
+    cursor_values = None
+    if cursor:
+        try:
+            cursor_values = decode_cursor(sort, cursor)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    try:
+        rows, more = snapshot.select(*filters, sort, limit, cursor_values)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {"X-Catalog-Version": str(snapshot.version)}
+    if more:
+        headers["X-Next-Cursor"] = encode_cursor(sort, snapshot.sort_values(rows[-1], sort))
+    # The same snapshot and parameters give the same body, so the tag is known before it's built
+    etag = make_etag(f"{snapshot.digest}:{cache_key!r}".encode())
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return json_response(request, b"", etag, headers)
+    if model is None or model is ProductSummary:
+        # Stored already serialized as either model
+        body = snapshot.json_array(rows, summary=model is ProductSummary)
+    else:
+        body = encode_listing(model, snapshot.documents(rows))
+    return json_response(request, body, etag, headers)
+
+async def fetch_products_page(query, sort, limit, cursor, projection=None):
+    """Run a listing query and return ``(products, next_cursor)``.
+
+    With a ``projection`` the products are the raw projected documents;
+    otherwise they are validated ``Product`` models.
+    """
+    if cursor:
+        try:
+            cursor_values = decode_cursor(sort, cursor)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        keyset = keyset_filter(sort, cursor_values)
+        query = {"$and": [query, keyset]} if query else keyset
+
+    # Fetch one extra row to learn whether another page follows
+    find = db.products.find(query, projection).sort(SORT_SPECS[sort]).limit(limit + 1)
+    products = await find.to_list(length=limit + 1)
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        next_cursor = encode_cursor(sort, products[-1])
+    if projection:
+        return products, next_cursor
+    return [Product(**product) for product in products], next_cursor
+
+def load_search_products():
+    # Products soft-deleted by a feed sync are hidden from search too
+    return db.products.find({"deleted_at": None}, INDEX_PROJECTION)
+
+@api_router.get("/products/search", response_model=List[Product])
+async def search_products(
+    request: Request,
+    q: str,
+    category: Optional[Category] = None,
+    skin_type: Optional[SkinType] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    prefix: bool = True,
+    limit: int = Query(20, ge=1, le=100)
+):
+    await search_index.ensure_ready(load_search_products)
+
+    hits = search_index.search(
+        q,
+        category=category,
+        skin_type=skin_type,
+        min_price=min_price,
+        max_price=max_price,
+        limit=limit,
+        prefix=prefix,
+    )
+    products = []
+    if hits:
+        ranked_ids = [product_id for product_id, _ in hits]
+        documents = await db.products.find(
+            {"id": {"$in": ranked_ids}, "deleted_at": None}
+        ).to_list(length=len(ranked_ids))
+        by_id = {document["id"]: document for document in documents}
+        products = [Product(**by_id[product_id]) for product_id in ranked_ids if product_id in by_id]
+    return json_response(request, product_list_json.dump_json(products))
+
+EXPORT_MEDIA_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+@api_router.get("/products/export")
+async def export_products(
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    category: Optional[Category] = None,
+    skin_type: Optional[SkinType] = None,
+    featured: Optional[bool] = None,
+    new: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort: ProductSort = ProductSort.FEATURED
+):
+    """Stream every matching product straight from the cursor, for exports and admin listings."""
+    cursor = db.products.find(
+        build_product_query(category, skin_type, featured, new, min_price, max_price),
+        EXPORT_PROJECTION,
+    ).sort(SORT_SPECS[sort.value]).batch_size(CURSOR_BATCH_SIZE)
+    return StreamingResponse(stream_products(cursor, format), media_type=EXPORT_MEDIA_TYPES[format])
+
+@api_router.get("/products/facets", response_model=ProductFacets)
+async def get_product_facets(
+    request: Request,
+    category: Optional[Category] = None,
+    skin_type: Optional[SkinType] = None,
+    featured: Optional[bool] = None,
+    new: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None
+):
+    """Sidebar counts for the same filters ``get_products`` takes."""
+    facets = await read_through_cache(
+        ("facets", category, skin_type, featured, new, min_price, max_price),
+        lambda: compute_facets(db.products, build_product_query(category, skin_type, featured, new, min_price, max_price)),
+    )
+    return json_response(request, facets.model_dump_json().encode())
+
+async def lookup_products(ids: List[str]) -> ProductBatch:
+    """Products for ``ids`` in request order: cached ones first, the rest in one ``$in`` query."""
+    found = {}
+    for product_id in ids:
+        product = catalog_cache.get(("product", product_id))
+        if product is not MISSING:
+            found[product_id] = product
+    uncached = list(dict.fromkeys(product_id for product_id in ids if product_id not in found))
+    if uncached:
+        version = catalog_cache.version
+        async for document in db.products.find({"id": {"$in": uncached}, "deleted_at": None}):
+            product = Product(**document)
+            found[product.id] = product
+            catalog_cache.set(("product", product.id), product, version)
+    return ProductBatch(
+        products=[found.get(product_id) for product_id in ids],
+        missing=list(dict.fromkeys(product_id for product_id in ids if product_id not in found)),
+    )
+
+@api_router.get("/products/changes", response_model=CatalogChanges)
+async def get_catalog_changes(
+    request: Request,
+    since: int = Query(..., ge=0, description="Catalog version the client already has"),
+    limit: int = Query(MAX_CHANGES_PER_REQUEST, ge=1, le=MAX_CHANGES_PER_REQUEST),
+    view: ProductView = ProductView.FULL
+):
+    """Products written or removed since catalog version ``since``.
+
+    Call again with the returned ``version`` while ``has_more`` is set. With
+    ``resync`` set, the log no longer covers ``since``; reload ``/products``
+    and continue from its ``X-Catalog-Version``.
+    """
+    async def load():
+        entries, version, resync, has_more = await changelog.changes(since, limit)
+        # The last entry per product wins
+        latest = {entry["product_id"]: entry["op"] for entry in entries}
+        upserted_ids = [product_id for product_id, op in latest.items() if op != REMOVE]
+        removed = [product_id for product_id, op in latest.items() if op == REMOVE]
+        upserted = []
+        if upserted_ids:
+            # Straight from Mongo: this worker's product cache may not have caught up with writes
+            # from other workers and the CLI tools, and a stale copy sent with the new version
+            # would never be corrected
+            async for document in db.products.find({"id": {"$in": upserted_ids}, "deleted_at": None}):
+                upserted.append(Product(**document))
+            # Removed again since the entry was written
+            found = {product.id for product in upserted}
+            removed += [product_id for product_id in upserted_ids if product_id not in found]
+        if view == ProductView.SUMMARY:
+            upserted = [ProductSummary(**product.dict()) for product in upserted]
+        changes = CatalogChanges(version=version, resync=resync, has_more=has_more, upserted=upserted, removed=removed)
+        return changes.model_dump_json().encode()
+
+    body = await read_through_cache(("changes", since, limit, view), load)
+    return json_response(request, body)
+
+@api_router.get("/products/batch", response_model=ProductBatch)
+async def get_products_batch(ids: List[str] = Query(..., description="Product ids, repeated or comma-separated")):
+    ids = [product_id for value in ids for product_id in value.split(",") if product_id]
+    if not 1 <= len(ids) <= MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {MAX_BATCH_IDS} ids are required")
+    return await lookup_products(ids)
+
+@api_router.post("/products/batch", response_model=ProductBatch)
+async def post_products_batch(request: ProductBatchRequest):
+    return await lookup_products(request.ids)
 
 @api_router.get("/products/{product_id}", response_model=Product)
 async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id})
-    if not product:
+    async def load():
+        product = await db.products.find_one({"id": product_id, "deleted_at": None})
+        return Product(**product) if product else None
+
+    product = await read_through_cache(("product", product_id), load)
+    if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    return Product(**parse_from_mongo(product))
+    return product
 
 @api_router.post("/products", response_model=Product)
 async def create_product(product_data: ProductCreate):
-    product = Product(**product_data.dict())
-    product_dict = prepare_for_mongo(product.dict())
+    product = StoredProduct(**product_data.dict())
+    product_dict = product.dict()
     await db.products.insert_one(product_dict)
+    await index_new_products([product_dict])
     return product
 
+async def index_new_products(product_dicts):
+    for product_dict in product_dicts:
+        search_index.add(product_dict)
+    similar_products.submit(product_dicts)
+    await catalog_changed([product_dict["id"] for product_dict in product_dicts])
+
+@api_router.post("/products/import", response_model=ImportReport)
+async def import_products_feed(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=10000)
+):
+    """Stream an NDJSON or CSV feed from the request body into the catalog."""
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    return await import_products(
+        db.products,
+        feed_rows(format, request.stream()),
+        chunk_size=chunk_size,
+        on_inserted=index_new_products,
+    )
+
+async def refresh_indexes(upserted_ids, removed_ids):
+    """Re-read written products into the search and similar-product indexes."""
+    removed_ids = list(removed_ids)
+    upserted = []
+    if upserted_ids:
+        async for product in db.products.find({"id": {"$in": list(upserted_ids)}, "deleted_at": None}, INDEX_PROJECTION):
+            search_index.add(product)
+            upserted.append(product)
+        # Deleted again since they were written
+        found = {product["id"] for product in upserted}
+        removed_ids += [product_id for product_id in upserted_ids if product_id not in found]
+    for product_id in removed_ids:
+        search_index.remove(product_id)
+    similar_products.submit(upserted, removed_ids)
+
+async def reindex_changed_products(upserted_ids, removed_ids):
+    await refresh_indexes(upserted_ids, removed_ids)
+    await catalog_changed(upserted_ids, removed_ids)
+
+@api_router.post("/feeds/{supplier}/sync", response_model=SyncReport)
+async def sync_supplier_feed(
+    supplier: str,
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$")
+):
+    """Diff a supplier's full feed against the catalog and write only what changed."""
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    return await sync_feed(
+        db.products,
+        supplier,
+        feed_rows(format, request.stream()),
+        on_changed=reindex_changed_products,
+    )
+
+@api_router.post("/pricing/reprice", response_model=RepricingReport)
+async def reprice_catalog(request: RepricingRequest):
+    """Apply cost/markup/discount rules to the whole catalog; a dry run unless ``dry_run`` is false."""
+    try:
+        report, _ = await reprice(
+            db.products,
+            request.rules,
+            dry_run=request.dry_run,
+            diff_limit=request.diff_limit,
+            on_repriced=apply_new_prices,
+        )
+    except InvalidRules as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return report
+
+async def apply_new_prices(prices):
+    search_index.update_prices(prices)
+    await catalog_changed(list(prices))
+
+@api_router.post("/images", response_model=ImageAsset)
+async def upload_image(file: UploadFile = File(...), product_id: Optional[str] = None):
+    """Store an uploaded original; with ``product_id``, that product gets its variants."""
+    data = await file.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Images are limited to {MAX_IMAGE_BYTES} bytes")
+    return await store_image(data, product_id)
+
+@api_router.post("/images/ingest", response_model=ImageAsset)
+async def ingest_image(request: ImageIngestRequest):
+    """Fetch and store an original by URL, by default the product's current ``image_url``."""
+    url = request.url
+    expected_image_url = None
+    if url is None:
+        if not request.product_id:
+            raise HTTPException(status_code=400, detail="A url or a product_id is required")
+        product = await db.products.find_one({"id": request.product_id, "deleted_at": None}, {"_id": 0, "image_url": 1})
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        url = expected_image_url = product["image_url"]
+    try:
+        data = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: download(url, MAX_IMAGE_BYTES, allowed_hosts=IMAGE_INGEST_HOSTS))
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ImageFetchFailed as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return await store_image(data, request.product_id, expected_image_url)
+
+async def store_image(data, product_id, expected_image_url=None):
+    try:
+        digest, image_format, width, height = await image_store.ingest(data)
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    variants = image_store.variant_urls(digest, width)
+    if product_id:
+        query = {"id": product_id, "deleted_at": None}
+        if expected_image_url is not None:
+            # A feed sync may have replaced the image while it was being fetched
+            query["image_url"] = expected_image_url
+        result = await db.products.update_one(
+            query, {"$set": {"image_variants": [variant.dict() for variant in variants]}}
+        )
+        if not result.matched_count:
+            if expected_image_url is not None and await db.products.find_one({"id": product_id, "deleted_at": None}):
+                raise HTTPException(status_code=409, detail="The product's image_url changed during ingest")
+            raise HTTPException(status_code=404, detail="Product not found")
+        await catalog_changed([product_id])
+    return ImageAsset(digest=digest, format=image_format, width=width, height=height, variants=variants,
+                      product_id=product_id)
+
+@api_router.get("/images/{digest}/{variant}")
+async def get_image_variant(digest: str, variant: str):
+    """A resized variant such as ``640.webp``, rendered on first request and cached for a year."""
+    width, _, extension = variant.partition(".")
+    if (not DIGEST_PATTERN.match(digest) or not width.isdigit() or int(width) not in VARIANT_WIDTHS
+            or extension not in {image_format.value for image_format in ImageFormat}):
+        raise HTTPException(status_code=404, detail="Image not found")
+    image_format = ImageFormat(extension)
+    path = await image_store.variant(digest, int(width), image_format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path, media_type=MEDIA_TYPES[image_format],
+                        headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    stats = {**catalog_cache.stats(), "coalescing": read_flight.stats()}
+    if catalog_snapshots:
+        stats["snapshot"] = catalog_snapshots.stats()
+    stats["images"] = image_store.stats()
+    return stats
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus scrape endpoint."""
+    cache = catalog_cache.stats()
+    flight = read_flight.stats()
+    events = trending.stats()
+    signups = newsletter_queue.stats()
+    body = metrics.render(
+        metrics.render_values("catalog_cache_entries", "Entries in the catalog cache", "gauge", (),
+                              {(): cache["size"]}),
+        metrics.render_values("catalog_cache_lookups_total", "Catalog cache lookups by result", "counter", ("result",),
+                              {("hit",): cache["hits"], ("miss",): cache["misses"]}),
+        metrics.render_values("catalog_cache_removals_total", "Catalog cache entries dropped by reason", "counter",
+                              ("reason",), {("evicted",): cache["evictions"], ("expired",): cache["expirations"]}),
+        metrics.render_values("catalog_reads_coalesced_total", "Catalog reads that joined an in-flight load", "counter",
+                              (), {(): flight["coalesced"]}),
+        metrics.render_values("catalog_reads_in_flight", "Catalog loads currently running", "gauge", (),
+                              {(): flight["in_flight"]}),
+        metrics.render_values("product_events_total", "Product analytics events by outcome", "counter", ("result",),
+                              {("accepted",): events["accepted"], ("dropped",): events["dropped"],
+                               ("flushed",): events["flushed_events"], ("failed",): events["failed_events"]}),
+        metrics.render_values("newsletter_write_behind_total", "Queued newsletter signups by outcome", "counter",
+                              ("result",), {(result,): signups[result]
+                                            for result in ("accepted", "rejected", "written", "failed")}),
+        metrics.render_values("newsletter_write_behind_pending", "Newsletter signups waiting to be written", "gauge",
+                              (), {(): signups["pending"]}),
+        mongo_pool.render(),
+    )
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 # Cart routes
+def get_cart_id(response: Response, x_cart_id: Optional[str] = Header(None, max_length=64)) -> str:
+    """Identify the caller's cart from the X-Cart-Id header, minting a new id if absent."""
+    if not x_cart_id:
+        x_cart_id = str(uuid.uuid4())
+    response.headers["X-Cart-Id"] = x_cart_id
+    return x_cart_id
+
+CART_PRODUCT_FIELDS = list(CartProduct.model_fields)
+
+async def build_cart_view(cart_id: str) -> CartView:
+    """Join the cart's lines with their products in a single aggregation and total them."""
+    pipeline = [
+        {"$match": {"cart_id": cart_id}},
+        {"$sort": {"added_at": 1}},
+        {"$lookup": {"from": "products", "localField": "product_id", "foreignField": "id", "as": "product"}},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "product_id": 1,
+            "quantity": 1,
+            **{f"product.{field}": 1 for field in CART_PRODUCT_FIELDS},
+            "product.deleted_at": 1,
+        }},
+    ]
+    lines = []
+    item_count = 0
+    subtotal = 0.0
+    savings = 0.0
+    async for row in db.cart.aggregate(pipeline):
+        found = row["product"][0] if row["product"] else None
+        product = CartProduct(**found) if found and not found.get("deleted_at") else None
+        line_total = line_savings = 0.0
+        if product:
+            line_total = product.price * row["quantity"]
+            if product.original_price and product.original_price > product.price:
+                line_savings = (product.original_price - product.price) * row["quantity"]
+            item_count += row["quantity"]
+            subtotal += line_total
+            savings += line_savings
+        lines.append(CartLine(
+            id=row["id"],
+            product_id=row["product_id"],
+            quantity=row["quantity"],
+            product=product,
+            line_total=round(line_total, 2),
+            line_savings=round(line_savings, 2),
+        ))
+    return CartView(
+        cart_id=cart_id,
+        items=lines,
+        item_count=item_count,
+        subtotal=round(subtotal, 2),
+        savings=round(savings, 2),
+    )
+
+@api_router.get("/cart/view", response_model=CartView)
+async def get_cart_view(cart_id: str = Depends(get_cart_id)):
+    return await build_cart_view(cart_id)
+
 @api_router.get("/cart", response_model=List[CartItem])
-async def get_cart():
-    cart_items = await db.cart.find().to_list(length=None)
-    return [CartItem(**parse_from_mongo(item)) for item in cart_items]
-
-@api_router.post("/cart", response_model=CartItem)
-async def add_to_cart(item_data: CartItemCreate):
-    # Check if product exists
-    product = await db.products.find_one({"id": item_data.product_id})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    # Check if item already in cart
-    existing_item = await db.cart.find_one({"product_id": item_data.product_id})
-    if existing_item:
-        # Update quantity
-        new_quantity = existing_item["quantity"] + item_data.quantity
-        await db.cart.update_one(
-            {"product_id": item_data.product_id},
-            {"$set": {"quantity": new_quantity}}
-        )
-        existing_item["quantity"] = new_quantity
-        return CartItem(**parse_from_mongo(existing_item))
-    else:
-        # Add new item
-        cart_item = CartItem(**item_data.dict())
-        cart_item_dict = prepare_for_mongo(cart_item.dict())
-        await db.cart.insert_one(cart_item_dict)
-        return cart_item
-
-@api_router.delete("/cart/{item_id}")
-async def remove_from_cart(item_id: str):
-    result = await db.cart.delete_one({"id": item_id})
+async def get_cart(cart_id: str = Depends(get_cart_id)):
+    cart_items = await db.cart.find({"cart_id": cart_id}).to_list(length=None)
+    return [CartItem(**item) for item in cart_items]
+
+@api_router.post("/cart", response_model=CartView)
+async def add_to_cart(item_data: CartItemCreate, cart_id: str = Depends(get_cart_id)):
+    # Check if product exists (served from the catalog cache when warm). The stock
+    # check here is advisory; checkout reserves stock with an atomic conditional update.
+    product = await get_product(item_data.product_id)
+    if not product.stock_shards and product.stock < item_data.quantity:
+        raise HTTPException(status_code=409, detail="Insufficient stock")
+
+    # Insert the line or bump its quantity in one atomic upsert on the unique (cart_id, product_id) key
+    now = datetime.now(timezone.utc)
+    line_filter = {"cart_id": cart_id, "product_id": item_data.product_id}
+    line_update = {
+        "$inc": {"quantity": item_data.quantity},
+        "$set": {"updated_at": now},
+        "$setOnInsert": {"id": str(uuid.uuid4()), "added_at": now},
+    }
+    try:
+        await db.cart.update_one(line_filter, line_update, upsert=True)
+    except DuplicateKeyError:
+        # A concurrent add inserted the same line first; now it exists, so this becomes an update
+        await db.cart.update_one(line_filter, line_update, upsert=True)
+    return await build_cart_view(cart_id)
+
+@api_router.delete("/cart/{item_id}", response_model=CartView)
+async def remove_from_cart(item_id: str, cart_id: str = Depends(get_cart_id)):
+    result = await db.cart.delete_one({"id": item_id, "cart_id": cart_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cart item not found")
-    return {"message": "Item removed from cart"}
+    return await build_cart_view(cart_id)
 
-@api_router.delete("/cart")
-async def clear_cart():
-    await db.cart.delete_many({})
-    return {"message": "Cart cleared"}
+@api_router.delete("/cart", response_model=CartView)
+async def clear_cart(cart_id: str = Depends(get_cart_id)):
+    await db.cart.delete_many({"cart_id": cart_id})
+    return CartView(cart_id=cart_id, items=[], item_count=0, subtotal=0.0, savings=0.0)
 
-@api_router.put("/cart/{item_id}")
-async def update_cart_item(item_id: str, quantity: int):
+@api_router.put("/cart/{item_id}", response_model=CartView)
+async def update_cart_item(item_id: str, quantity: int, cart_id: str = Depends(get_cart_id)):
     if quantity <= 0:
-        return await remove_from_cart(item_id)
+        return await remove_from_cart(item_id, cart_id)
     
     result = await db.cart.update_one(
-        {"id": item_id},
-        {"$set": {"quantity": quantity}}
+        {"id": item_id, "cart_id": cart_id},
+        {"$set": {"quantity": quantity, "updated_at": datetime.now(timezone.utc)}}
     )
-    if result.modified_count == 0:
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Cart item not found")
-    return {"message": "Cart item updated"}
+    return await build_cart_view(cart_id)
+
+# Checkout routes
+@api_router.post("/checkout/reserve", response_model=Reservation)
+async def reserve_cart(cart_id: str = Depends(get_cart_id)):
+    lines = await db.cart.find({"cart_id": cart_id}, {"_id": 0, "product_id": 1, "quantity": 1}).to_list(length=None)
+    if not lines:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    products = await db.products.find(
+        {"id": {"$in": [line["product_id"] for line in lines]}, "deleted_at": None},
+        {"_id": 0, "id": 1, "stock_shards": 1},
+    ).to_list(length=None)
+    shards = {product["id"]: product.get("stock_shards", 0) for product in products}
+    items = []
+    for line in lines:
+        if line["product_id"] not in shards:
+            raise HTTPException(status_code=409, detail=f"Product {line['product_id']} is no longer available")
+        items.append({**line, "stock_shards": shards[line["product_id"]]})
+    try:
+        return await inventory.reserve(db, items, RESERVATION_TTL_SECONDS, cart_id=cart_id)
+    except inventory.OutOfStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@api_router.post("/checkout/{reservation_id}/confirm", response_model=Reservation)
+async def confirm_reservation(reservation_id: str, cart_id: str = Depends(get_cart_id)):
+    reservation = await inventory.confirm(db, reservation_id, cart_id)
+    if reservation is None:
+        raise HTTPException(status_code=409, detail="Reservation is expired or no longer pending")
+    await db.cart.delete_many({"cart_id": cart_id})
+    return reservation
+
+@api_router.delete("/checkout/{reservation_id}", response_model=Reservation)
+async def release_reservation(reservation_id: str, cart_id: str = Depends(get_cart_id)):
+    reservation = await inventory.release(db, reservation_id, cart_id)
+    if reservation is None:
+        raise HTTPException(status_code=409, detail="Reservation is not pending")
+    return reservation
+
+@api_router.get("/products/{product_id}/similar", response_model=List[Product])
+async def get_similar_products(product_id: str, limit: int = Query(8, ge=1, le=NEIGHBOURS)):
+    """Products sharing the most category, skin type, tag and ingredient signal with this one."""
+    await get_product(product_id)
+    await similar_products.ensure_ready(load_similarity_products)
+    similar_ids = similar_products.similar(product_id, limit)
+    if not similar_ids:
+        return []
+    batch = await lookup_products(similar_ids)
+    return [product for product in batch.products if product is not None]
+
+@api_router.get("/products/{product_id}/stock", response_model=StockLevel)
+async def get_product_stock(product_id: str):
+    product = await get_product(product_id)
+    stock = await inventory.available_stock(db, product_id, product.stock_shards)
+    return StockLevel(product_id=product_id, stock=stock, shards=product.stock_shards)
+
+@api_router.post("/products/{product_id}/stock/shards", response_model=StockLevel)
+async def shard_product_stock(product_id: str, request: StockShardRequest):
+    """Spread a hot product's stock over several counters so checkouts don't contend on one document."""
+    moved = await inventory.shard_stock(db, product_id, request.shards)
+    if moved is None:
+        raise HTTPException(status_code=409, detail="Product not found, already sharded or being sharded")
+    await catalog_changed([product_id])
+    return StockLevel(product_id=product_id, stock=moved, shards=request.shards)
+
+# Analytics events
+@api_router.post("/events", response_model=EventsAccepted, status_code=202)
+async def record_events(batch: ProductEventBatch):
+    """Count product views and add-to-carts; written to Mongo by the background flush, not here."""
+    accepted = sum(event_buffer.add(event.product_id, event.type.value) for event in batch.events)
+    return EventsAccepted(accepted=accepted, dropped=len(batch.events) - accepted)
 
 # Newsletter route
+async def insert_subscriptions(subscriptions):
+    try:
+        await db.newsletter.insert_many(subscriptions, ordered=False)
+    except BulkWriteError as e:
+        # Addresses that were already subscribed are expected; anything else is a real failure
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+# With write-behind on, signups are acknowledged once validated and inserted in batches. Duplicates are
+# then only reported while the first signup is still queued; later ones are dropped by the unique index.
+NEWSLETTER_WRITE_BEHIND = os.environ.get('NEWSLETTER_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+newsletter_queue = WriteBehindQueue(
+    insert_subscriptions,
+    max_pending=int(os.environ.get('NEWSLETTER_QUEUE_MAX_PENDING', '10000')),
+    batch_size=int(os.environ.get('NEWSLETTER_BATCH_SIZE', '500')),
+    flush_interval=float(os.environ.get('NEWSLETTER_FLUSH_SECONDS', '0.25')),
+    enqueue_timeout=float(os.environ.get('NEWSLETTER_ENQUEUE_TIMEOUT_SECONDS', '1')),
+    key=lambda subscription: subscription["email"],
+)
+
 @api_router.post("/newsletter", response_model=NewsletterSubscription)
 async def subscribe_newsletter(subscription_data: NewsletterSubscriptionCreate):
-    # Check if email already subscribed
-    existing = await db.newsletter.find_one({"email": subscription_data.email})
-    if existing:
-        raise HTTPException(status_code=400, detail="Email already subscribed")
-    
     subscription = NewsletterSubscription(**subscription_data.dict())
-    subscription_dict = prepare_for_mongo(subscription.dict())
-    await db.newsletter.insert_one(subscription_dict)
+    subscription_dict = subscription.dict()
+    if NEWSLETTER_WRITE_BEHIND:
+        try:
+            queued = await newsletter_queue.put(subscription_dict)
+        except QueueFull:
+            raise HTTPException(status_code=503, detail="Too many signups right now, please retry",
+                                headers={"Retry-After": "1"})
+        if not queued:
+            raise HTTPException(status_code=400, detail="Email already subscribed")
+        return subscription
+    # The unique index on email rejects duplicates, including concurrent ones
+    try:
+        await db.newsletter.insert_one(subscription_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already subscribed")
     return subscription
 
 # Initialize sample products
 @api_router.post("/init-products")
 async def initialize_products():
     # Check if products already exist
-    existing_count = await db.products.count_documents({})
+    existing_count = await db.products.estimated_document_count()
     if existing_count > 0:
         return {"message": f"Products already initialized ({existing_count} products)"}
     
@@ -347,10 +1057,9 @@ async def initialize_products():
         }
     ]
     
-    for product_data in sample_products:
-        product = Product(**product_data)
-        product_dict = prepare_for_mongo(product.dict())
-        await db.products.insert_one(product_dict)
+    product_dicts = [StoredProduct(**product_data).dict() for product_data in sample_products]
+    await db.products.insert_many(product_dicts)
+    await index_new_products(product_dicts)
     
     return {"message": f"Initialized {len(sample_products)} sample products"}
 
@@ -363,6 +1072,19 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Cart-Id", "X-Catalog-Version", "ETag"],
+)
+
+# brotli or gzip, negotiated per request; streamed exports are compressed chunk by chunk
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MINIMUM_SIZE', '1024')),
+)
+
+# Outermost, so latencies include compression; SLOW_REQUEST_MS > 0 turns on the slow-request log
+app.add_middleware(
+    metrics.MetricsMiddleware,
+    slow_request_ms=float(os.environ.get('SLOW_REQUEST_MS', '0')),
 )
 
 # Configure logging
@@ -372,6 +1094,174 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Startup steps that read Mongo run in the background when listings come from a snapshot,
+# so a new worker serves them without waiting on a Mongo round trip
+startup_tasks = set()
+
+async def at_startup(step):
+    if catalog_snapshots is None:
+        await step
+        return
+    task = asyncio.create_task(step)
+    startup_tasks.add(task)
+    task.add_done_callback(startup_step_done)
+
+def startup_step_done(task):
+    startup_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.critical("Startup step failed", exc_info=task.exception())
+
+@app.on_event("startup")
+async def map_catalog_snapshot():
+    if catalog_snapshots is not None and catalog_snapshots.current() is None:
+        logger.warning(f"No catalog snapshot at {CATALOG_SNAPSHOT_PATH} yet; listings read Mongo until one is built")
+
+async def ensure_indexes_at_startup():
+    try:
+        await ensure_indexes(db)
+    except IndexBuildError:
+        # Without the unique indexes duplicates would be accepted silently; don't serve like that
+        raise
+    except Exception:
+        logger.exception("Failed to ensure indexes at startup")
+
+@app.on_event("startup")
+async def create_indexes():
+    await at_startup(ensure_indexes_at_startup())
+
+async def build_search_index_at_startup():
+    try:
+        await search_index.rebuild(load_search_products())
+        logger.info(f"Search index built ({len(search_index)} products)")
+    except Exception:
+        # The search route rebuilds lazily, so a cold database shouldn't block startup
+        logger.exception("Failed to build search index at startup")
+
+@app.on_event("startup")
+async def build_search_index():
+    await at_startup(build_search_index_at_startup())
+
+def load_similarity_products():
+    return db.products.find({"deleted_at": None}, SIMILARITY_PROJECTION)
+
+async def build_similarity_index():
+    try:
+        await similar_products.ensure_ready(load_similarity_products)
+        logger.info(f"Similar-product index built ({len(similar_products)} products)")
+    except Exception:
+        # The similar route retries the build on demand
+        logger.exception("Failed to build similar-product index")
+
+@app.on_event("startup")
+async def start_similarity_build():
+    # Large catalogs take a while; don't hold up startup
+    app.state.similarity_build = asyncio.create_task(build_similarity_index())
+
+@app.on_event("startup")
+async def start_reservation_sweeper():
+    app.state.reservation_sweeper = asyncio.create_task(
+        inventory.run_sweeper(db, RESERVATION_SWEEP_SECONDS)
+    )
+
+@app.on_event("shutdown")
+async def stop_reservation_sweeper():
+    app.state.reservation_sweeper.cancel()
+
+async def backfill_trending_scores():
+    try:
+        await trending.backfill()
+    except Exception:
+        logger.exception("Failed to initialise trending scores")
+
+@app.on_event("startup")
+async def start_event_flusher():
+    await at_startup(backfill_trending_scores())
+    app.state.event_flusher = asyncio.create_task(trending.run(EVENT_FLUSH_SECONDS))
+
+@app.on_event("startup")
+async def start_changelog_compactor():
+    app.state.changelog_compactor = asyncio.create_task(changelog.run_compactor(CATALOG_CHANGES_COMPACT_SECONDS))
+
+def forget_own_changes(version):
+    own_change_versions.difference_update([own for own in own_change_versions if own <= version])
+
+async def apply_catalog_changes(version):
+    """Bring this worker's indexes and cache up to date with the log after ``version``; returns the new version."""
+    while True:
+        entries, version, resync, has_more = await changelog.changes(version, MAX_CHANGES_PER_REQUEST)
+        if resync:
+            # Too far behind to replay; start over from the collection
+            await search_index.rebuild(load_search_products())
+            await similar_products.rebuild(load_similarity_products())
+            own_change_versions.clear()
+            catalog_cache.bump()
+            return version
+        # The last entry per product wins
+        latest = {entry["product_id"]: entry["op"] for entry in entries if entry["version"] not in own_change_versions}
+        forget_own_changes(version)
+        if latest:
+            await refresh_indexes(
+                [product_id for product_id, op in latest.items() if op != REMOVE],
+                [product_id for product_id, op in latest.items() if op == REMOVE],
+            )
+            catalog_cache.bump()
+        if not has_more:
+            return version
+
+async def follow_catalog_changes(interval_seconds):
+    version = None
+    while True:
+        try:
+            if version is None:
+                version = await changelog.version()
+                forget_own_changes(version)
+            else:
+                version = await apply_catalog_changes(version)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to apply catalog changes from the log")
+        await asyncio.sleep(interval_seconds)
+
+@app.on_event("startup")
+async def start_catalog_change_follower():
+    app.state.catalog_change_follower = asyncio.create_task(follow_catalog_changes(CATALOG_CHANGES_FOLLOW_SECONDS))
+
+@app.on_event("startup")
+async def start_newsletter_writer():
+    if NEWSLETTER_WRITE_BEHIND:
+        app.state.newsletter_writer = asyncio.create_task(newsletter_queue.run())
+
+@app.on_event("shutdown")
+async def stop_newsletter_writer():
+    if NEWSLETTER_WRITE_BEHIND:
+        app.state.newsletter_writer.cancel()
+        await newsletter_queue.drain()
+
+@app.on_event("shutdown")
+async def stop_changelog_compactor():
+    app.state.changelog_compactor.cancel()
+
+@app.on_event("shutdown")
+async def stop_catalog_change_follower():
+    app.state.catalog_change_follower.cancel()
+
+@app.on_event("shutdown")
+async def stop_event_flusher():
+    app.state.event_flusher.cancel()
+    try:
+        await trending.flush()
+    except Exception:
+        logger.exception("Failed to flush buffered product events at shutdown")
+
+@app.on_event("startup")
+async def start_image_store():
+    await image_store.start()
+
+@app.on_event("shutdown")
+async def stop_image_store():
+    image_store.stop()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
\ No newline at end of file
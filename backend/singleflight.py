@@ -0,0 +1,75 @@
+"""Request coalescing for identical concurrent reads.
+
+While a load for a key is in flight, every other caller asking for the same
+key awaits that load instead of starting its own. When a viral product
+misses the cache, the first request goes to Mongo and the thousands right
+behind it share its result. A load that raises hands the same exception to
+every waiter. A load that runs past its timeout is cancelled, and every
+waiter gets ``asyncio.TimeoutError``. Either way the key is cleared, so the
+next caller starts fresh.
+
+The load runs as its own task and waiters await it through
+``asyncio.shield``. A client that disconnects cancels only its own wait, not
+the load the other requests depend on.
+"""
+import asyncio
+
+
+class SingleFlight:
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._calls = {}  # key -> task running the load
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, load, timeout=None):
+        """Return ``await load()``, sharing one in-flight call per ``key``.
+
+        ``timeout`` overrides the default for this key's load if this call starts it.
+        """
+        self.calls += 1
+        task = self._calls.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(self._run(load, self.timeout if timeout is None else timeout))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _run(self, load, timeout):
+        try:
+            if timeout is None:
+                return await load()
+            return await asyncio.wait_for(load(), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the outcome retrieved even if every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "coalesced_ratio": self.coalesced / self.calls if self.calls else 0.0,
+        }
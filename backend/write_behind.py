@@ -0,0 +1,124 @@
+"""Write-behind batching for documents the caller has already acknowledged.
+
+``put`` adds a document to a bounded ``asyncio.Queue``. A single ``run``
+task takes documents off it and writes them with one ``write_batch`` call per
+batch. A batch closes when it reaches ``batch_size`` or ``flush_interval``
+seconds after its first document, whichever comes first. A burst of requests
+then costs a handful of round trips instead of one each.
+
+A full queue is backpressure. ``put`` waits up to ``enqueue_timeout``
+for room and then raises ``QueueFull``, so the caller can shed load rather
+than buffer without limit. With ``key`` set, documents still waiting to be
+written are tracked by key, and ``put`` refuses a key that is already
+pending. Documents are lost if the process dies before they are written;
+only use this where that trade is acceptable.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WriteBehindQueue:
+    def __init__(self, write_batch, max_pending, batch_size, flush_interval, enqueue_timeout, key=None):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.key = key
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._pending_keys = set()
+        self._batch = []  # taken off the queue, not yet handed to write_batch
+        self._batch_full = asyncio.Event()
+        self._writing = None  # the batch write in progress, if any
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def is_pending(self, document):
+        return self.key is not None and self.key(document) in self._pending_keys
+
+    async def put(self, document):
+        """Queue ``document``; returns False if one with the same key is already pending."""
+        if self.is_pending(document):
+            return False
+        # Claim the key before waiting for room, so a concurrent duplicate is refused too
+        key = self.key(document) if self.key is not None else None
+        if key is not None:
+            self._pending_keys.add(key)
+        try:
+            await asyncio.wait_for(self._queue.put(document), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self._pending_keys.discard(key)
+            self.rejected += 1
+            raise QueueFull(f"Write-behind queue is full ({self._queue.maxsize} pending)")
+        except BaseException:
+            self._pending_keys.discard(key)
+            raise
+        self.accepted += 1
+        if len(self._batch) + self._queue.qsize() >= self.batch_size:
+            self._batch_full.set()
+        return True
+
+    async def _fill_batch(self):
+        # Documents only leave the queue through get() and get_nowait(), so cancelling
+        # run() never drops one: it is either still queued or already in _batch
+        self._batch.append(await self._queue.get())
+        if 1 + self._queue.qsize() < self.batch_size:
+            self._batch_full.clear()
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+        while not self._queue.empty() and len(self._batch) < self.batch_size:
+            self._batch.append(self._queue.get_nowait())
+
+    async def _write(self, batch):
+        try:
+            await self.write_batch(batch)
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception(f"Write-behind batch of {len(batch)} documents failed")
+        finally:
+            self.batches += 1
+            if self.key is not None:
+                self._pending_keys.difference_update(self.key(document) for document in batch)
+
+    async def run(self):
+        while True:
+            await self._fill_batch()
+            batch, self._batch = self._batch, []
+            # Cancelling run() mid-write leaves the write to finish; drain() waits for it
+            self._writing = asyncio.ensure_future(self._write(batch))
+            await asyncio.shield(self._writing)
+
+    async def drain(self):
+        """Write everything still queued; call after cancelling ``run`` at shutdown."""
+        if self._writing is not None:
+            await self._writing
+        batch, self._batch = self._batch, []
+        while batch or not self._queue.empty():
+            while not self._queue.empty() and len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+            await self._write(batch)
+            batch = []
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize(),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
@@ -14,17 +14,42 @@ import { Toaster } from 'sonner';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Each browser keeps its own cart, identified by an id sent with every cart request
+const CART_ID_KEY = 'cartId';
+
+const getCartId = () => {
+  let cartId = localStorage.getItem(CART_ID_KEY);
+  if (!cartId) {
+    cartId = crypto.randomUUID();
+    localStorage.setItem(CART_ID_KEY, cartId);
+  }
+  return cartId;
+};
+
+const cartConfig = () => ({ headers: { 'X-Cart-Id': getCartId() } });
+
+// Views and add-to-carts feed the trending sort; delivery is best-effort
+export const trackEvent = (productId, type) => {
+  axios.post(`${API}/events`, { events: [{ product_id: productId, type }] })
+    .catch(error => console.error('Error recording event:', error));
+};
+
+// srcset over a product's resized WebP variants; empty until its image has been ingested
+export const imageSrcSet = (product) => (product.image_variants || [])
+  .filter(variant => variant.format === 'webp')
+  .map(variant => `${variant.url.startsWith('/') ? BACKEND_URL : ''}${variant.url} ${variant.width}w`)
+  .join(', ');
+
+// Rendered width of a product card image, for the browser's srcset choice
+export const CARD_IMAGE_SIZES = '(max-width: 768px) 100vw, 400px';
+
 // Context for cart
 export const CartContext = React.createContext();
 
 function App() {
-  const [cartItems, setCartItems] = useState([]);
-  const [products, setProducts] = useState([]);
-  const [loading, setLoading] = useState(true);
-
-  // Fetch products on app load
+  const [cart, setCart] = useState({ items: [], item_count: 0, subtotal: 0, savings: 0 });
+  // Fetch the cart on app load; each page fetches the products it shows
   useEffect(() => {
-    fetchProducts();
     fetchCart();
     initializeProducts();
   }, []);
@@ -37,21 +62,10 @@ function App() {
     }
   };
 
-  const fetchProducts = async () => {
-    try {
-      const response = await axios.get(`${API}/products`);
-      setProducts(response.data);
-    } catch (error) {
-      console.error('Error fetching products:', error);
-    } finally {
-      setLoading(false);
-    }
-  };
-
   const fetchCart = async () => {
     try {
-      const response = await axios.get(`${API}/cart`);
-      setCartItems(response.data);
+      const response = await axios.get(`${API}/cart/view`, cartConfig());
+      setCart(response.data);
     } catch (error) {
       console.error('Error fetching cart:', error);
     }
@@ -59,11 +73,12 @@ function App() {
 
   const addToCart = async (productId, quantity = 1) => {
     try {
-      await axios.post(`${API}/cart`, {
+      const response = await axios.post(`${API}/cart`, {
         product_id: productId,
         quantity: quantity
-      });
-      fetchCart(); // Refresh cart
+      }, cartConfig());
+      setCart(response.data);
+      trackEvent(productId, 'add_to_cart');
       return true;
     } catch (error) {
       console.error('Error adding to cart:', error);
@@ -73,8 +88,8 @@ function App() {
 
   const removeFromCart = async (itemId) => {
     try {
-      await axios.delete(`${API}/cart/${itemId}`);
-      fetchCart(); // Refresh cart
+      const response = await axios.delete(`${API}/cart/${itemId}`, cartConfig());
+      setCart(response.data);
     } catch (error) {
       console.error('Error removing from cart:', error);
     }
@@ -82,8 +97,8 @@ function App() {
 
   const updateCartItem = async (itemId, quantity) => {
     try {
-      await axios.put(`${API}/cart/${itemId}?quantity=${quantity}`);
-      fetchCart(); // Refresh cart
+      const response = await axios.put(`${API}/cart/${itemId}?quantity=${quantity}`, null, cartConfig());
+      setCart(response.data);
     } catch (error) {
       console.error('Error updating cart item:', error);
     }
@@ -91,45 +106,35 @@ function App() {
 
   const clearCart = async () => {
     try {
-      await axios.delete(`${API}/cart`);
-      fetchCart(); // Refresh cart
+      const response = await axios.delete(`${API}/cart`, cartConfig());
+      setCart(response.data);
     } catch (error) {
       console.error('Error clearing cart:', error);
     }
   };
 
   const cartValue = {
-    items: cartItems,
+    // Lines, prices and totals are joined and computed server-side
+    items: cart.items,
     addToCart,
     removeFromCart,
     updateCartItem,
     clearCart,
-    itemCount: cartItems.reduce((sum, item) => sum + item.quantity, 0),
-    total: cartItems.reduce((sum, item) => {
-      const product = products.find(p => p.id === item.product_id);
-      return sum + (product ? product.price * item.quantity : 0);
-    }, 0)
+    itemCount: cart.item_count,
+    total: cart.subtotal,
+    savings: cart.savings
   };
 
-  if (loading) {
-    return (
-      <div className="loading-screen">
-        <div className="loading-spinner"></div>
-        <p>Loading beautiful products...</p>
-      </div>
-    );
-  }
-
   return (
     <CartContext.Provider value={cartValue}>
       <div className="App">
         <BrowserRouter>
           <Header />
           <Routes>
-            <Route path="/" element={<HomePage products={products} />} />
-            <Route path="/shop" element={<ShopPage products={products} />} />
-            <Route path="/product/:id" element={<ProductPage products={products} />} />
-            <Route path="/cart" element={<CartPage products={products} />} />
+            <Route path="/" element={<HomePage />} />
+            <Route path="/shop" element={<ShopPage />} />
+            <Route path="/product/:id" element={<ProductPage />} />
+            <Route path="/cart" element={<CartPage />} />
           </Routes>
           <Toaster position="top-right" />
         </BrowserRouter>
@@ -4,7 +4,7 @@ import { ArrowLeft, Plus, Minus, Trash2, ShoppingBag } from 'lucide-react';
 import { CartContext } from '../App';
 import { toast } from 'sonner';
 
-const CartPage = ({ products }) => {
+const CartPage = () => {
   const { items, removeFromCart, updateCartItem, clearCart, total } = useContext(CartContext);
 
   const handleQuantityChange = async (itemId, newQuantity) => {
@@ -44,14 +44,10 @@ const CartPage = ({ products }) => {
     );
   }
 
-  const cartItemsWithDetails = items.map(item => {
-    const product = products.find(p => p.id === item.product_id);
-    return { ...item, product };
-  }).filter(item => item.product);
+  // Cart lines arrive with their product details; skip products that no longer exist
+  const cartItemsWithDetails = items.filter(item => item.product);
 
-  const subtotal = cartItemsWithDetails.reduce((sum, item) => 
-    sum + (item.product.price * item.quantity), 0
-  );
+  const subtotal = total;
   const shipping = 0; // Free shipping
   const tax = subtotal * 0.08; // 8% tax
   const finalTotal = subtotal + shipping + tax;
@@ -1,20 +1,30 @@
-import React, { useState, useContext } from 'react';
+import React, { useState, useContext, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import { ArrowRight, Star, Truck, Shield, Leaf, Heart, Play, Sparkles, ShoppingBag } from 'lucide-react';
-import { CartContext } from '../App';
+import { CARD_IMAGE_SIZES, CartContext, imageSrcSet } from '../App';
 import { toast } from 'sonner';
 import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
-const HomePage = ({ products }) => {
+const HomePage = () => {
   const { addToCart } = useContext(CartContext);
   const [newsletterEmail, setNewsletterEmail] = useState('');
   const [isSubscribing, setIsSubscribing] = useState(false);
+  const [featuredProducts, setFeaturedProducts] = useState([]);
 
-  const featuredProducts = products.filter(product => product.is_featured).slice(0, 6);
-  const newProducts = products.filter(product => product.is_new).slice(0, 3);
+  useEffect(() => {
+    let cancelled = false;
+    axios.get(`${API}/products`, { params: { featured: true, view: 'summary', limit: 6 } })
+      .then(response => {
+        if (!cancelled) setFeaturedProducts(response.data);
+      })
+      .catch(error => console.error('Error fetching featured products:', error));
+    return () => {
+      cancelled = true;
+    };
+  }, []);
 
   const handleAddToCart = async (productId) => {
     const success = await addToCart(productId);
@@ -139,7 +149,7 @@ const HomePage = ({ products }) => {
             {featuredProducts.map((product) => (
               <div key={product.id} className="product-card" onClick={() => window.location.href = `/product/${product.id}`}>
                 <div className="product-image">
-                  <img src={product.image_url} alt={product.name} />
+                  <img src={product.image_url} srcSet={imageSrcSet(product) || undefined} sizes={CARD_IMAGE_SIZES} alt={product.name} loading="lazy" />
                   <div className="product-badges">
                     {product.is_viral && <span className="product-badge viral">Viral</span>}
                     {product.is_new && <span className="product-badge new">New</span>}
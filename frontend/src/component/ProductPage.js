@@ -1,17 +1,66 @@
-import React, { useState, useContext } from 'react';
+import React, { useState, useContext, useEffect } from 'react';
 import { useParams, Link } from 'react-router-dom';
 import { ArrowLeft, Star, ShoppingBag, Heart, Share2, Truck, Shield, RotateCcw } from 'lucide-react';
-import { CartContext } from '../App';
+import axios from 'axios';
+import { CARD_IMAGE_SIZES, CartContext, imageSrcSet, trackEvent } from '../App';
 import { toast } from 'sonner';
 
-const ProductPage = ({ products }) => {
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+const ProductPage = () => {
   const { id } = useParams();
   const { addToCart } = useContext(CartContext);
   const [quantity, setQuantity] = useState(1);
   const [selectedImage, setSelectedImage] = useState(0);
-  
-  const product = products.find(p => p.id === id);
-  
+  const [details, setDetails] = useState(null);
+  const [notFound, setNotFound] = useState(false);
+  const [similar, setSimilar] = useState(null);
+
+  useEffect(() => {
+    let cancelled = false;
+    setNotFound(false);
+    axios.get(`${API}/products/${id}`)
+      .then(response => {
+        if (!cancelled) setDetails(response.data);
+      })
+      .catch(error => {
+        if (cancelled) return;
+        if (error.response && error.response.status === 404) setNotFound(true);
+        else console.error('Error fetching product:', error);
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, [id]);
+
+  useEffect(() => {
+    trackEvent(id, 'view');
+  }, [id]);
+
+  useEffect(() => {
+    let cancelled = false;
+    setSimilar(null);
+    axios.get(`${API}/products/${id}/similar`, { params: { limit: 4 } })
+      .then(response => {
+        if (!cancelled) setSimilar(response.data);
+      })
+      .catch(error => console.error('Error fetching similar products:', error));
+    return () => {
+      cancelled = true;
+    };
+  }, [id]);
+
+  const product = details && details.id === id ? details : null;
+
+  if (!product && !notFound) {
+    return (
+      <div className="loading-screen">
+        <div className="loading-spinner"></div>
+      </div>
+    );
+  }
+
   if (!product) {
     return (
       <div className="product-not-found">
@@ -28,9 +77,8 @@ const ProductPage = ({ products }) => {
   }
 
   const images = product.images && product.images.length > 0 ? product.images : [product.image_url];
-  const relatedProducts = products.filter(p => 
-    p.category === product.category && p.id !== product.id
-  ).slice(0, 4);
+  // Ranked by shared ingredients, tags and skin types
+  const relatedProducts = similar || [];
 
   const handleAddToCart = async () => {
     const success = await addToCart(product.id, quantity);
@@ -235,7 +283,7 @@ const ProductPage = ({ products }) => {
               {relatedProducts.map((relatedProduct) => (
                 <Link key={relatedProduct.id} to={`/product/${relatedProduct.id}`} className="related-card">
                   <div className="related-image">
-                    <img src={relatedProduct.image_url} alt={relatedProduct.name} />
+                    <img src={relatedProduct.image_url} srcSet={imageSrcSet(relatedProduct) || undefined} sizes={CARD_IMAGE_SIZES} alt={relatedProduct.name} loading="lazy" />
                   </div>
                   <div className="related-info">
                     <h4>{relatedProduct.name}</h4>
@@ -1,14 +1,23 @@
 import React, { useState, useContext, useEffect } from 'react';
 import { useSearchParams } from 'react-router-dom';
 import { Search, Filter, Grid, List, Star, ShoppingBag } from 'lucide-react';
-import { CartContext } from '../App';
+import axios from 'axios';
+import { CARD_IMAGE_SIZES, CartContext, imageSrcSet } from '../App';
 import { toast } from 'sonner';
 
-const ShopPage = ({ products }) => {
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+// Cards per listing page; later pages are fetched by cursor as the shopper asks for them
+const PAGE_SIZE = 24;
+
+const ShopPage = () => {
   const [searchParams, setSearchParams] = useSearchParams();
   const { addToCart } = useContext(CartContext);
   
-  const [filteredProducts, setFilteredProducts] = useState(products);
+  const [listedProducts, setListedProducts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [filters, setFilters] = useState({
     category: searchParams.get('category') || '',
     skinType: '',
@@ -19,68 +28,75 @@ const ShopPage = ({ products }) => {
   const [sortBy, setSortBy] = useState('featured');
   const [viewMode, setViewMode] = useState('grid');
   const [showFilters, setShowFilters] = useState(false);
+  const [facets, setFacets] = useState(null);
 
-  useEffect(() => {
-    applyFilters();
-  }, [products, filters, sortBy]);
-
-  const applyFilters = () => {
-    let filtered = [...products];
-
-    // Search filter
-    if (filters.search) {
-      filtered = filtered.filter(product =>
-        product.name.toLowerCase().includes(filters.search.toLowerCase()) ||
-        product.description.toLowerCase().includes(filters.search.toLowerCase()) ||
-        product.short_description.toLowerCase().includes(filters.search.toLowerCase())
-      );
-    }
-
-    // Category filter
-    if (filters.category) {
-      filtered = filtered.filter(product => product.category === filters.category);
-    }
+  // The same filters go to the listing, the search and the sidebar counts
+  const filterParams = () => {
+    const params = {};
+    if (filters.category) params.category = filters.category;
+    if (filters.skinType) params.skin_type = filters.skinType;
+    if (filters.minPrice) params.min_price = filters.minPrice;
+    if (filters.maxPrice) params.max_price = filters.maxPrice;
+    return params;
+  };
 
-    // Skin type filter
-    if (filters.skinType) {
-      filtered = filtered.filter(product => 
-        product.skin_types.includes(filters.skinType)
-      );
-    }
+  // Filtering, sorting and paging all happen server-side; only the shown pages are fetched
+  useEffect(() => {
+    let cancelled = false;
+    const searching = Boolean(filters.search.trim());
+    // Search runs against the ranked index and arrives in relevance order, debounced per keystroke
+    const timer = setTimeout(async () => {
+      try {
+        const response = searching
+          ? await axios.get(`${API}/products/search`, { params: { ...filterParams(), q: filters.search, limit: 100 } })
+          : await axios.get(`${API}/products`, {
+            params: { ...filterParams(), sort: sortBy, view: 'summary', limit: PAGE_SIZE }
+          });
+        if (cancelled) return;
+        setListedProducts(response.data);
+        setNextCursor(searching ? null : response.headers['x-next-cursor'] || null);
+      } catch (error) {
+        console.error('Error fetching products:', error);
+      }
+    }, searching ? 200 : 0);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [filters, sortBy]);
 
-    // Price filter
-    if (filters.minPrice) {
-      filtered = filtered.filter(product => product.price >= parseFloat(filters.minPrice));
-    }
-    if (filters.maxPrice) {
-      filtered = filtered.filter(product => product.price <= parseFloat(filters.maxPrice));
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/products`, {
+        params: { ...filterParams(), sort: sortBy, view: 'summary', limit: PAGE_SIZE, cursor: nextCursor }
+      });
+      setListedProducts(listed => [...listed, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error fetching more products:', error);
+    } finally {
+      setLoadingMore(false);
     }
+  };
 
-    // Sort products
-    switch (sortBy) {
-      case 'price-low':
-        filtered.sort((a, b) => a.price - b.price);
-        break;
-      case 'price-high':
-        filtered.sort((a, b) => b.price - a.price);
-        break;
-      case 'rating':
-        filtered.sort((a, b) => b.rating - a.rating);
-        break;
-      case 'newest':
-        filtered.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
-        break;
-      case 'featured':
-      default:
-        filtered.sort((a, b) => {
-          if (a.is_featured && !b.is_featured) return -1;
-          if (!a.is_featured && b.is_featured) return 1;
-          return b.rating - a.rating;
-        });
-        break;
-    }
+  // Sidebar counts come from one cached aggregation instead of the full catalog
+  useEffect(() => {
+    let cancelled = false;
+    axios.get(`${API}/products/facets`, { params: filterParams() })
+      .then(response => {
+        if (!cancelled) setFacets(response.data);
+      })
+      .catch(error => console.error('Error fetching filter counts:', error));
+    return () => {
+      cancelled = true;
+    };
+  }, [filters.category, filters.skinType, filters.minPrice, filters.maxPrice]);
 
-    setFilteredProducts(filtered);
+  const facetCount = (group, value) => {
+    if (!facets) return null;
+    const entry = facets[group].find(item => item.value === value);
+    return <span className="filter-count">{entry ? entry.count : 0}</span>;
   };
 
   const handleFilterChange = (key, value) => {
@@ -137,7 +153,7 @@ const ShopPage = ({ products }) => {
           <div className="shop-title-section">
             <h1 className="shop-title">Beauty Collection</h1>
             <p className="shop-subtitle">
-              Discover {filteredProducts.length} products in our curated beauty collection
+              Discover {filters.search.trim() ? listedProducts.length : (facets ? facets.total : listedProducts.length)} products in our curated beauty collection
             </p>
           </div>
           
@@ -160,6 +176,7 @@ const ShopPage = ({ products }) => {
             >
               <option value="featured">Featured</option>
               <option value="newest">Newest</option>
+              <option value="trending">Trending</option>
               <option value="price-low">Price: Low to High</option>
               <option value="price-high">Price: High to Low</option>
               <option value="rating">Highest Rated</option>
@@ -221,7 +238,7 @@ const ShopPage = ({ products }) => {
                     checked={filters.category === 'skincare'}
                     onChange={(e) => handleFilterChange('category', e.target.value)}
                   />
-                  Skincare
+                  Skincare {facetCount('categories', 'skincare')}
                 </label>
                 <label className="filter-option">
                   <input
@@ -231,7 +248,7 @@ const ShopPage = ({ products }) => {
                     checked={filters.category === 'lips'}
                     onChange={(e) => handleFilterChange('category', e.target.value)}
                   />
-                  Lips
+                  Lips {facetCount('categories', 'lips')}
                 </label>
                 <label className="filter-option">
                   <input
@@ -241,7 +258,7 @@ const ShopPage = ({ products }) => {
                     checked={filters.category === 'eyes'}
                     onChange={(e) => handleFilterChange('category', e.target.value)}
                   />
-                  Eyes
+                  Eyes {facetCount('categories', 'eyes')}
                 </label>
                 <label className="filter-option">
                   <input
@@ -251,7 +268,7 @@ const ShopPage = ({ products }) => {
                     checked={filters.category === 'tools'}
                     onChange={(e) => handleFilterChange('category', e.target.value)}
                   />
-                  Tools
+                  Tools {facetCount('categories', 'tools')}
                 </label>
               </div>
             </div>
@@ -277,7 +294,7 @@ const ShopPage = ({ products }) => {
                     checked={filters.skinType === 'dry'}
                     onChange={(e) => handleFilterChange('skinType', e.target.value)}
                   />
-                  Dry
+                  Dry {facetCount('skin_types', 'dry')}
                 </label>
                 <label className="filter-option">
                   <input
@@ -287,7 +304,7 @@ const ShopPage = ({ products }) => {
                     checked={filters.skinType === 'oily'}
                     onChange={(e) => handleFilterChange('skinType', e.target.value)}
                   />
-                  Oily
+                  Oily {facetCount('skin_types', 'oily')}
                 </label>
                 <label className="filter-option">
                   <input
@@ -297,7 +314,7 @@ const ShopPage = ({ products }) => {
                     checked={filters.skinType === 'sensitive'}
                     onChange={(e) => handleFilterChange('skinType', e.target.value)}
                   />
-                  Sensitive
+                  Sensitive {facetCount('skin_types', 'sensitive')}
                 </label>
                 <label className="filter-option">
                   <input
@@ -307,7 +324,7 @@ const ShopPage = ({ products }) => {
                     checked={filters.skinType === 'combination'}
                     onChange={(e) => handleFilterChange('skinType', e.target.value)}
                   />
-                  Combination
+                  Combination {facetCount('skin_types', 'combination')}
                 </label>
               </div>
             </div>
@@ -336,7 +353,7 @@ const ShopPage = ({ products }) => {
 
           {/* Products Grid */}
           <div className="shop-main">
-            {filteredProducts.length === 0 ? (
+            {listedProducts.length === 0 ? (
               <div className="no-products">
                 <h3>No products found</h3>
                 <p>Try adjusting your filters or search terms.</p>
@@ -346,10 +363,10 @@ const ShopPage = ({ products }) => {
               </div>
             ) : (
               <div className={`products-grid ${viewMode}`}>
-                {filteredProducts.map((product) => (
+                {listedProducts.map((product) => (
                   <div key={product.id} className="product-card" onClick={() => window.location.href = `/product/${product.id}`}>
                     <div className="product-image">
-                      <img src={product.image_url} alt={product.name} />
+                      <img src={product.image_url} srcSet={imageSrcSet(product) || undefined} sizes={CARD_IMAGE_SIZES} alt={product.name} loading="lazy" />
                       <div className="product-badges">
                         {product.is_viral && <span className="product-badge viral">Viral</span>}
                         {product.is_new && <span className="product-badge new">New</span>}
@@ -401,6 +418,13 @@ const ShopPage = ({ products }) => {
                 ))}
               </div>
             )}
+            {nextCursor && (
+              <div className="load-more">
+                <button onClick={loadMore} disabled={loadingMore} className="cta-primary">
+                  {loadingMore ? 'Loading...' : 'Load More'}
+                </button>
+              </div>
+            )}
           </div>
         </div>
       </div>
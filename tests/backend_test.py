@@ -1,6 +1,8 @@
+import base64
 import requests
 import sys
 import json
+import uuid
 from datetime import datetime
 
 class BeautyDropshipAPITester:
@@ -10,11 +12,13 @@ class BeautyDropshipAPITester:
         self.tests_run = 0
         self.tests_passed = 0
         self.product_ids = []
+        # Carts are per session; keep one cart for the whole run
+        self.cart_id = str(uuid.uuid4())
 
     def run_test(self, name, method, endpoint, expected_status, data=None, params=None):
         """Run a single API test"""
         url = f"{self.api_url}/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', 'X-Cart-Id': self.cart_id}
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -94,6 +98,57 @@ class BeautyDropshipAPITester:
         """Test filtering products by price range"""
         return self.run_test("Get Products $20-$40", "GET", "products", 200, params={"min_price": 20, "max_price": 40})
 
+    def test_paginate_products(self):
+        """Test keyset pagination walks every product exactly once in sort order"""
+        success, full = self.run_test("Get Products by Price", "GET", "products", 200,
+                                      params={"sort": "price-low", "limit": 200})
+        if not success:
+            return False, {}
+
+        seen = []
+        params = {"sort": "price-low", "limit": 2}
+        while True:
+            url = f"{self.api_url}/products"
+            response = requests.get(url, params=params)
+            if response.status_code != 200:
+                print(f"❌ Page request failed - Status: {response.status_code}")
+                return False, {}
+            seen.extend(product["id"] for product in response.json())
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                break
+            params["cursor"] = next_cursor
+
+        if seen != [product["id"] for product in full]:
+            print("❌ Paged results differ from the unpaged listing")
+            return False, {}
+        print(f"   Walked {len(seen)} products in pages of 2")
+
+        return self.run_test("Get Products with Invalid Cursor", "GET", "products", 400, params={"cursor": "not-a-cursor"})
+
+    def test_search_products(self):
+        """Test ranked full-text search with prefix matching and filters"""
+        success, response = self.run_test("Search Products", "GET", "products/search", 200, params={"q": "vitamin"})
+        if not success:
+            return False, {}
+        if not response or "Vitamin" not in response[0].get("name", ""):
+            print("❌ Expected the vitamin C serum to rank first")
+            return False, {}
+
+        success, response = self.run_test("Search Products by Prefix", "GET", "products/search", 200, params={"q": "hyal"})
+        if not success or not response:
+            print("❌ Prefix search returned no products")
+            return False, {}
+
+        success, response = self.run_test("Search Products with Category", "GET", "products/search", 200,
+                                          params={"q": "oil", "category": "lips"})
+        if not success:
+            return False, {}
+        if any(product.get("category") != "lips" for product in response):
+            print("❌ Search ignored the category filter")
+            return False, {}
+        return True, response
+
     def test_get_single_product(self):
         """Test getting a single product by ID"""
         if not self.product_ids:
@@ -103,6 +158,213 @@ class BeautyDropshipAPITester:
         product_id = self.product_ids[0]
         return self.run_test("Get Single Product", "GET", f"products/{product_id}", 200)
 
+    def test_cache_stats(self):
+        """Test catalog cache counters are exposed and repeat reads hit the cache"""
+        success, before = self.run_test("Cache Stats", "GET", "cache/stats", 200)
+        if not success:
+            return False, {}
+        self.run_test("Get All Products (cached)", "GET", "products", 200)
+        success, after = self.run_test("Cache Stats After Read", "GET", "cache/stats", 200)
+        if not success:
+            return False, {}
+        if after.get("hits", 0) + after.get("misses", 0) <= before.get("hits", 0) + before.get("misses", 0):
+            print("❌ Cache counters did not move after a product read")
+            return False, {}
+        if after.get("coalescing", {}).get("calls", 0) < before.get("coalescing", {}).get("calls", 0):
+            print("❌ Read coalescing counters are missing")
+            return False, {}
+        return True, after
+
+    def test_metrics(self):
+        """Test the Prometheus endpoint reports per-route latency and Mongo command timings"""
+        self.run_test("Get Single Product (for metrics)", "GET", f"products/{self.product_ids[0]}", 200)
+        self.tests_run += 1
+        print(f"\n🔍 Testing Metrics...")
+        response = requests.get(f"{self.api_url}/metrics")
+        text = response.text if response.status_code == 200 else ""
+        expected = [
+            'http_request_duration_seconds_bucket{method="GET",route="/api/products/{product_id}",le="+Inf"}',
+            'mongo_command_duration_seconds_count{command="find",collection="products"}',
+            'catalog_cache_entries',
+        ]
+        missing = [series for series in expected if series not in text]
+        if missing:
+            print(f"❌ Failed - Missing series: {missing}")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - {len(text.splitlines())} metric lines")
+        return True
+
+    def test_product_facets(self):
+        """Test facet counts agree with the filtered listing, each facet ignoring its own filter"""
+        success, facets = self.run_test("Get Product Facets", "GET", "products/facets", 200,
+                                        params={"category": "skincare"})
+        if not success:
+            return False
+        _, products = self.run_test("Get Skincare Products", "GET", "products", 200,
+                                    params={"category": "skincare", "limit": 200})
+        counts = {entry['value']: entry['count'] for entry in facets['categories']}
+        if facets['total'] != len(products) or counts.get("skincare") != len(products):
+            print(f"❌ Facet counts {counts} (total {facets['total']}) don't match {len(products)} listed products")
+            return False
+        if len(counts) < 2:
+            print(f"❌ Category counts {counts} should still offer the other categories")
+            return False
+        if sum(bucket['count'] for bucket in facets['price_ranges']) != facets['total']:
+            print("❌ Price buckets don't add up to the total")
+            return False
+        return True
+
+    def test_product_projections(self):
+        """Test summary view and fields= projection return only the requested fields"""
+        success, summaries = self.run_test("Get Product Summaries", "GET", "products", 200, params={"view": "summary"})
+        if not success or not summaries or 'description' in summaries[0] or 'ingredients' in summaries[0]:
+            print("❌ Summary view returned full products")
+            return False
+        success, products = self.run_test("Get Projected Products", "GET", "products", 200,
+                                          params={"fields": "name,price", "sort": "price-low"})
+        if not success or any(set(product) != {"id", "name", "price"} for product in products):
+            print(f"❌ Unexpected projected fields: {sorted(products[0]) if products else []}")
+            return False
+        success, _ = self.run_test("Unknown Projection Field", "GET", "products", 400, params={"fields": "name,nope"})
+        return success
+
+    def test_export_products(self):
+        """Test streaming NDJSON export matches the listing and is compressed when asked"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Export Products...")
+        response = requests.get(f"{self.api_url}/products/export", params={"format": "ndjson", "category": "skincare"},
+                                headers={'Accept-Encoding': 'gzip'}, stream=True)
+        exported = [json.loads(line) for line in response.iter_lines() if line]
+        listed = requests.get(f"{self.api_url}/products", params={"category": "skincare", "limit": 200}).json()
+        if response.status_code != 200 or [p['id'] for p in exported] != [p['id'] for p in listed]:
+            print(f"❌ Failed - Export returned {len(exported)} products, listing {len(listed)}")
+            return False
+        if response.headers.get('Content-Encoding') != 'gzip':
+            print(f"❌ Failed - Expected a gzip response, got {response.headers.get('Content-Encoding')}")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - {len(exported)} products streamed")
+        return True
+
+    def test_similar_products(self):
+        """Test similar products exclude the product itself and respect the limit"""
+        if not self.product_ids:
+            print("❌ No product IDs available for similarity testing")
+            return False
+        product_id = self.product_ids[0]
+        success, similar = self.run_test("Get Similar Products", "GET", f"products/{product_id}/similar", 200,
+                                         params={"limit": 3})
+        if not success or not similar or len(similar) > 3 or any(p['id'] == product_id for p in similar):
+            print(f"❌ Unexpected similar products: {[p.get('id') for p in similar or []]}")
+            return False
+        success, _ = self.run_test("Similar for Missing Product", "GET", "products/invalid-id/similar", 404)
+        return success
+
+    def test_record_events(self):
+        """Test product events are accepted for the background flush and the trending sort is served"""
+        if not self.product_ids:
+            print("❌ No product IDs available for event testing")
+            return False
+        events = [{"product_id": self.product_ids[0], "type": "view"},
+                  {"product_id": self.product_ids[0], "type": "add_to_cart"}]
+        success, response = self.run_test("Record Product Events", "POST", "events", 202, data={"events": events})
+        if not success or response.get('accepted') != 2:
+            print(f"❌ Expected 2 accepted events, got {response}")
+            return False
+        success, _ = self.run_test("Reject Unknown Event Type", "POST", "events", 422,
+                                   data={"events": [{"product_id": self.product_ids[0], "type": "purchase"}]})
+        if not success:
+            return False
+        success, products = self.run_test("Get Trending Products", "GET", "products", 200, params={"sort": "trending"})
+        scores = [product.get('trending_score', 0) for product in products or []]
+        if not success or scores != sorted(scores, reverse=True):
+            print(f"❌ Trending listing is not ordered by score: {scores}")
+            return False
+        return True
+
+    def test_catalog_changes(self):
+        """Test the delta-sync change feed and conditional GETs on the product listing"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Catalog Changes...")
+        listing = requests.get(f"{self.api_url}/products", params={"view": "summary"})
+        version, etag = listing.headers.get('X-Catalog-Version'), listing.headers.get('ETag')
+        if listing.status_code != 200 or version is None or not etag:
+            print(f"❌ Failed - Listing is missing X-Catalog-Version or ETag: {dict(listing.headers)}")
+            return False
+        unchanged = requests.get(f"{self.api_url}/products", params={"view": "summary"},
+                                 headers={'If-None-Match': etag})
+        if unchanged.status_code != 304:
+            print(f"❌ Failed - Expected 304 for an unchanged listing, got {unchanged.status_code}")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - Catalog version {version}, 304 on revalidation")
+
+        success, changes = self.run_test("Get Catalog Changes", "GET", "products/changes", 200,
+                                         params={"since": version, "view": "summary"})
+        if not success or changes.get('resync') or changes.get('version', -1) < int(version):
+            print(f"❌ Unexpected change feed: {changes}")
+            return False
+        success, changes = self.run_test("Catalog Changes From The Future", "GET", "products/changes", 200,
+                                         params={"since": int(version) + 10 ** 9})
+        if not success or not changes.get('resync'):
+            print(f"❌ Expected a resync for an unknown version: {changes}")
+            return False
+        return True
+
+    def test_reprice_dry_run(self):
+        """Test a repricing dry run reports the diff without writing prices"""
+        rules = [{"markup": 2.5, "max_discount": 0.3}]
+        success, report = self.run_test("Reprice Dry Run", "POST", "pricing/reprice", 200, data={"rules": rules})
+        if not success or not report.get('dry_run') or report.get('written') != 0:
+            print(f"❌ Unexpected dry-run report: {report}")
+            return False
+        if any(round(change['new_price'] * 100) % 100 != 99 for change in report.get('changes', [])):
+            print(f"❌ Expected every new price to end in .99: {report['changes'][:5]}")
+            return False
+        success, _ = self.run_test("Reprice With Duplicate Rules", "POST", "pricing/reprice", 400,
+                                   data={"rules": rules + rules})
+        return success
+
+    def test_image_variants(self):
+        """Test an uploaded image gets lazily rendered, immutable-cached variants"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing Image Variants...")
+        pixel = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==")
+        upload = requests.post(f"{self.api_url}/images", files={'file': ('pixel.png', pixel, 'image/png')})
+        variants = upload.json().get('variants', []) if upload.status_code == 200 else []
+        if not variants:
+            print(f"❌ Failed - Upload returned {upload.status_code}: {upload.text[:200]}")
+            return False
+        url = variants[0]['url']
+        variant = requests.get(url if url.startswith('http') else f"{self.base_url}{url}")
+        if variant.status_code != 200 or 'immutable' not in variant.headers.get('Cache-Control', ''):
+            print(f"❌ Failed - Variant returned {variant.status_code} with {variant.headers.get('Cache-Control')}")
+            return False
+        rejected = requests.post(f"{self.api_url}/images", files={'file': ('notes.txt', b'not an image', 'text/plain')})
+        if rejected.status_code != 400:
+            print(f"❌ Failed - Expected 400 for a non-image upload, got {rejected.status_code}")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - {len(variants)} variants, {variant.headers.get('Content-Type')} served immutable")
+        return True
+
+    def test_batch_get_products(self):
+        """Test batch lookup keeps request order and reports misses"""
+        if len(self.product_ids) < 2:
+            print("❌ Not enough product IDs available for batch testing")
+            return False
+        ids = [self.product_ids[1], "invalid-id", self.product_ids[0]]
+        success, response = self.run_test("Batch Get Products", "GET", "products/batch", 200, params={"ids": ",".join(ids)})
+        if not success:
+            return False
+        returned = [product['id'] if product else None for product in response['products']]
+        if returned != [ids[0], None, ids[2]] or response['missing'] != ["invalid-id"]:
+            print(f"❌ Unexpected batch result: {returned}, missing {response['missing']}")
+            return False
+        success, response = self.run_test("Batch Get Products (POST)", "POST", "products/batch", 200, data={"ids": ids})
+        return success and response['missing'] == ["invalid-id"]
+
     def test_get_nonexistent_product(self):
         """Test getting a non-existent product"""
         return self.run_test("Get Non-existent Product", "GET", "products/nonexistent-id", 404)
@@ -128,7 +390,9 @@ class BeautyDropshipAPITester:
         if not success:
             return False
 
-        cart_item_id = response.get('id') if response else None
+        # Mutations return the full cart view
+        items = response.get('items', []) if response else []
+        cart_item_id = items[0].get('id') if items else None
         if not cart_item_id:
             print("❌ No cart item ID returned")
             return False
@@ -138,6 +402,15 @@ class BeautyDropshipAPITester:
         if not success:
             return False
 
+        # Cart view joins product details and totals server-side
+        success, response = self.run_test("Get Cart View", "GET", "cart/view", 200)
+        if not success:
+            return False
+        line = response['items'][0] if response.get('items') else {}
+        if not line.get('product') or response.get('subtotal') != line.get('line_total'):
+            print("❌ Cart view is missing product details or totals")
+            return False
+
         # Add same item again (should update quantity)
         success, response = self.run_test("Add Same Item Again", "POST", "cart", 200, 
                                         data={"product_id": product_id, "quantity": 1})
@@ -149,6 +422,15 @@ class BeautyDropshipAPITester:
                                         params={"quantity": 5})
         if not success:
             return False
+        if response.get('item_count') != 5:
+            print(f"❌ Expected 5 items after update, got {response.get('item_count')}")
+            return False
+
+        # Another session's cart must not see this item
+        other_cart = requests.get(f"{self.api_url}/cart", headers={'X-Cart-Id': str(uuid.uuid4())})
+        if other_cart.status_code != 200 or other_cart.json():
+            print("❌ Cart item leaked into another session's cart")
+            return False
 
         # Remove item from cart
         success, response = self.run_test("Remove from Cart", "DELETE", f"cart/{cart_item_id}", 200)
@@ -175,6 +457,17 @@ class BeautyDropshipAPITester:
         # Try to subscribe same email again (should fail)
         success, response = self.run_test("Duplicate Newsletter Subscription", "POST", "newsletter", 400, 
                                         data={"email": test_email})
+        if not success:
+            return False
+
+        # Emails are normalized, so a case variant is the same subscriber
+        success, response = self.run_test("Case-Variant Newsletter Subscription", "POST", "newsletter", 400,
+                                        data={"email": f"  {test_email.upper()} "})
+        if not success:
+            return False
+
+        success, response = self.run_test("Invalid Newsletter Email", "POST", "newsletter", 422,
+                                        data={"email": "not-an-email"})
         return success
 
     def test_create_product(self):
@@ -192,6 +485,117 @@ class BeautyDropshipAPITester:
         }
         return self.run_test("Create Product", "POST", "products", 200, data=new_product)
 
+    def test_import_products(self):
+        """Test streaming NDJSON import reports inserted rows and per-row errors"""
+        rows = [
+            {
+                "name": f"Imported Test Product {i}",
+                "description": "Imported through the bulk feed endpoint",
+                "short_description": "Imported product",
+                "price": 10 + i,
+                "category": "tools",
+                "skin_types": ["dry"],
+                "ingredients": ["Test Ingredient"],
+                "tags": ["Test"],
+                "image_url": "https://example.com/test.jpg"
+            }
+            for i in range(3)
+        ]
+        feed = "\n".join([json.dumps(row) for row in rows] + ['{"name": "missing fields"}'])
+
+        self.tests_run += 1
+        print(f"\n🔍 Testing Import Products...")
+        response = requests.post(f"{self.api_url}/products/import", data=feed.encode(),
+                                 headers={'Content-Type': 'application/x-ndjson'})
+        report = response.json() if response.status_code == 200 else {}
+        if report.get("inserted") != 3 or report.get("failed") != 1 or report["errors"][0]["row"] != 4:
+            print(f"❌ Failed - Unexpected import report: {response.text[:200]}")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - {report['inserted']} inserted, {report['failed']} failed, {report['rows_per_second']} rows/s")
+        return True
+
+    def test_sync_supplier_feed(self):
+        """Test feed sync inserts new SKUs, skips unchanged ones and updates only changed rows"""
+        token = uuid.uuid4().hex[:8]
+        supplier = f"test-supplier-{token}"
+        rows = [
+            {
+                "sku": f"SKU-{i}",
+                "name": f"Synced Test Product {token}x{i}",
+                "description": "Synced from a supplier feed",
+                "short_description": "Synced product",
+                "price": 20 + i,
+                "stock": 50,
+                "category": "skincare",
+                "skin_types": ["oily"],
+                "ingredients": ["Test Ingredient"],
+                "tags": ["Test"],
+                "image_url": "https://example.com/test.jpg"
+            }
+            for i in range(4)
+        ]
+
+        def sync(feed_rows):
+            feed = "\n".join(json.dumps(row) for row in feed_rows).encode()
+            response = requests.post(f"{self.api_url}/feeds/{supplier}/sync", data=feed,
+                                     headers={'Content-Type': 'application/x-ndjson'})
+            return response.json() if response.status_code == 200 else {}
+
+        self.tests_run += 1
+        print(f"\n🔍 Testing Sync Supplier Feed...")
+        first = sync(rows)
+        repeat = sync(rows)
+        rows[0]["price"] = 99.0
+        changed = sync(rows[:3])
+        if (first.get("inserted"), repeat.get("unchanged"), changed.get("updated"), changed.get("deleted")) != (4, 4, 1, 1):
+            print(f"❌ Failed - Unexpected sync reports: {first}, {repeat}, {changed}")
+            return False
+        # SKU-3 left the feed, so it is soft-deleted and must drop out of search
+        hits = requests.get(f"{self.api_url}/products/search", params={"q": f"{token}x3", "prefix": "false"}).json()
+        if any(hit.get("supplier_sku") == "SKU-3" and hit.get("supplier") == supplier for hit in hits):
+            print(f"❌ Failed - Search still returns the deleted product: {hits}")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - {changed['updated']} updated, {changed['unchanged']} unchanged, {changed['deleted']} deleted")
+        return True
+
+    def test_checkout_reservation(self):
+        """Test checkout reserves stock atomically and a release returns it"""
+        if not self.product_ids:
+            print("❌ No product IDs available for checkout testing")
+            return False
+
+        product_id = self.product_ids[0]
+        self.run_test("Clear Cart", "DELETE", "cart", 200)
+        success, before = self.run_test("Get Product Stock", "GET", f"products/{product_id}/stock", 200)
+        if not success:
+            return False
+        success, _ = self.run_test("Add to Cart", "POST", "cart", 200, data={"product_id": product_id, "quantity": 1})
+        if not success:
+            return False
+
+        success, reservation = self.run_test("Reserve Cart", "POST", "checkout/reserve", 200)
+        if not success:
+            return False
+        _, held = self.run_test("Get Reserved Stock", "GET", f"products/{product_id}/stock", 200)
+        if held.get('stock') != before['stock'] - 1:
+            print(f"❌ Expected stock {before['stock'] - 1} while reserved, got {held.get('stock')}")
+            return False
+
+        success, released = self.run_test("Release Reservation", "DELETE", f"checkout/{reservation['id']}", 200)
+        if not success or released.get('status') != "released":
+            return False
+        _, after = self.run_test("Get Released Stock", "GET", f"products/{product_id}/stock", 200)
+        if after.get('stock') != before['stock']:
+            print(f"❌ Expected stock {before['stock']} after release, got {after.get('stock')}")
+            return False
+
+        # A released reservation can't be confirmed
+        success, _ = self.run_test("Confirm Released Reservation", "POST", f"checkout/{reservation['id']}/confirm", 409)
+        self.run_test("Clear Cart", "DELETE", "cart", 200)
+        return success
+
 def main():
     print("🧪 Starting Beauty Dropship API Tests")
     print("=" * 50)
@@ -207,12 +611,28 @@ def main():
         ("Get Products by Category", tester.test_get_products_by_category),
         ("Get Products by Skin Type", tester.test_get_products_by_skin_type),
         ("Get Products by Price Range", tester.test_get_products_by_price_range),
+        ("Paginate Products", tester.test_paginate_products),
+        ("Search Products", tester.test_search_products),
         ("Get Single Product", tester.test_get_single_product),
         ("Get Non-existent Product", tester.test_get_nonexistent_product),
+        ("Batch Get Products", tester.test_batch_get_products),
+        ("Similar Products", tester.test_similar_products),
+        ("Product Events", tester.test_record_events),
+        ("Catalog Changes", tester.test_catalog_changes),
+        ("Reprice Dry Run", tester.test_reprice_dry_run),
+        ("Image Variants", tester.test_image_variants),
+        ("Product Facets", tester.test_product_facets),
+        ("Export Products", tester.test_export_products),
+        ("Product Projections", tester.test_product_projections),
+        ("Cache Stats", tester.test_cache_stats),
+        ("Metrics", tester.test_metrics),
         ("Cart Operations", tester.test_cart_operations),
         ("Cart with Invalid Product", tester.test_cart_with_invalid_product),
+        ("Checkout Reservation", tester.test_checkout_reservation),
         ("Newsletter Subscription", tester.test_newsletter_subscription),
         ("Create Product", tester.test_create_product),
+        ("Import Products", tester.test_import_products),
+        ("Sync Supplier Feed", tester.test_sync_supplier_feed),
     ]
     
     failed_tests = []
@@ -0,0 +1,132 @@
+"""Synthetic catalog shaped like the ``initialize_products`` samples.
+
+Names, descriptions, ingredients, tags and prices are drawn from per-category
+vocabularies with a seeded RNG, so a given ``(count, seed)`` always produces
+the same catalog. Featured, new and viral flags, ratings and price spreads
+follow roughly the proportions of the sample products.
+
+Also writes NDJSON feeds for the bulk import endpoint:
+
+    python tests/benchmarks/catalog_generator.py 100000 catalog.ndjson --seed 7
+"""
+import argparse
+import json
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "backend"))
+
+from models import Product, ProductCreate  # noqa: E402
+
+SKIN_TYPES = ["dry", "oily", "sensitive", "combination"]
+TAGS = ["Vegan", "Cruelty-Free", "Paraben-Free", "Fragrance-Free", "Dermatologist-Tested", "Anti-Aging",
+        "Eco-Friendly", "Long-Lasting", "Hydrating", "Organic", "Reef-Safe", "Non-Comedogenic"]
+INGREDIENTS = ["Vitamin C", "Hyaluronic Acid", "Vitamin E", "Aloe Vera", "Niacinamide", "Ceramides", "Retinol",
+               "Jojoba Oil", "Squalane", "Peptides", "Caffeine", "Shea Butter", "Green Tea Extract", "Rosehip Oil",
+               "Salicylic Acid", "Glycerin", "Beeswax", "Rose Quartz", "Jade Stone", "Bamboo Charcoal"]
+BENEFITS = ["Brightens skin", "Reduces dark spots", "Anti-aging", "Hydrating", "Soothes redness", "Long-wearing",
+            "Smooths texture", "Reduces puffiness", "Strengthens barrier", "Non-drying"]
+
+CATEGORIES = {
+    "skincare": {
+        "adjectives": ["Radiant", "Pure", "Gentle", "Glow", "Dewy", "Calming", "Renewing", "Velvet", "Daily"],
+        "products": ["Vitamin C Serum", "Face Moisturizer", "Cleansing Oil", "Night Cream", "Toner", "Face Mask",
+                     "Sunscreen SPF 50", "Essence", "Exfoliating Peel"],
+        "price": (12.0, 79.0),
+        "share": 0.45,
+    },
+    "lips": {
+        "adjectives": ["Velvet", "Glossy", "Matte", "Plump", "Tinted", "Silk", "Berry"],
+        "products": ["Lip Tint", "Lip Balm", "Lip Oil", "Lipstick", "Lip Liner", "Lip Mask"],
+        "price": (8.0, 38.0),
+        "share": 0.2,
+    },
+    "eyes": {
+        "adjectives": ["Brightening", "Bold", "Lifting", "Smoky", "Wide Awake", "Feather"],
+        "products": ["Eye Cream", "Mascara", "Eyeliner", "Eyeshadow Palette", "Brow Gel", "Under-Eye Patches"],
+        "price": (10.0, 65.0),
+        "share": 0.2,
+    },
+    "tools": {
+        "adjectives": ["Jade", "Rose Quartz", "Sonic", "Bamboo", "Gold", "Ionic"],
+        "products": ["Facial Roller", "Gua Sha", "Cleansing Brush", "Makeup Sponge", "Brush Set", "Derma Roller"],
+        "price": (9.0, 120.0),
+        "share": 0.15,
+    },
+}
+CATEGORY_NAMES = list(CATEGORIES)
+CATEGORY_WEIGHTS = [CATEGORIES[name]["share"] for name in CATEGORY_NAMES]
+
+
+def generate_product_fields(rng, index):
+    """One product's ``ProductCreate`` fields plus rating and review count."""
+    category = rng.choices(CATEGORY_NAMES, CATEGORY_WEIGHTS)[0]
+    vocabulary = CATEGORIES[category]
+    adjective = rng.choice(vocabulary["adjectives"])
+    kind = rng.choice(vocabulary["products"])
+    ingredients = rng.sample(INGREDIENTS, rng.randint(2, 5))
+    low, high = vocabulary["price"]
+    price = round(rng.uniform(low, high), 0) - 0.01
+    on_sale = rng.random() < 0.35
+    return {
+        "name": f"{adjective} {kind} {index}",
+        "description": (
+            f"A {adjective.lower()} {kind.lower()} formulated with {', '.join(ingredients[:-1])} and "
+            f"{ingredients[-1]}. Designed for everyday use and suitable for most skin types, it layers "
+            f"well with the rest of your routine."
+        ),
+        "short_description": f"{adjective} {kind.lower()} with {ingredients[0]}",
+        "price": price,
+        "original_price": round(price * rng.uniform(1.15, 1.6), 2) if on_sale else None,
+        "category": category,
+        "skin_types": rng.sample(SKIN_TYPES, rng.randint(1, 4)),
+        "ingredients": ingredients,
+        "tags": rng.sample(TAGS, rng.randint(1, 4)),
+        "image_url": f"https://images.example.com/products/{index}.jpg",
+        "is_featured": rng.random() < 0.15,
+        "is_new": rng.random() < 0.2,
+        "is_viral": rng.random() < 0.1,
+        "benefits": rng.sample(BENEFITS, rng.randint(2, 4)),
+        "how_to_use": f"Apply the {kind.lower()} to clean skin as part of your routine.",
+        "rating": round(rng.triangular(3.5, 5.0, 4.7), 1),
+        "review_count": int(rng.paretovariate(1.2) * 20),
+    }
+
+
+def generate_products(count, seed=0, start=None):
+    """Yield ``count`` product documents (``Product.dict()``), deterministic for a given seed."""
+    rng = random.Random(seed)
+    start = start or datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for index in range(count):
+        fields = generate_product_fields(rng, index)
+        rating, review_count = fields.pop("rating"), fields.pop("review_count")
+        product = Product(
+            **ProductCreate(**fields).dict(),
+            id=str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            rating=rating,
+            review_count=review_count,
+            stock=1_000_000,
+            created_at=start + timedelta(minutes=index),
+        )
+        yield product.dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic catalog as an NDJSON import feed")
+    parser.add_argument("count", type=int, help="number of products")
+    parser.add_argument("path", help="output NDJSON file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    create_fields = set(ProductCreate.model_fields)
+    with open(args.path, "w") as feed:
+        for product in generate_products(args.count, args.seed):
+            row = {field: value for field, value in product.items() if field in create_fields}
+            feed.write(json.dumps(row) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""In-process load benchmark for the API.
+
+Seeds a scratch database with a synthetic catalog, drives the FastAPI app
+through ``httpx.ASGITransport`` (no network, no uvicorn), and reports
+per-route p50/p95/p99 latency and requests per second.
+
+Two backends:
+
+* ``mongod`` (default): the ``MONGO_URL`` from ``backend/.env`` or the
+  environment, using a ``<DB_NAME>_bench`` database that is dropped afterwards.
+* ``memory``: ``mongomock_motor``, an in-memory Motor stand-in. It needs no
+  server, which suits quick comparisons, but it plans no indexes, so its
+  numbers don't track production.
+
+Save a baseline, then diff later runs against it (exit status 1 on a
+regression beyond ``--tolerance``):
+
+    python tests/benchmarks/run_benchmarks.py --products 10000 --mix mixed --save baseline.json
+    python tests/benchmarks/run_benchmarks.py --products 10000 --mix mixed --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[2] / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from dotenv import load_dotenv  # noqa: E402
+
+from catalog_generator import generate_products  # noqa: E402
+
+SEED_BATCH_SIZE = 10_000
+PERCENTILES = (50, 95, 99)
+
+
+# Workload operations. Each takes (client, state) and times every request it makes with ``timed``.
+
+async def browse(client, state):
+    sort = state.rng.choice(["featured", "newest", "price-low", "price-high", "rating"])
+    response = await timed(state, "GET /products (browse)", client.get(
+        "/api/products", params={"view": "summary", "sort": sort, "limit": 24}))
+    next_cursor = response.headers.get("x-next-cursor")
+    if next_cursor and state.rng.random() < 0.3:
+        await timed(state, "GET /products (next page)", client.get(
+            "/api/products", params={"view": "summary", "sort": sort, "limit": 24, "cursor": next_cursor}))
+
+
+async def filter_listing(client, state):
+    params = {"view": "summary", "limit": 24}
+    params["category"] = state.rng.choice(["skincare", "lips", "eyes", "tools"])
+    if state.rng.random() < 0.5:
+        params["skin_type"] = state.rng.choice(["dry", "oily", "sensitive", "combination"])
+    if state.rng.random() < 0.4:
+        params["max_price"] = state.rng.choice([15, 25, 50])
+    await timed(state, "GET /products/facets", client.get("/api/products/facets", params=params))
+    await timed(state, "GET /products (filter)", client.get("/api/products", params=params))
+
+
+async def product_detail(client, state):
+    # Skewed towards a small hot set, like a catalog with a few viral products
+    if state.rng.random() < 0.7:
+        product_id = state.rng.choice(state.hot_ids)
+    else:
+        product_id = state.rng.choice(state.product_ids)
+    await timed(state, "GET /products/{id}", client.get(f"/api/products/{product_id}"))
+
+
+async def search(client, state):
+    query = state.rng.choice(["serum", "lip", "vitamin c", "eye cream", "roller", "matte", "hydra"])
+    await timed(state, "GET /products/search", client.get("/api/products/search", params={"q": query}))
+
+
+async def cart_churn(client, state):
+    headers = {"X-Cart-Id": state.rng.choice(state.cart_ids)}
+    product_id = state.rng.choice(state.product_ids)
+    view = await timed(state, "POST /cart", client.post(
+        "/api/cart", json={"product_id": product_id, "quantity": 1}, headers=headers))
+    items = view.json().get("items", []) if view.status_code == 200 else []
+    if items and state.rng.random() < 0.5:
+        line = state.rng.choice(items)
+        await timed(state, "PUT /cart/{id}", client.put(
+            f"/api/cart/{line['id']}", params={"quantity": state.rng.randint(1, 3)}, headers=headers))
+    if len(items) > 5:
+        await timed(state, "DELETE /cart/{id}", client.delete(f"/api/cart/{items[0]['id']}", headers=headers))
+    await timed(state, "GET /cart/view", client.get("/api/cart/view", headers=headers))
+
+
+async def newsletter_signup(client, state):
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    await timed(state, "POST /newsletter", client.post("/api/newsletter", json={"email": email}))
+
+
+MIXES = {
+    "browse": [(browse, 60), (filter_listing, 25), (product_detail, 15)],
+    "detail": [(product_detail, 90), (browse, 10)],
+    "cart": [(cart_churn, 70), (product_detail, 30)],
+    "newsletter-burst": [(newsletter_signup, 90), (browse, 10)],
+    "mixed": [(browse, 30), (filter_listing, 15), (product_detail, 30), (search, 10), (cart_churn, 12),
+              (newsletter_signup, 3)],
+}
+
+
+class RunState:
+    def __init__(self, rng, product_ids, carts):
+        self.rng = rng
+        self.product_ids = product_ids
+        self.hot_ids = product_ids[:max(1, len(product_ids) // 1000)]
+        self.cart_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(carts)]
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = True
+
+
+async def timed(state, label, request):
+    """Await ``request`` and record its latency under ``label`` (outside warm-up)."""
+    started = time.perf_counter()
+    response = await request
+    if state.recording:
+        state.latencies[label].append(time.perf_counter() - started)
+        if response.status_code >= 500 or response.status_code in (400, 422):
+            state.errors[label] += 1
+    return response
+
+
+async def drive(client, state, schedule, concurrency):
+    """Run the scheduled operations on ``concurrency`` concurrent workers."""
+    remaining = iter(schedule)
+
+    async def worker():
+        for operation in remaining:
+            await operation(client, state)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+def summarize(state, elapsed):
+    routes = {}
+    for label, values in sorted(state.latencies.items()):
+        values.sort()
+        routes[label] = {
+            "requests": len(values),
+            "errors": state.errors[label],
+            "requests_per_second": round(len(values) / elapsed, 1),
+            **{f"p{pct}_ms": round(percentile(values, pct) * 1000, 3) for pct in PERCENTILES},
+        }
+    return routes
+
+
+def configure_backend(backend):
+    """Point the app at a scratch database; must run before ``server`` is imported."""
+    load_dotenv(BACKEND_DIR / ".env")
+    os.environ["DB_NAME"] = f"{os.environ.get('DB_NAME', 'beauty')}_bench"
+    if backend == "memory":
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        try:
+            import mongomock_motor
+        except ImportError:
+            raise SystemExit("--backend memory needs mongomock-motor (pip install -r backend/requirements.txt)")
+        import motor.motor_asyncio
+
+        class InMemoryMotorClient(mongomock_motor.AsyncMongoMockClient):
+            def __init__(self, *args, **kwargs):
+                super().__init__()
+
+        motor.motor_asyncio.AsyncIOMotorClient = InMemoryMotorClient
+
+
+async def seed(server, backend, products, seed_value):
+    await server.client.drop_database(os.environ["DB_NAME"])
+    if backend == "mongod":
+        # mongomock ignores partial index filters, so the SKU index would reject SKU-less products
+        await server.create_indexes()
+    product_ids = []
+    batch = []
+    for product in generate_products(products, seed_value):
+        product_ids.append(product["id"])
+        batch.append(product)
+        if len(batch) >= SEED_BATCH_SIZE:
+            await server.db.products.insert_many(batch)
+            batch = []
+    if batch:
+        await server.db.products.insert_many(batch)
+    await server.build_search_index()
+    return product_ids
+
+
+async def run(args):
+    configure_backend(args.backend)
+    import httpx
+    import server
+
+    seeding_started = time.perf_counter()
+    product_ids = await seed(server, args.backend, args.products, args.seed)
+    seed_seconds = time.perf_counter() - seeding_started
+    print(f"Seeded {len(product_ids)} products in {seed_seconds:.1f}s ({args.backend})")
+
+    rng = random.Random(args.seed)
+    state = RunState(rng, product_ids, args.carts)
+    operations, weights = zip(*MIXES[args.mix])
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        # Warm-up fills caches and connection pools and isn't measured
+        state.recording = False
+        await drive(client, state, rng.choices(operations, weights, k=args.warmup), args.concurrency)
+        state.recording = True
+        started = time.perf_counter()
+        await drive(client, state, rng.choices(operations, weights, k=args.requests), args.concurrency)
+        elapsed = time.perf_counter() - started
+
+    try:
+        if args.backend == "mongod":
+            await server.client.drop_database(os.environ["DB_NAME"])
+    finally:
+        server.client.close()
+
+    total = sum(len(values) for values in state.latencies.values())
+    return {
+        "meta": {
+            "backend": args.backend,
+            "mix": args.mix,
+            "products": args.products,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "elapsed_seconds": round(elapsed, 3),
+            "requests_per_second": round(total / elapsed, 1) if elapsed else 0.0,
+        },
+        "routes": summarize(state, elapsed),
+    }
+
+
+def print_report(result):
+    meta = result["meta"]
+    print(f"\n{meta['mix']} mix, {meta['products']} products, concurrency {meta['concurrency']}: "
+          f"{meta['requests_per_second']} req/s overall")
+    print(f"{'route':<28}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, stats in result["routes"].items():
+        print(f"{label:<28}{stats['requests']:>9}{stats['errors']:>8}{stats['requests_per_second']:>9}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+
+def compare(result, baseline, tolerance):
+    """Return the regressions of ``result`` against ``baseline`` as readable lines."""
+    regressions = []
+    for label, before in baseline["routes"].items():
+        after = result["routes"].get(label)
+        if after is None:
+            continue
+        if after["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {before['p95_ms']}ms -> {after['p95_ms']}ms")
+        if after["requests_per_second"] < before["requests_per_second"] * (1 - tolerance):
+            regressions.append(f"{label}: {before['requests_per_second']} -> {after['requests_per_second']} req/s")
+        if after["errors"] > before["errors"]:
+            regressions.append(f"{label}: errors {before['errors']} -> {after['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API in-process against a synthetic catalog")
+    parser.add_argument("--backend", choices=("mongod", "memory"), default="mongod")
+    parser.add_argument("--products", type=int, default=1000, help="synthetic catalog size (1k to 1M)")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed", help="workload mix")
+    parser.add_argument("--requests", type=int, default=2000, help="measured operations")
+    parser.add_argument("--warmup", type=int, default=200, help="unmeasured operations run first")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--carts", type=int, default=200, help="distinct cart sessions for cart churn")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to diff against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative p95/throughput regression")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.save:
+        Path(args.save).write_text(json.dumps(result, indent=2) + "\n")
+        print(f"\nBaseline saved to {args.save}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,86 @@
+"""Contention benchmark: many concurrent checkouts on one hot SKU.
+
+Seeds a single product in a scratch database, then runs ``--workers``
+concurrent tasks that each reserve one unit at a time until stock runs out,
+and reports reservations per second. The run is repeated for every
+``--shards`` value (0 = a single stock counter on the product document) so
+the sharded counters can be compared with the plain document. Every run
+checks that exactly the seeded stock was handed out.
+
+    python tests/benchmarks/stock_contention.py --stock 20000 --workers 200 --shards 0 8 32
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "backend"))
+
+from dotenv import load_dotenv  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+import inventory  # noqa: E402
+from indexes import ensure_indexes  # noqa: E402
+
+load_dotenv(Path(__file__).resolve().parents[2] / "backend" / ".env")
+
+PRODUCT_ID = "hot-sku"
+
+
+async def run_once(db, stock, workers, shards):
+    await db.products.delete_many({"id": PRODUCT_ID})
+    await db.stock_shards.delete_many({"product_id": PRODUCT_ID})
+    await db.reservations.delete_many({})
+    await db.products.insert_one({"id": PRODUCT_ID, "stock": stock, "stock_shards": 0, "is_viral": True})
+    if shards:
+        await inventory.shard_stock(db, PRODUCT_ID, shards)
+
+    item = {"product_id": PRODUCT_ID, "quantity": 1, "stock_shards": shards}
+    reserved = 0
+    sold_out = 0
+
+    async def worker():
+        nonlocal reserved, sold_out
+        while True:
+            try:
+                await inventory.reserve(db, [item], ttl_seconds=600)
+            except inventory.OutOfStock:
+                sold_out += 1
+                return
+            reserved += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    elapsed = time.perf_counter() - started
+
+    remaining = await inventory.available_stock(db, PRODUCT_ID, shards)
+    if reserved != stock or remaining != 0:
+        raise AssertionError(f"Oversold or lost stock: reserved {reserved}, remaining {remaining}, seeded {stock}")
+    return {"shards": shards, "reserved": reserved, "seconds": round(elapsed, 3),
+            "reservations_per_second": round(reserved / elapsed, 1)}
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True, maxPoolSize=args.pool_size)
+    db_name = f"{os.environ['DB_NAME']}_stock_bench"
+    db = client[db_name]
+    try:
+        await ensure_indexes(db)
+        for shards in args.shards:
+            result = await run_once(db, args.stock, args.workers, shards)
+            print(f"shards={result['shards']:>3}  reserved={result['reserved']}  "
+                  f"time={result['seconds']}s  throughput={result['reservations_per_second']}/s")
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark concurrent stock reservations on one hot SKU")
+    parser.add_argument("--stock", type=int, default=5000, help="units seeded on the hot product")
+    parser.add_argument("--workers", type=int, default=100, help="concurrent checkout tasks")
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 8], help="shard counts to compare (0 = unsharded)")
+    parser.add_argument("--pool-size", type=int, default=100, help="Motor connection pool size")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,57 @@
+"""In-process tests for the catalog read cache in backend/cache.py."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import cache  # noqa: E402
+from cache import MISSING, CatalogCache  # noqa: E402
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_evicts_least_recently_used(clock):
+    catalog_cache = CatalogCache(max_entries=2)
+    catalog_cache.set("a", 1)
+    catalog_cache.set("b", 2)
+    assert catalog_cache.get("a") == 1  # "b" is now the least recently used
+    catalog_cache.set("c", 3)
+    assert catalog_cache.get("b") is MISSING
+    assert (catalog_cache.get("a"), catalog_cache.get("c")) == (1, 3)
+    assert catalog_cache.evictions == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    catalog_cache = CatalogCache(ttl=60.0)
+    catalog_cache.set("listing", [1, 2])
+    clock[0] += 59.9
+    assert catalog_cache.get("listing") == [1, 2]
+    clock[0] += 0.1
+    assert catalog_cache.get("listing") is MISSING
+    assert (catalog_cache.expirations, len(catalog_cache)) == (1, 0)
+
+
+def test_bump_drops_every_entry(clock):
+    catalog_cache = CatalogCache()
+    catalog_cache.set("a", 1)
+    catalog_cache.set("b", 2)
+    assert catalog_cache.bump() == 1
+    assert len(catalog_cache) == 0
+    assert catalog_cache.get("a") is MISSING
+
+
+def test_value_loaded_across_a_bump_is_not_stored(clock):
+    catalog_cache = CatalogCache()
+    version = catalog_cache.version
+    catalog_cache.bump()  # a write lands while the load is in flight
+    catalog_cache.set("listing", "stale", version)
+    assert catalog_cache.get("listing") is MISSING
+    catalog_cache.set("listing", "fresh", catalog_cache.version)
+    assert catalog_cache.get("listing") == "fresh"
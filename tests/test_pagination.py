@@ -0,0 +1,61 @@
+"""In-process tests for keyset cursors in backend/pagination.py.
+
+Pages are read from an in-memory mongomock collection, which orders values
+of different types the way MongoDB does. Skipped when mongomock isn't
+installed.
+"""
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from pagination import SORT_SPECS, TYPE_ORDER, _type_name, decode_cursor, encode_cursor, keyset_filter  # noqa: E402
+
+mongomock = pytest.importorskip("mongomock")
+
+# Two values of every type in TYPE_ORDER, plus documents missing the field
+MIXED_VALUES = [None, None, 2, 7.5, "2024-01-01", "2024-06-01", False, True,
+                datetime(2024, 1, 1), datetime(2024, 6, 1)]
+
+
+def collection_with(field, values):
+    collection = mongomock.MongoClient().db.products
+    documents = [{"id": f"p{index:02d}", field: value} for index, value in enumerate(values)]
+    documents += [{"id": "p90"}, {"id": "p91"}]
+    collection.insert_many(documents)
+    return collection
+
+
+def page_through(collection, sort, limit):
+    seen, cursor = [], None
+    while True:
+        query = keyset_filter(sort, decode_cursor(sort, cursor)) if cursor else {}
+        page = list(collection.find(query).sort(SORT_SPECS[sort]).limit(limit + 1))
+        seen += [document["id"] for document in page[:limit]]
+        if len(page) <= limit:
+            return seen
+        cursor = encode_cursor(sort, page[limit - 1])
+
+
+def test_mixed_values_cover_every_type():
+    assert {_type_name(value) for value in MIXED_VALUES} == set(TYPE_ORDER)
+
+
+@pytest.mark.parametrize("sort, field", [("newest", "created_at"), ("price-low", "price"), ("price-high", "price")])
+@pytest.mark.parametrize("limit", [1, 2, 3])
+def test_pages_cross_every_type_boundary(sort, field, limit):
+    collection = collection_with(field, MIXED_VALUES)
+    expected = [document["id"] for document in collection.find().sort(SORT_SPECS[sort])]
+    assert page_through(collection, sort, limit) == expected
+
+
+def test_null_cursor_value_only_matches_later_types():
+    branches = keyset_filter("price-low", [None, "p90"])["$or"]
+    # Nothing sorts between two nulls, so the first key only continues into the later types
+    assert {"price": {"$gt": None}} not in branches
+    assert [branch for branch in branches if "id" not in branch] == [
+        {"price": {"$type": type_name}} for type_name in TYPE_ORDER[1:]
+    ]
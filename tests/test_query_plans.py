@@ -0,0 +1,119 @@
+"""Verify that every query shape issued by the API routes is served by an index.
+
+Runs against the MongoDB in backend/.env, using a throwaway database seeded
+with the sample catalog. Each shape is explained and the test fails if any
+winning plan contains a COLLSCAN stage. Skipped when no server is reachable.
+"""
+import asyncio
+import itertools
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from facets import facet_pipeline  # noqa: E402
+from feed_sync import supplier_query  # noqa: E402
+from indexes import ensure_indexes  # noqa: E402
+from pagination import SORT_SPECS, keyset_filter  # noqa: E402
+
+PLAN_CHECK_DB = f"{server.os.environ['DB_NAME']}_plan_check"
+
+
+def product_listing_shapes(sample):
+    """Every filter combination get_products can build, under every sort, with and without a cursor."""
+    filter_values = {
+        "category": [None, "skincare"],
+        "skin_type": [None, "dry"],
+        "featured": [None, True],
+        "new": [None, True],
+        "min_price": [None, 20.0],
+        "max_price": [None, 40.0],
+    }
+    for combination in itertools.product(*filter_values.values()):
+        query = server.build_product_query(**dict(zip(filter_values, combination)))
+        for sort in SORT_SPECS:
+            name = f"products.find({query}, sort={sort})"
+            yield name, "products", query, SORT_SPECS[sort]
+            cursor_values = [sample.get(field) for field, _ in SORT_SPECS[sort]]
+            keyset = keyset_filter(sort, cursor_values)
+            paged = {"$and": [query, keyset]} if query else keyset
+            yield f"{name} after cursor", "products", paged, SORT_SPECS[sort]
+
+
+def route_shapes(sample):
+    yield "get_product", "products", {"id": sample["id"], "deleted_at": None}, None
+    yield "sync_feed hash load", "products", supplier_query("acme"), None
+    yield "lookup_products", "products", {"id": {"$in": [sample["id"], "missing-id"]}, "deleted_at": None}, None
+    yield "search_products", "products", {"id": {"$in": [sample["id"]]}, "deleted_at": None}, None
+    for category, skin_type, min_price, featured in itertools.product(
+            [None, sample["category"]], [None, "dry"], [None, 20.0], [None, True]):
+        facet_query = server.build_product_query(category=category, skin_type=skin_type, min_price=min_price,
+                                                 featured=featured)
+        yield f"get_product_facets $match {facet_query}", "products", facet_pipeline(facet_query)[0]["$match"], None
+    yield "get/clear cart", "cart", {"cart_id": "cart-id"}, None
+    yield "add_to_cart upsert", "cart", {"cart_id": "cart-id", "product_id": sample["id"]}, None
+    yield "update/remove cart item", "cart", {"id": "cart-item-id", "cart_id": "cart-id"}, None
+    yield "cart updated_at backfill", "cart", {"updated_at": {"$exists": False}}, None
+    yield "reserve/release/confirm", "reservations", {"id": "reservation-id", "status": "pending"}, None
+    yield "reservation sweep", "reservations", {"status": "pending", "expires_at": {"$lte": sample["created_at"]}}, None
+    yield "sharded stock take", "stock_shards", {"product_id": sample["id"], "shard": 0, "stock": {"$gte": 1}}, None
+    yield "trending score backfill", "products", {"trending_score": None}, None
+    yield "auto-viral top trending", "products", {"trending_score": {"$gte": 1.0}, "deleted_at": None}, SORT_SPECS["trending"]
+    yield "auto-viral flagged", "products", {"is_viral": True}, None
+    yield "event rollup upsert", "product_event_counts", {"product_id": sample["id"], "hour": sample["created_at"]}, None
+    yield "catalog changes", "catalog_changes", {"version": {"$gt": 0}}, [("version", 1)]
+    yield "repricing guarded write", "products", {"id": sample["id"], "price": sample["price"], "deleted_at": None}, None
+    yield "catalog changes compaction", "catalog_changes", {"at": {"$lt": sample["created_at"]}}, [("at", -1), ("version", -1)]
+
+
+def find_collscans(plan):
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(find_collscans(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(find_collscans(value) for value in plan)
+    return False
+
+
+async def collect_collscans():
+    test_client = server.AsyncIOMotorClient(server.mongo_url, serverSelectionTimeoutMS=2000)
+    try:
+        await test_client.admin.command("ping")
+    except Exception:
+        test_client.close()
+        return None
+
+    test_db = test_client[PLAN_CHECK_DB]
+    await test_client.drop_database(PLAN_CHECK_DB)
+    original_db, server.db = server.db, test_db
+    # Seeding logs catalog changes; keep them in the throwaway database too
+    server.changelog.db = test_db
+    try:
+        await ensure_indexes(test_db)
+        await server.initialize_products()
+        sample = await test_db.products.find_one({}, sort=SORT_SPECS["featured"])
+
+        offenders = []
+        for name, collection, query, sort in itertools.chain(product_listing_shapes(sample), route_shapes(sample)):
+            find = test_db[collection].find(query)
+            if sort:
+                find = find.sort(sort)
+            explanation = await find.explain()
+            if find_collscans(explanation["queryPlanner"]["winningPlan"]):
+                offenders.append(name)
+        return offenders
+    finally:
+        server.db = server.changelog.db = original_db
+        await test_client.drop_database(PLAN_CHECK_DB)
+        test_client.close()
+
+
+def test_no_route_query_plans_a_collscan():
+    offenders = asyncio.run(collect_collscans())
+    if offenders is None:
+        pytest.skip(f"MongoDB not reachable at {server.mongo_url}")
+    assert not offenders, "Query shapes planned as COLLSCAN:\n" + "\n".join(offenders)
@@ -0,0 +1,91 @@
+"""In-process tests for request coalescing in backend/singleflight.py."""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from singleflight import SingleFlight  # noqa: E402
+
+
+def test_concurrent_callers_share_one_load():
+    async def scenario():
+        flight = SingleFlight()
+        loads = 0
+
+        async def load():
+            nonlocal loads
+            loads += 1
+            await asyncio.sleep(0.01)
+            return {"products": loads}
+
+        results = await asyncio.gather(*[flight.do("viral", load) for _ in range(10)])
+        return flight, loads, results
+
+    flight, loads, results = asyncio.run(scenario())
+    assert loads == 1
+    assert all(result is results[0] for result in results)
+    assert (flight.executions, flight.coalesced, len(flight)) == (1, 9, 0)
+
+
+def test_error_reaches_every_waiter_and_clears_the_key():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("mongo down")
+
+        outcomes = await asyncio.gather(*[flight.do("key", failing) for _ in range(3)], return_exceptions=True)
+
+        async def load():
+            return "fresh"
+
+        return flight, outcomes, await flight.do("key", load)
+
+    flight, outcomes, retried = asyncio.run(scenario())
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+    assert flight.errors == 1
+    assert retried == "fresh"
+
+
+def test_timeout_cancels_the_load_for_every_waiter():
+    async def scenario():
+        flight = SingleFlight(timeout=0.01)
+        cancelled = asyncio.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        outcomes = await asyncio.gather(*[flight.do("key", slow) for _ in range(3)], return_exceptions=True)
+        return flight, outcomes, cancelled.is_set()
+
+    flight, outcomes, cancelled = asyncio.run(scenario())
+    assert all(isinstance(outcome, asyncio.TimeoutError) for outcome in outcomes)
+    assert cancelled
+    assert (flight.timeouts, len(flight)) == (1, 0)
+
+
+def test_cancelled_waiter_leaves_the_load_running():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def load():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("key", load))
+        second = asyncio.ensure_future(flight.do("key", load))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "done"